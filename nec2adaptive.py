@@ -0,0 +1,180 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Adaptive frequency sweeps. Instead of solving at every step of a linear FR card, solve at a few coarse
+frequencies, fit a rational function to the impedance (the AAA algorithm, which handles the poles near
+resonances that polynomials can't), and keep adding frequencies where successive fits disagree most and
+around the SWR minimum until the fit stops moving. The fit then gives a dense SWR curve for the price of
+a handful of solves.
+
+Every sample frequency is rounded to what an FR card's 13.5E field can hold, so sampleList() describes
+exactly the frequencies that were solved.
+
+Usage:
+
+  sweep = nec2adaptive.adaptiveSweep(model, 145.5, 147.5)
+  mhz, impedance, swr = sweep.dense(401)
+  sweep.solves, sweep.minimum()
+'''
+
+import numpy
+
+import nec2solver
+from nec2utils import frequencyPoints, sci
+
+
+# =======================================================================================================
+# Rational interpolation
+# =======================================================================================================
+
+class RationalFit:
+	def __init__(self, x, f, tolerance=1e-12, maxDegree=None):
+		''' AAA rational approximation of samples f at points x (Nakatsukasa, Sete and Trefethen, 2018): a
+			barycentric rational function through a greedily chosen subset of the samples, with weights that
+			least squares fit the rest. Stops adding support points once every sample is matched to tolerance
+			(relative to the largest |f|).
+		'''
+		x = numpy.asarray(x, dtype=float)
+		f = numpy.asarray(f, dtype=complex)
+		self.center, self.halfWidth = 0.5 * (x.max() + x.min()), 0.5 * (x.max() - x.min()) or 1.0
+		z = (x - self.center) / self.halfWidth
+		maxSupport = (len(x) + 1) // 2 if maxDegree is None else maxDegree + 1
+		rest = numpy.ones(len(x), dtype=bool)
+		support = []
+		approximation = numpy.full(len(x), f.mean())
+		for m in range(maxSupport):
+			j = numpy.argmax(numpy.where(rest, numpy.abs(f - approximation), -1.0))
+			support.append(j)
+			rest[j] = False
+			zj, fj = z[support], f[support]
+			C = 1.0 / (z[rest, None] - zj[None, :])
+			loewner = (f[rest, None] - fj[None, :]) * C
+			w = numpy.linalg.svd(loewner, full_matrices=True)[2][-1].conj() if rest.any() else numpy.ones(len(support))
+			approximation = f.copy()
+			approximation[rest] = C.dot(w * fj) / C.dot(w)
+			if numpy.abs(f - approximation).max() <= tolerance * numpy.abs(f).max():
+				break
+		self.z, self.f, self.w = zj, fj, w
+
+	def __call__(self, x):
+		''' Evaluate the fit at points x
+		'''
+		x = numpy.atleast_1d(numpy.asarray(x, dtype=float))
+		z = (x - self.center) / self.halfWidth
+		difference = z[:, None] - self.z[None, :]
+		exact = difference == 0.0
+		difference[exact] = 1.0
+		C = 1.0 / difference
+		values = C.dot(self.w * self.f) / C.dot(self.w)
+		row, column = numpy.nonzero(exact)
+		values[row] = self.f[column]
+		return values
+
+
+# =======================================================================================================
+# Adaptive sweep
+# =======================================================================================================
+
+class AdaptiveSweep:
+	def __init__(self, frequencies, impedance, fit, z0, solves, converged):
+		''' Result of an adaptive sweep: the frequencies actually solved (sorted) and their impedances, the
+			rational fit through them, and whether the fit converged before the solve budget ran out
+		'''
+		self.frequencies = frequencies
+		self.impedance   = impedance
+		self.fit         = fit
+		self.z0          = z0
+		self.solves      = solves
+		self.converged   = converged
+
+	def interpolate(self, mhz):
+		''' Return the interpolated impedance at frequencies mhz
+		'''
+		return self.fit(mhz)
+
+	def swr(self, mhz):
+		return nec2solver.swr(self.fit(mhz), self.z0)
+
+	def dense(self, count=401):
+		''' Return (frequencies, impedance, SWR) at count evenly spaced frequencies across the sweep
+		'''
+		mhz = numpy.linspace(self.frequencies[0], self.frequencies[-1], count)
+		impedance = self.fit(mhz)
+		return mhz, impedance, nec2solver.swr(impedance, self.z0)
+
+	def minimum(self, count=4001):
+		''' Return (frequency, SWR) at the interpolated SWR minimum
+		'''
+		mhz, impedance, swr = self.dense(count)
+		i = numpy.argmin(swr)
+		return mhz[i], swr[i]
+
+	def sampleList(self):
+		''' Return the solved frequencies as a nec2utils.FrequencyList, for a deck that runs exactly them
+		'''
+		return frequencyPoints(self.frequencies)
+
+
+def _cardValue(mhz):
+	''' Round a frequency to the 6 significant digits an FR card field holds
+	'''
+	return float(sci(mhz))
+
+
+def adaptiveSweep(model, low, high, z0=50.0, tolerance=1e-3, initial=9, batch=4, maxSolves=60, evaluate=None):
+	''' Sample the model's input impedance adaptively between low and high MHz. Start with initial evenly
+		spaced solves, then each round fit the samples, compare the fit with the previous round's on a fine
+		grid, and solve at up to batch frequencies where they disagree most (plus the SWR minimum), until the
+		reflection coefficients of the two fits agree to tolerance everywhere or maxSolves is reached.
+		evaluate(frequencies) -> impedances replaces nec2solver if given, e.g. to run an external engine.
+	'''
+	if evaluate is None:
+		solver = nec2solver.Solver(model)
+		evaluate = lambda mhz: solver.solve(mhz, z0).impedance
+	grid = numpy.linspace(low, high, 2001)
+	reflection = lambda impedance: (impedance - z0) / (impedance + z0)
+	spacing = max((high - low) / 1000.0, 1e-5 * max(abs(low), abs(high)))  # closest allowed sample spacing
+
+	samples = {}
+	def solveAt(mhz):
+		mhz = sorted(set(_cardValue(f) for f in mhz) - set(samples))
+		if mhz:
+			for f, z in zip(mhz, evaluate(numpy.array(mhz))):
+				samples[f] = complex(z)
+		return len(mhz)
+
+	solveAt(numpy.linspace(low, high, max(initial, 3)))
+	previous, converged = None, False
+	while True:
+		x = numpy.array(sorted(samples))
+		values = numpy.array([samples[f] for f in x])
+		fit = RationalFit(x, values)
+		current = reflection(fit(grid))
+		if previous is None:
+			error = numpy.abs(current - reflection(numpy.interp(grid, x, values)))  # first round: versus straight lines
+		else:
+			error = numpy.abs(current - previous)
+			if error.max() <= tolerance:
+				converged = True
+				break
+		if len(samples) >= maxSolves:
+			break
+		previous = current
+
+		# New samples: the biggest disagreements, each at least a sample spacing from the others
+		picks = []
+		for i in numpy.argsort(-error):
+			if len(picks) >= batch or error[i] <= tolerance:
+				break
+			f = grid[i]
+			if numpy.abs(x - f).min() > spacing and all(abs(p - f) > (high - low) / (4.0 * batch) for p in picks):
+				picks.append(f)
+		best = grid[numpy.argmin(numpy.abs(current))]  # the SWR minimum is where |reflection| is smallest
+		if numpy.abs(x - best).min() > spacing:
+			picks.append(best)
+		if not solveAt(picks[:max(maxSolves - len(samples), 0)]):
+			break
+	x = numpy.array(sorted(samples))
+	impedance = numpy.array([samples[f] for f in x])
+	return AdaptiveSweep(x, impedance, RationalFit(x, impedance), z0, len(samples), converged)
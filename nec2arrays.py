@@ -0,0 +1,133 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Procedural yagis and arrays. Rather than placing every element's end points by hand and adding them one
+at a time, give the element lengths and boom positions of a yagi, or one element and the steps between
+copies of it for a linear or planar array, and the element coordinates are worked out as numpy arrays and
+added to a Model in one block.
+
+Where elements are identical and evenly spaced, a single GW card plus a GM card that replicates it (its
+NRPT field) is written instead of a GW card per element, so a deck for a 1000 element array is a few
+lines long and nec2 expands it while reading. The replicated elements still get tags of their own. A GM
+card copies everything after the first wire it names, and Model writes its GM cards after all of its
+wires, so only the last elements of a model can be replicated and nothing can be added after them.
+
+Usage:
+
+  m = Model(inch(1.0/16.0))
+  tags = nec2arrays.addYagi(m, lengths, nec2arrays.boomPositions(spacings), 21, driven=1, height=Z0)
+
+  m = Model(0.001)
+  tags = nec2arrays.addArray(m, 11, Point(0.5, 0, 0), Point(-0.5, 0, 0), 32, Point(0, 0.6, 0),
+                             rows=32, rowStep=Point(0, 0, 0.6), feed=0)
+'''
+
+import math
+
+import numpy
+
+from nec2utils import AUTO, Point
+
+
+SAME_TOLERANCE = 1e-9  # Lengths and spacings within this fraction of each other count as identical
+
+
+# =======================================================================================================
+# Element positions
+# =======================================================================================================
+
+def boomPositions(spacings, start=0.0):
+	''' Return the position along the boom of each element, given the spacing from each one to the next
+	'''
+	return start + numpy.r_[0.0, numpy.cumsum(numpy.asarray(spacings, dtype=float))]
+
+
+def gridOffsets(columns, columnStep, rows=1, rowStep=None):
+	''' Return the (rows * columns, 3) offsets of the elements of a planar array from the first one, row
+		by row, with columnStep and rowStep the (x, y, z) steps along a row and from one row to the next
+	'''
+	column = numpy.arange(columns)[None, :, None] * numpy.asarray(columnStep, dtype=float)
+	row = numpy.arange(rows)[:, None, None] * numpy.asarray(rowStep if rowStep is not None else (0.0, 0.0, 0.0), dtype=float)
+	return (row + column).reshape(-1, 3)
+
+
+def trailingRun(lengths, positions, counts=None, tolerance=SAME_TOLERANCE):
+	''' Return the index of the first of the last run of elements that have the same length (and segment
+		count, if counts are given) and the same spacing from one to the next (len(lengths) - 1 when the
+		last two differ)
+	'''
+	lengths, positions = numpy.asarray(lengths, dtype=float), numpy.asarray(positions, dtype=float)
+	if len(lengths) < 2:
+		return 0
+	gaps = numpy.diff(positions)
+	scale = max(numpy.abs(lengths).max(), numpy.abs(gaps).max(), 1e-300)
+	same = numpy.abs(numpy.diff(lengths)) <= tolerance * scale
+	if counts is not None:
+		same &= numpy.array([a == b for a, b in zip(counts[:-1], counts[1:])], dtype=bool)
+	even = numpy.r_[True, numpy.abs(numpy.diff(gaps)) <= tolerance * scale]
+	different = numpy.nonzero(~(same & even))[0]
+	return int(different[-1]) + 1 if len(different) else 0
+
+
+def _point(p):
+	return numpy.array([p.x, p.y, p.z]) if isinstance(p, Point) else numpy.asarray(p, dtype=float)
+
+
+# =======================================================================================================
+# Builders
+# =======================================================================================================
+
+def addYagi(model, lengths, positions, segments, driven=1, height=0.0, replicate=True):
+	''' Add a yagi's elements to a model: straight wires of the given lengths parallel to the X axis and
+		centered on a boom along the Y axis at the given positions, height above the XY plane, in order from
+		the reflector. segments is a count for every element, a list of them, or AUTO. The driven element
+		(an index into lengths) is fed at its middle segment. With replicate, a run of identical, evenly
+		spaced elements at the end is written as one element and a GM card that copies it. Returns the
+		tag of each element.
+	'''
+	lengths = numpy.asarray(lengths, dtype=float)
+	positions = numpy.asarray(positions, dtype=float)
+	if len(positions) != len(lengths):
+		raise ValueError("a yagi needs a position for each of its {} elements".format(len(lengths)))
+	counts = [segments] * len(lengths) if numpy.ndim(segments) == 0 else list(segments)
+	starts = numpy.stack([0.5 * lengths, positions, numpy.full(len(lengths), float(height))], axis=1)
+	ends = starts * (-1.0, 1.0, 1.0)
+
+	# Copies of the first element of the run at the end, past the driven element, stand in for the rest of
+	# it when that saves cards (a run of three or more)
+	first = max(trailingRun(lengths, positions, counts), driven + 1) if replicate else len(lengths)
+	copies = len(lengths) - first - 1 if len(lengths) - first >= 3 else 0
+	tags = numpy.arange(model.tag + 1, model.tag + 1 + len(lengths))
+	for k in range(len(lengths) - copies):
+		model.addWire(counts[k], Point(*starts[k]), Point(*ends[k]))
+		if k == driven:
+			model.feedAtMiddle()
+	if copies:
+		model.replicate(copies, translate=Point(0.0, positions[first + 1] - positions[first], 0.0))
+	return tags
+
+
+def addArray(model, segments, pt1, pt2, columns, columnStep, rows=1, rowStep=None, feed=None, replicate=True):
+	''' Add a linear or planar array of identical elements to a model: the wire from pt1 to pt2, copied
+		along a row of columns elements columnStep apart (a Point), and that row copied rows times rowStep
+		apart. Elements are tagged row by row. feed is the index of the element (in tag order) whose middle
+		segment gets the EX card, if any. With replicate the deck holds one GW card and a GM card per
+		direction; without, a GW card per element. Returns the tag of each element, as a rows x columns
+		array.
+	'''
+	columnStep, rowStep = _point(columnStep), _point(rowStep) if rowStep is not None else numpy.zeros(3)
+	tags = (model.tag + 1 + numpy.arange(rows * columns)).reshape(rows, columns)
+	if replicate and rows * columns > 1:
+		model.addWire(segments, pt1, pt2)
+		if columns > 1:
+			model.replicate(columns - 1, translate=Point(*columnStep), tagIncrement=1)
+		if rows > 1:
+			model.replicate(rows - 1, translate=Point(*rowStep), firstTag=int(tags[0, 0]), tagIncrement=columns)
+	else:
+		offsets = gridOffsets(columns, columnStep, rows, rowStep)
+		model.addWires(segments, _point(pt1) + offsets, _point(pt2) + offsets)
+	if feed is not None:
+		model.EX_tag     = int(tags.ravel()[feed])
+		model.EX_segment = math.trunc(model.getCard(int(tags[0, 0]))[1][1]/2) + 1
+	return tags
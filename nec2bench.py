@@ -0,0 +1,290 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Benchmark suite. Times each stage of the pipeline (building a Model; rendering its cards the way the
+original Model did, with cardLine(), and with the bulk formatter; getText(); writing the deck to a file;
+parsing it back; and solving it) on synthetic models of 10 to 100k wires and arcs and on the two 2m models that ship with
+the project. Results are saved as JSON, tagged with the git commit, so runs from different commits can
+be compared. Everything runs locally; no network or external NEC engine needed.
+
+Run from the console:
+
+  $ python nec2bench.py                               # full suite, results in nec2bench.json
+  $ python nec2bench.py --sizes 10,1000 --output new.json --compare nec2bench.json
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+from nec2utils import *
+import nec2cache
+import nec2deck
+import nec2geometry
+import nec2solver
+
+
+SIZES = (10, 100, 1000, 10000, 100000)  # Wire counts of the synthetic models
+SHIPPED_MODELS = ('2m-fd-fed-yagi.py', os.path.join('2m-folded-dipole', '2m-folded-dipole.py'))
+SOLVE_SEGMENTS = 1000  # Only models with at most this many segments are solved
+SWEEP = (146.0, 0.1, 11)  # FR card used for getText() and friends
+FORMAT_VERSION = 1
+
+
+# =======================================================================================================
+# Synthetic models
+# =======================================================================================================
+
+def syntheticModel(wireCount):
+	''' Return a model with a row of wireCount parallel wires, every tenth one followed by an arc, fed at
+		the middle of the first wire
+	'''
+	model = Model(inch(1.0/16.0))
+	for i in range(wireCount):
+		y = inch(5.0) * i
+		model.addWire(21, Point(-0.5, y, 1.0), Point(0.5, y, 1.0))
+		if i == 0:
+			model.feedAtMiddle()
+		if i % 10 == 9:
+			model.addArc(15, inch(0.5), deg(90), deg(270), Rotation(deg(0), deg(0), deg(0)), Point(-0.5, y, 1.0))
+	return model
+
+
+def shippedModel(script):
+	''' Run one of the shipped model scripts in a scratch directory (they write their deck to the current
+		directory and echo it) and return its Model
+	'''
+	script = os.path.abspath(script)
+	scratch = tempfile.mkdtemp(prefix='nec2bench')
+	cwd = os.getcwd()
+	try:
+		os.chdir(scratch)
+		with contextlib.redirect_stdout(io.StringIO()):
+			return runpy.run_path(script)['m']
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bestTime(function, repeat=3):
+	''' Return the fastest wall clock time in seconds out of repeat calls to function
+	'''
+	best = None
+	for i in range(repeat):
+		t0 = time.time()
+		function()
+		elapsed = time.time() - t0
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+
+# =======================================================================================================
+# The original per-field card string building, the baseline for cardLine() and the bulk formatter
+# =======================================================================================================
+
+# Copies of sci(), dec() and the gw(), ga() and gm() methods as they were before the column store, when
+# Model built every card field by field as it was added and appended it to one growing string. They are
+# the baseline the other formatting stages are measured against, so leave them as they are.
+
+def _sci(f):
+	return '{: > 13.5E}'.format(f)
+
+
+def _dec(i):
+	return '{: >6d}'.format(math.trunc(i))
+
+
+def _gw(tag, segments, x1, y1, z1, x2, y2, z2, radius):
+	gw = "GW" + _dec(tag) + _dec(segments)
+	gw += _sci(x1) + _sci(y1) + _sci(z1)
+	gw += _sci(x2) + _sci(y2) + _sci(z2)
+	gw += _sci(radius) + "\n"
+	return gw
+
+
+def _ga(tag, segments, arcRadius, startAngle, endAngle, wireRadius):
+	notUsed = 0.0
+	ga = "GA" + _dec(tag) + _dec(segments)
+	ga += _sci(arcRadius) + _sci(startAngle) + _sci(endAngle)
+	ga += _sci(wireRadius)
+	ga += _sci(notUsed)
+	ga += _sci(notUsed) + _sci(notUsed) + "\n"
+	return ga
+
+
+def _gm(rotX, rotY, rotZ, trX, trY, trZ, firstTag, tagIncrement=0, newStructures=0):
+	gm = "GM" + _dec(tagIncrement) + _dec(newStructures)
+	gm += _sci(rotX) + _sci(rotY) + _sci(rotZ)
+	gm += _sci(trX) + _sci(trY) + _sci(trZ)
+	gm += _sci(firstTag*1.0) + "\n"
+	return gm
+
+
+def originalCards(store):
+	''' Return the text of a CardStore's GW/GA/GM cards built the original way, with the copies of gw(),
+		ga() and gm() above appending one line at a time to a string
+	'''
+	text = ""
+	for name, ints, floats in store:
+		if name == 'GW':
+			text += _gw(ints[0], ints[1], *floats)
+		elif name == 'GA':
+			text += _ga(ints[0], ints[1], *floats[:4])
+		elif name == 'GM':
+			text += _gm(*(tuple(floats) + tuple(ints)))
+		else:
+			text += cardLine(name, ints, floats)
+	return text
+
+
+# =======================================================================================================
+# Suite
+# =======================================================================================================
+
+def benchModel(name, build, repeat=3, solve=True):
+	''' Time every stage for the model build() returns and return a list of result dicts, one per stage
+	'''
+	results = []
+	model = build()
+	wires = sum(1 for card in model.wires if card[0] == 'GW')
+	arcs  = len(model.wires) - wires
+	segments = len(nec2geometry.compileGeometry(model))
+	record = lambda stage, seconds, size=None: results.append({'model': name, 'wires': wires, 'arcs': arcs,
+		'cards': len(model.wires) + len(model.transforms), 'segments': segments, 'stage': stage,
+		'seconds': seconds, 'bytes': size})
+
+	record('construct', bestTime(build, repeat))
+	text = model.getText(*SWEEP)
+	record('getText', bestTime(lambda: model.getText(*SWEEP), repeat), len(text))
+	store = model.wires
+	ints, floats = store.columns()
+	original = lambda: originalCards(store)
+	perField = lambda: ''.join([cardLine(*card) for card in store])
+	bulk     = lambda: formatCards(store.names, ints, floats)
+	if original() != bulk() or perField() != bulk():
+		raise AssertionError("formatCards() output differs from the original gw()/ga()/gm() cards or cardLine()")
+	record('originalCards', bestTime(original, repeat))
+	record('cardLine', bestTime(perField, repeat))
+	record('formatCards', bestTime(bulk, repeat))
+
+	scratch = tempfile.mkdtemp(prefix='nec2bench')
+	try:
+		fileName = os.path.join(scratch, 'bench.nec')
+		comments = 'CM benchmark\nCE'
+		record('writeCardsToFile', bestTime(lambda: writeCardsToFile(fileName, comments, model.getText(*SWEEP)), repeat),
+		       os.path.getsize(fileName))
+		record('writeModelToFile', bestTime(lambda: writeModelToFile(fileName, comments, model, *SWEEP), repeat))
+		record('parseDeck', bestTime(lambda: nec2deck.parseDeck(text), repeat))
+		record('readDeck', bestTime(lambda: nec2deck.readDeck(fileName), repeat))
+	finally:
+		shutil.rmtree(scratch, ignore_errors=True)
+
+	if solve and segments <= SOLVE_SEGMENTS:
+		cache = nec2cache.activeCache()
+		nec2cache.disable()  # time the solver, not the cache
+		try:
+			record('solve', bestTime(lambda: nec2solver.solve(model, SWEEP[0], 0.0, 1), repeat))
+			record('solveSweep', bestTime(lambda: nec2solver.solve(model, *SWEEP), repeat))
+		finally:
+			if cache is not None:
+				nec2cache.enable(cache.directory, cache.maxBytes, cache.maxEntries)
+	return results
+
+
+def runSuite(sizes=SIZES, repeat=3, solve=True, shipped=True, log=None):
+	''' Run the suite and return its JSON-ready dict. log(text) is called as each model finishes.
+	'''
+	here = os.path.dirname(os.path.abspath(__file__))
+	models = [('synthetic-{}'.format(n), (lambda n=n: syntheticModel(n))) for n in sizes]
+	if shipped:
+		for script in SHIPPED_MODELS:
+			path = os.path.join(here, script)
+			if os.path.exists(path):
+				models.append((os.path.basename(script)[:-3], (lambda path=path: shippedModel(path))))
+	results = []
+	for name, build in models:
+		results += benchModel(name, build, repeat, solve)
+		if log is not None:
+			log(formatResults([r for r in results if r['model'] == name]))
+	return {'version': FORMAT_VERSION, 'commit': gitCommit(here), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+	        'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(),
+	        'repeat': repeat, 'results': results}
+
+
+def gitCommit(directory):
+	''' Return the commit the working tree is at (with a + if it has uncommitted changes), or None
+	'''
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory,
+		                                 stderr=subprocess.DEVNULL).decode('ascii').strip()
+		dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=directory, stderr=subprocess.DEVNULL)
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	return commit + ('+' if dirty else '')
+
+
+# =======================================================================================================
+# Reports
+# =======================================================================================================
+
+def formatResults(results):
+	''' Return results as a text table
+	'''
+	lines = []
+	for r in results:
+		size = '' if r['bytes'] is None else '{:,} bytes'.format(r['bytes'])
+		lines.append('{: <22}{: >9} cards {: <18}{: >12.2f} ms  {}\n'.format(r['model'], r['cards'], r['stage'],
+		             r['seconds'] * 1000.0, size))
+	return ''.join(lines)
+
+
+def compareResults(baseline, current):
+	''' Return a text table of the stages two suite runs have in common, with the ratio of their times
+		(above 1 means current is slower)
+	'''
+	old = dict(((r['model'], r['stage']), r['seconds']) for r in baseline['results'])
+	lines = ['{} -> {}\n'.format(baseline.get('commit'), current.get('commit'))]
+	for r in current['results']:
+		key = (r['model'], r['stage'])
+		if key in old and old[key] > 0.0:
+			lines.append('{: <22}{: <18}{: >12.2f} ms{: >12.2f} ms{: >8.2f}x\n'.format(key[0], key[1],
+			             old[key] * 1000.0, r['seconds'] * 1000.0, r['seconds'] / old[key]))
+	return ''.join(lines)
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Time model generation, formatting, parsing and solving.')
+	parser.add_argument('--sizes', default=','.join(str(n) for n in SIZES),
+	                    help='comma separated wire counts of the synthetic models')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the fastest is kept')
+	parser.add_argument('--output', default='nec2bench.json', help='JSON file for the results')
+	parser.add_argument('--compare', help='earlier JSON results to compare against')
+	parser.add_argument('--no-solve', dest='solve', action='store_false', help='skip the solver stages')
+	parser.add_argument('--no-shipped', dest='shipped', action='store_false', help='skip the shipped 2m models')
+	args = parser.parse_args(argv)
+	sizes = [int(n) for n in args.sizes.split(',') if n]
+	suite = runSuite(sizes, args.repeat, args.solve, args.shipped, sys.stdout.write)
+	with open(args.output, 'w') as f:
+		json.dump(suite, f, indent=1)
+	sys.stdout.write('Results written to {}\n'.format(args.output))
+	if args.compare:
+		with open(args.compare) as f:
+			sys.stdout.write(compareResults(json.load(f), suite))
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
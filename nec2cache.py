@@ -0,0 +1,204 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Content addressed cache of simulation results. Results are filed under a hash of the deck's cards with
+the comments left out and the fields put in canonical form, so decks that differ only in their CM lines
+(or in how a hand written deck spaces its fields) share an entry. Each entry is a .npz file of arrays;
+a small SQLite index keeps track of their sizes and when they were last used, so the cache can throw
+out the least recently used entries once it grows past its size or entry limit.
+
+nec2solver.solve() and nec2runner.runJob() check the active cache before doing any work. The cache is off
+until enable() is called or the NEC2_CACHE_DIR environment variable names a directory for it.
+
+Usage:
+
+  nec2cache.enable('~/.nec2cache', maxBytes=2 << 30)
+  nec2solver.solve(model, 145.5, 0.05, 40)   # solved and cached
+  nec2solver.solve(model, 145.5, 0.05, 40)   # straight from the cache
+'''
+
+import contextlib
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy
+
+
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GB
+
+
+# =======================================================================================================
+# Keys
+# =======================================================================================================
+
+def canonicalText(text):
+	''' Return the cards of a deck without its CM/CE comments, every card re-rendered in the fixed column
+		layout nec2utils writes
+	'''
+	from nec2deck import parseDeck
+	deck = parseDeck(text)
+	deck.comments = []
+	return deck.getText()
+
+
+def deckKey(text, kind):
+	''' Return the cache key for the deck text, as simulated by kind (a string naming the engine and
+		anything else about the run that changes the results)
+	'''
+	return _key(canonicalText(text), kind)
+
+
+def modelKey(model, start, stepSize, stepCount, kind):
+	''' Return the cache key for model.getText(start, stepSize, stepCount), which is already canonical
+	'''
+	return _key(model.getText(start, stepSize, stepCount), kind)
+
+
+def _key(canonical, kind):
+	digest = hashlib.sha256()
+	digest.update(kind.encode('utf-8'))
+	digest.update(b'\0')
+	digest.update(canonical.encode('ascii'))
+	return digest.hexdigest()
+
+
+# =======================================================================================================
+# Cache
+# =======================================================================================================
+
+class ResultCache:
+	def __init__(self, directory, maxBytes=DEFAULT_MAX_BYTES, maxEntries=None):
+		''' Open (or create) the cache in directory, holding at most maxBytes of payload files and, if given,
+			at most maxEntries entries
+		'''
+		self.directory  = os.path.abspath(os.path.expanduser(directory))
+		self.maxBytes   = maxBytes
+		self.maxEntries = maxEntries
+		self.hits       = 0
+		self.misses     = 0
+		self._lock      = threading.Lock()
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		with self._index() as db:
+			db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT, bytes INTEGER, '
+			           'created REAL, used REAL, hits INTEGER)')
+			db.execute('CREATE INDEX IF NOT EXISTS entriesUsed ON entries (used)')
+
+	@contextlib.contextmanager
+	def _index(self):
+		''' Open the SQLite index for one transaction
+		'''
+		db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=60.0)
+		try:
+			with db:
+				yield db
+		finally:
+			db.close()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + '.npz')
+
+	def get(self, key):
+		''' Return the dict of arrays stored under key, or None
+		'''
+		with self._lock, self._index() as db:
+			found = db.execute('SELECT key FROM entries WHERE key = ?', (key,)).fetchone()
+			if found is not None:
+				try:
+					with numpy.load(self._path(key)) as payload:
+						arrays = dict(payload.items())
+				except (IOError, OSError, ValueError):
+					db.execute('DELETE FROM entries WHERE key = ?', (key,))  # payload went missing or is damaged
+					found = None
+			if found is None:
+				self.misses += 1
+				return None
+			db.execute('UPDATE entries SET used = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+		self.hits += 1
+		return arrays
+
+	def put(self, key, arrays, kind=''):
+		''' Store a dict of arrays under key, then evict entries until the cache is within its limits
+		'''
+		handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+		with os.fdopen(handle, 'wb') as f:
+			numpy.savez(f, **arrays)
+		size = os.path.getsize(temporary)
+		os.replace(temporary, self._path(key))
+		now = time.time()
+		with self._lock, self._index() as db:
+			db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, 0)', (key, kind, size, now, now))
+			self._evict(db)
+
+	def _evict(self, db):
+		''' Delete least recently used entries while the cache is over either limit
+		'''
+		count, total = db.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries').fetchone()
+		if total <= self.maxBytes and (self.maxEntries is None or count <= self.maxEntries):
+			return
+		for key, size in db.execute('SELECT key, bytes FROM entries ORDER BY used').fetchall():
+			if total <= self.maxBytes and (self.maxEntries is None or count <= self.maxEntries):
+				break
+			db.execute('DELETE FROM entries WHERE key = ?', (key,))
+			try:
+				os.remove(self._path(key))
+			except OSError:
+				pass
+			count -= 1
+			total -= size
+
+	def clear(self):
+		''' Delete every entry
+		'''
+		with self._lock, self._index() as db:
+			for (key,) in db.execute('SELECT key FROM entries').fetchall():
+				try:
+					os.remove(self._path(key))
+				except OSError:
+					pass
+			db.execute('DELETE FROM entries')
+
+	def stats(self):
+		''' Return (entry count, total payload bytes)
+		'''
+		with self._index() as db:
+			return tuple(db.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries').fetchone())
+
+
+# =======================================================================================================
+# The active cache
+# =======================================================================================================
+
+_active = None
+_fromEnvironment = False
+
+
+def enable(directory, maxBytes=DEFAULT_MAX_BYTES, maxEntries=None):
+	''' Make a ResultCache in directory the one solve() and runJob() consult, and return it
+	'''
+	global _active, _fromEnvironment
+	_active, _fromEnvironment = ResultCache(directory, maxBytes, maxEntries), False
+	return _active
+
+
+def disable():
+	''' Stop consulting any cache (including one named by NEC2_CACHE_DIR)
+	'''
+	global _active, _fromEnvironment
+	_active, _fromEnvironment = None, True
+
+
+def activeCache():
+	''' Return the cache solve() and runJob() should consult, or None
+	'''
+	global _active, _fromEnvironment
+	if _active is None and not _fromEnvironment:
+		_fromEnvironment = True
+		if os.environ.get('NEC2_CACHE_DIR'):
+			_active = ResultCache(os.environ['NEC2_CACHE_DIR'])
+	return _active
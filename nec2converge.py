@@ -0,0 +1,228 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Segment-count convergence studies. Rebuild a model at increasing segment densities (1x, 1.5x, 2x, ... the
+segments of the baseline), solve each over the same sweep on a pool of worker processes, and watch how
+much the input impedance and peak gain move from one density to the next. Densities go in increasing
+order, only AHEAD at a time and no more than fit in memory together (see nec2solver.memoryEstimate), so
+a study that converges early never pays for the finest ones. The cheapest density whose
+answer the next finer one changes by less than the tolerances is the one worth running production sweeps
+at; anything finer just costs more.
+
+The build function takes the density as a keyword and has to be importable by the workers, so define it
+at the top level of a module (and start the study from under if __name__ == '__main__' in a script).
+scaledSegments() scales a hand picked count; models using AUTO segments can divide the segment length
+given to setSegmentation() by the density instead.
+
+Usage:
+
+  def buildYagi(density):
+      m = Model(wireRadius)
+      m.addWire(nec2converge.scaledSegments(41, density), a1, a2)
+      ...
+      return m
+
+  study = nec2converge.convergenceStudy(buildYagi, 145.5, 0.5, 5)
+  sys.stdout.write(study.text())
+  study.density, study.segments[study.best]
+'''
+
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy
+
+import nec2solver
+import nec2sweep
+from nec2geometry import compileGeometry
+
+
+DENSITIES           = (1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0)  # Segment densities tried, relative to the baseline
+IMPEDANCE_TOLERANCE = 0.01  # Largest relative change in input impedance between densities to call converged
+GAIN_TOLERANCE      = 0.1   # and largest change in peak gain, in dB
+AHEAD               = 2     # Densities solved at once, past the finest one finished so far
+
+
+def scaledSegments(segments, density):
+	''' Return a segment count density times segments, rounded, and kept odd if segments is odd so that a
+		middle feed stays centered
+	'''
+	scaled = max(1, int(round(segments * density)))
+	if segments % 2 == 1 and scaled % 2 == 0:
+		scaled += 1
+	return scaled
+
+
+# =======================================================================================================
+# Results
+# =======================================================================================================
+
+class ConvergenceStudy:
+	def __init__(self, densities, segments, frequencies, impedance, gain, seconds, errors, impedanceTolerance,
+	             gainTolerance):
+		''' Results at each density tried, in order: number of segments, input impedance and peak gain in dBi
+			at each frequency (rows of nan where a density failed; gain is None if it wasn't computed), solve
+			time in seconds, and error text (None where it worked)
+		'''
+		self.densities   = numpy.asarray(densities, dtype=float)
+		self.segments    = numpy.asarray(segments)
+		self.frequencies = frequencies
+		self.impedance   = impedance
+		self.gain        = gain
+		self.seconds     = numpy.asarray(seconds, dtype=float)
+		self.errors      = errors
+		self.impedanceTolerance = impedanceTolerance
+		self.gainTolerance      = gainTolerance
+
+		# Change from each density to the next finer one (nan for the last)
+		count = len(self.densities)
+		self.impedanceChanges = numpy.full(count, numpy.nan)
+		self.gainChanges      = numpy.full(count, numpy.nan)
+		if count > 1:
+			self.impedanceChanges[:-1] = (numpy.abs(impedance[1:] - impedance[:-1]) / numpy.abs(impedance[:-1])).max(axis=1)
+			if gain is not None:
+				self.gainChanges[:-1] = numpy.abs(gain[1:] - gain[:-1]).max(axis=1)
+		converged = self.impedanceChanges <= impedanceTolerance
+		if gain is not None:
+			converged &= self.gainChanges <= gainTolerance
+		self.best = int(numpy.argmax(converged)) if converged.any() else None  # index of the cheapest converged density
+		self.converged = self.best is not None
+
+	@property
+	def density(self):
+		''' The cheapest density that converged, or None
+		'''
+		return None if self.best is None else self.densities[self.best]
+
+	def text(self):
+		''' Return the study as a text table, one line per density, with the verdict at the bottom
+		'''
+		lines = ['{: >8}{: >10}{: >12}{: >14}{: >12}\n'.format('density', 'segments', 'seconds', 'dZ/Z next', 'dG next dB')]
+		for i in range(len(self.densities)):
+			if self.errors[i] is not None:
+				lines.append('{: >8.2f}  failed: {}\n'.format(self.densities[i], self.errors[i].strip().split('\n')[-1]))
+				continue
+			lines.append('{: >8.2f}{: >10}{: >12.3f}{: >14.5f}{: >12.4f}{}\n'.format(self.densities[i], self.segments[i],
+			             self.seconds[i], self.impedanceChanges[i], self.gainChanges[i], '  <-' if i == self.best else ''))
+		if self.converged:
+			lines.append('Converged at density {:g} ({} segments)\n'.format(self.density, self.segments[self.best]))
+		else:
+			lines.append('Not converged to {:g} in impedance / {:g} dB in gain\n'.format(self.impedanceTolerance, self.gainTolerance))
+		return ''.join(lines)
+
+
+# =======================================================================================================
+# Study
+# =======================================================================================================
+
+def evaluateDensity(build, density, start, stepSize, stepCount, z0=50.0, gain=True):
+	''' Build and solve the model at one density, returning (segments, impedance, peak gain or None, seconds,
+		error text or None)
+	'''
+	t0 = time.time()
+	try:
+		model = build(density=density)
+		segments = len(compileGeometry(model))
+	except Exception:
+		return 0, None, None, 0.0, ''.join(traceback.format_exception(*sys.exc_info()))
+	result, error = nec2sweep.evaluate(lambda: model, {}, start, stepSize, stepCount, z0, metrics=gain)
+	if result is None:
+		return segments, None, None, time.time() - t0, error
+	return segments, result.impedance, (result.metrics['gain'] if gain else None), time.time() - t0, None
+
+
+def availableMemory():
+	''' Return the bytes of memory free for new work (MemAvailable on Linux, otherwise all physical memory),
+		or None if there's no telling
+	'''
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1]) * 1024
+	except (IOError, OSError, ValueError):
+		pass
+	try:
+		return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+	except (AttributeError, ValueError, OSError):
+		return None
+
+
+def densityMemory(build, density, frequencyCount):
+	''' Return the estimated bytes solving build(density=density) takes, or 0 if the model can't be built
+		(the worker reports why)
+	'''
+	try:
+		return nec2solver.memoryEstimate(len(compileGeometry(build(density=density))), frequencyCount)
+	except Exception:
+		return 0
+
+
+def convergenceStudy(build, start, stepSize=None, stepCount=None, densities=DENSITIES, z0=50.0,
+                     impedanceTolerance=IMPEDANCE_TOLERANCE, gainTolerance=GAIN_TOLERANCE, gain=True, workers=None,
+                     memory=None):
+	''' Solve build(density=d) over the FR sweep (start, stepSize, stepCount) at each density from the
+		coarsest up, until one has an answer within the tolerances of the next finer one, and return the
+		ConvergenceStudy of the densities tried. Up to AHEAD densities past the finest one finished run at
+		once on separate processes, as long as there are workers for them (default: one per core) and their
+		estimated memory fits in memory bytes between them (default: what's available at the start). Without
+		gain only the impedance is compared, which skips the far field calculations.
+	'''
+	workers = workers or multiprocessing.cpu_count()
+	densities = sorted(densities)
+	if len(densities) < 2:
+		raise ValueError("a convergence study needs at least two densities")
+	memory = availableMemory() if memory is None else memory
+	frequencyCount = len(nec2solver.frequencies(start, stepSize, stepCount))
+	outcomes = [None] * len(densities)
+	finished = 0   # densities[:finished] all have outcomes
+	queued = 0     # and densities[:queued] have been started
+	running = {}   # future -> (index, estimated bytes)
+	study = None
+	pool = ProcessPoolExecutor(max_workers=min(workers, AHEAD)) if workers > 1 else None
+	try:
+		while finished < len(densities):
+			if pool is None:
+				outcomes[finished] = evaluateDensity(build, densities[finished], start, stepSize, stepCount, z0, gain)
+			else:
+				# Start the next densities in order while there's room, but always at least one
+				while queued < min(finished + AHEAD, len(densities)) and len(running) < workers:
+					cost = densityMemory(build, densities[queued], frequencyCount)
+					if running and memory is not None and sum(c for i, c in running.values()) + cost > memory:
+						break
+					future = pool.submit(evaluateDensity, build, densities[queued], start, stepSize, stepCount, z0, gain)
+					running[future] = (queued, cost)
+					queued += 1
+				done, pending = wait(list(running), return_when=FIRST_COMPLETED)
+				for future in done:
+					outcomes[running.pop(future)[0]] = future.result()
+			while finished < len(densities) and outcomes[finished] is not None:
+				finished += 1
+			study = _study(densities[:finished], outcomes[:finished], start, stepSize, stepCount, impedanceTolerance,
+			               gainTolerance, gain)
+			if study.converged:
+				break
+	finally:
+		if pool is not None:
+			for future in running:
+				future.cancel()
+			pool.shutdown()
+	return study
+
+
+def _study(densities, outcomes, start, stepSize, stepCount, impedanceTolerance, gainTolerance, gain):
+	frequencies = nec2solver.frequencies(start, stepSize, stepCount)
+	impedance = numpy.full((len(outcomes), len(frequencies)), numpy.nan, dtype=complex)
+	gains = numpy.full((len(outcomes), len(frequencies)), numpy.nan) if gain else None
+	for i, (segments, z, g, seconds, error) in enumerate(outcomes):
+		if error is None:
+			impedance[i] = z
+			if gain:
+				gains[i] = g
+	return ConvergenceStudy(densities, [o[0] for o in outcomes], frequencies, impedance, gains,
+	                        [o[3] for o in outcomes], [o[4] for o in outcomes], impedanceTolerance, gainTolerance)
@@ -0,0 +1,262 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Read nec2 card stack files back in. Handles the fixed column layout nec2utils writes as well as free
+format cards separated by spaces or commas (like the gen1 decks in oldStuff/gen1). Decks written by
+nec2utils come back out of Deck.getText() byte for byte.
+
+Lines in the fixed layout are picked apart by column (the geometry cards for the whole file at once), so
+only hand written or oddly formatted cards go through the slower tokenizer. Going by column matters once
+tags reach 6 digits, since dec() then fills its whole field and nothing separates it from the one before.
+'''
+
+import numpy
+
+from nec2utils import *
+from nec2geometry import compileCards, compileGeometry
+
+
+# =======================================================================================================
+# Card layouts
+# =======================================================================================================
+
+COMMENT_CARDS  = ('CM', 'CE')
+GEOMETRY_CARDS = ('GW', 'GA', 'GM')  # Cards that fit a CardStore: 2 integer fields and 7 float fields
+INTEGER_FIELDS = 4                   # Every other card leads with up to 4 integer fields (I1-I4), then floats
+
+_GEOMETRY_WIDTH = 2 + 6*CardStore.INTS + 13*CardStore.FLOATS  # Length of a GW/GA/GM line from cardLine()
+
+# Characters that can appear in cardLine()'s integer and float fields
+_INTEGER_CHARACTERS = numpy.zeros(256, dtype=bool)
+_INTEGER_CHARACTERS[numpy.frombuffer(b' -0123456789', dtype=numpy.uint8)] = True
+_FLOAT_CHARACTERS = _INTEGER_CHARACTERS.copy()
+_FLOAT_CHARACTERS[numpy.frombuffer(b'+.EINAF', dtype=numpy.uint8)] = True  # exponents, NAN and INF
+
+
+# =======================================================================================================
+# Deck
+# =======================================================================================================
+
+class Deck:
+	def __init__(self):
+		''' A parsed card stack. GW, GA, and GM cards go into a CardStore in deck order, other cards are kept
+			as (mnemonic, integer fields, float fields) tuples along with how many geometry cards precede them.
+		'''
+		self.comments = []          # (number of GW/GA/GM cards before it, number of others before it, line)
+		self.cards    = CardStore() # GW, GA, and GM cards
+		self.others   = []          # (number of GW/GA/GM cards before it, card)
+
+	def iterText(self):
+		''' Generate the deck text a block at a time, every card and CM/CE line where it was in the deck
+		'''
+		position, comment = 0, 0
+		others = self.others + [(len(self.cards), None)]
+		for index, (before, card) in enumerate(others):
+			# Comment lines that come before this card, with the geometry cards between them
+			while comment < len(self.comments) and self.comments[comment][1] <= index:
+				cardsBefore, othersBefore, line = self.comments[comment]
+				if cardsBefore > position:
+					yield _storeText(self.cards, position, cardsBefore)
+					position = cardsBefore
+				yield line + '\n'
+				comment += 1
+			if before > position:
+				yield _storeText(self.cards, position, before)
+				position = before
+			if card is not None:
+				yield cardLine(*card)
+
+	def getText(self):
+		return ''.join(self.iterText())
+
+	def getCards(self, name):
+		''' Return the non-geometry cards with the given mnemonic, in deck order
+		'''
+		return [card for before, card in self.others if card[0] == name]
+
+	def compile(self):
+		''' Return the compiled nec2geometry.Geometry of the deck's GW/GA/GM cards and any GX card after them
+		'''
+		cards = list(self.cards)
+		for before, card in reversed(self.others):
+			if card[0] == 'GX':
+				cards.insert(before, card)
+		return compileCards(cards)
+
+	def toModel(self):
+		''' Return a Model holding the deck's geometry and EX feedpoint. Model always writes its GM cards after
+			all of its GW/GA cards, so decks that interleave them can't be represented.
+		'''
+		names = self.cards.names
+		isMove = numpy.array(names) == 'GM'
+		firstMove = numpy.argmax(isMove) if isMove.any() else len(names)
+		if isMove[firstMove:].sum() != len(names) - firstMove:
+			raise ValueError("deck has GW/GA cards after GM cards, which a Model can't represent")
+		if self.getCards('GX'):
+			raise ValueError("deck has a GX card, which a Model can't represent")
+		radius = 0.0
+		for name, ints, floats in self.cards:
+			if name in ('GW', 'GA'):
+				radius = floats[6] if name == 'GW' else floats[3]
+				break
+		model = Model(radius)
+		ints, floats = self.cards.columns()
+		model.wires.appendColumns(names[:firstMove], ints[:firstMove], floats[:firstMove])
+		model.transforms.appendColumns(names[firstMove:], ints[firstMove:], floats[firstMove:])
+		for row, tag in enumerate(ints[:firstMove, 0]):
+			model.tagRows.setdefault(int(tag), row)
+		model.tag = int(ints[:firstMove, 0].max()) if firstMove else 0
+		if firstMove:
+			model.middle = int(ints[firstMove - 1, 1]) // 2 + 1  # as addWire()/addArc() leave it, for feedAtMiddle()
+		if (ints[firstMove:, 1] != 0).any():  # GM cards that add copies, and their tags
+			model.tag = int(compileGeometry(model).tags.max())
+			model.replicated = True
+		excitations = self.getCards('EX')
+		if excitations:
+			model.EX_tag, model.EX_segment = excitations[0][1][1], excitations[0][1][2]
+		patterns = self.getCards('RP')
+		if patterns:
+			name, ints, floats = patterns[0]
+			ints, floats = tuple(ints) + (0,) * (4 - len(ints)), tuple(floats) + (0.0,) * (4 - len(floats))
+			model.setRadiationPattern(ints[1], ints[2], floats[0], floats[1], floats[2], floats[3], ints[0], ints[3])
+		return model
+
+
+def _storeText(store, first, last):
+	''' Render rows first to last-1 of a CardStore
+	'''
+	ints, floats = store.columns(first, last)
+	return formatCards(store.names[first:last], ints, floats)
+
+
+# =======================================================================================================
+# Parsing
+# =======================================================================================================
+
+def _tokens(line):
+	''' Split the fields of a free format card (spaces and/or commas between fields)
+	'''
+	return line[2:].replace(',', ' ').split()
+
+
+def _field(token, integer):
+	if integer:
+		return int(float(token)) if ('.' in token or 'E' in token or 'e' in token) else int(token)
+	return float(token)
+
+
+def _fixedFields(line, intCount):
+	''' Return the (integer fields, float fields) of a line in cardLine()'s fixed layout, with up to intCount
+		integer fields, or None if the line isn't in that layout
+	'''
+	width = len(line) - 2
+	ints = min(width // 6, intCount)
+	floats = (width - 6*ints) // 13
+	if width <= 0 or 6*ints + 13*floats != width or (floats and ints < intCount):
+		return None
+	row = numpy.frombuffer(line.encode('ascii', 'replace'), dtype=numpy.uint8)[None]
+	if not _fixedLayout(row, ints, floats)[0]:
+		return None
+	return (tuple([int(line[2+6*i:8+6*i]) for i in range(ints)]),
+	        tuple([float(line[2+6*ints+13*i:15+6*ints+13*i]) for i in range(floats)]))
+
+
+def parseCard(line):
+	''' Parse one card, in the fixed layout or free format, into a (mnemonic, integer fields, float fields)
+		tuple
+	'''
+	name = line[:2]
+	intCount = CardStore.INTS if name in GEOMETRY_CARDS else INTEGER_FIELDS
+	fields = _fixedFields(line.rstrip(), intCount)
+	if fields is not None:
+		ints, floats = fields
+	else:
+		tokens = _tokens(line)
+		ints   = tuple([_field(t, True) for t in tokens[:intCount]])
+		floats = tuple([_field(t, False) for t in tokens[intCount:]])
+	if name in GEOMETRY_CARDS:
+		ints   = (ints + (0,) * CardStore.INTS)[:CardStore.INTS]
+		floats = (floats + (0.0,) * CardStore.FLOATS)[:CardStore.FLOATS]
+	return (name, ints, floats)
+
+
+def parseDeck(text):
+	''' Parse the text of a card stack into a Deck
+	'''
+	deck  = Deck()
+	lines = text.split('\n')
+	# One byte per character, so offsets match the lines; anything outside ASCII can only be in a comment
+	data  = numpy.frombuffer(text.encode('ascii', 'replace'), dtype=numpy.uint8)
+	newlines = numpy.nonzero(data == ord('\n'))[0]
+	starts = numpy.r_[0, newlines + 1]
+	ends   = numpy.r_[newlines, len(data)]
+	# Ignore a carriage return before each newline
+	if len(data):
+		crlf = (ends > starts) & (data[numpy.maximum(ends - 1, 0)] == ord('\r'))
+		ends = ends - crlf
+	lengths = ends - starts
+
+	# Card mnemonics for every line at once
+	padded = numpy.r_[data, numpy.zeros(2, dtype=numpy.uint8)]
+	codes  = padded[starts].astype(numpy.int32) * 256 + padded[starts + 1]
+	code   = lambda name: ord(name[0]) * 256 + ord(name[1])
+	geometry = numpy.isin(codes, [code(n) for n in GEOMETRY_CARDS]) & (lengths >= 2)
+
+	# Geometry lines in the exact fixed layout get sliced into columns in bulk
+	fixed = geometry & (lengths == _GEOMETRY_WIDTH)
+	if fixed.any():
+		rows  = data[starts[fixed, None] + numpy.arange(_GEOMETRY_WIDTH)]
+		fixed[fixed] = _fixedLayout(rows, CardStore.INTS, CardStore.FLOATS)
+	geometryRows = numpy.nonzero(geometry)[0]
+	ints   = numpy.zeros((len(geometryRows), CardStore.INTS), dtype=numpy.int64)
+	floats = numpy.zeros((len(geometryRows), CardStore.FLOATS))
+	isFixed = fixed[geometryRows]
+	if isFixed.any():
+		rows = data[starts[geometryRows[isFixed], None] + numpy.arange(_GEOMETRY_WIDTH)]
+		intText   = numpy.ascontiguousarray(rows[:, 2:2+6*CardStore.INTS]).view('S6')
+		floatText = numpy.ascontiguousarray(rows[:, 2+6*CardStore.INTS:]).view('S13')
+		ints[isFixed]   = intText.astype(numpy.int64)
+		floats[isFixed] = floatText.astype(numpy.float64)
+	for i in numpy.nonzero(~isFixed)[0]:
+		name, cardInts, cardFloats = parseCard(lines[geometryRows[i]].rstrip('\r'))
+		ints[i], floats[i] = cardInts, cardFloats
+	deck.cards.appendColumns([lines[i][:2] for i in geometryRows], ints, floats)
+
+	# Everything else is rare enough to take one line at a time
+	before = numpy.cumsum(geometry) - geometry
+	for i in numpy.nonzero(~geometry)[0]:
+		line = lines[i].rstrip('\r')
+		if not line.strip():
+			continue
+		if line[:2] in COMMENT_CARDS:
+			deck.comments.append((int(before[i]), len(deck.others), line))
+		else:
+			deck.others.append((int(before[i]), parseCard(line)))
+	return deck
+
+
+def _fixedLayout(rows, ints, floats):
+	''' Return which (n, width) uint8 rows really are in cardLine()'s fixed layout with ints 6 char integer
+		fields and floats 13 char float fields: every field right aligned, holding only characters that
+		belong in it, with nothing but blanks in front. A field can fill its whole width (a 6 digit tag),
+		so its first column isn't necessarily blank.
+	'''
+	fieldStarts = [2 + 6*i for i in range(ints)] + [2 + 6*ints + 13*i for i in range(floats)]
+	fieldEnds   = fieldStarts[1:] + [2 + 6*ints + 13*floats]
+	ok = numpy.ones(len(rows), dtype=bool)
+	for k, (a, b) in enumerate(zip(fieldStarts, fieldEnds)):
+		field = rows[:, a:b]
+		blank = field == ord(' ')
+		allowed = _INTEGER_CHARACTERS if k < ints else _FLOAT_CHARACTERS
+		ok &= ~blank[:, -1] & allowed[field].all(axis=1) & (numpy.diff(blank.astype(numpy.int8), axis=1) <= 0).all(axis=1)
+	return ok
+
+
+def readDeck(fileName):
+	''' Read a card stack file (gzip compressed if the name ends in .gz) into a Deck
+	'''
+	nec2File = openCardFile(fileName, 'r')
+	text = nec2File.read()
+	nec2File.close()
+	return parseDeck(text)
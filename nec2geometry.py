@@ -0,0 +1,422 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Geometry compiler: resolve the GW, GA, and GM cards of a nec2utils.Model (or any card list in deck order)
+into flat numpy arrays describing where every segment actually ends up. Solvers, validators, and plotters
+all work from this compiled form instead of re-deriving it from the cards.
+'''
+
+import math
+
+import numpy
+
+
+CHUNK = 65536  # Segments transformed per vectorized step, to keep temporaries small on huge models
+
+
+# =======================================================================================================
+# GM card transforms
+# =======================================================================================================
+
+def rotationMatrix(rotX, rotY, rotZ):
+	''' Return the 3x3 matrix nec2 uses for a GM card: rotate about X, then Y, then Z (angles in degrees)
+	'''
+	ps, th, ph = math.radians(rotX), math.radians(rotY), math.radians(rotZ)
+	cps, sps = math.cos(ps), math.sin(ps)
+	cth, sth = math.cos(th), math.sin(th)
+	cph, sph = math.cos(ph), math.sin(ph)
+	return numpy.array([[cph*cth, cph*sth*sps - sph*cps, cph*sth*cps + sph*sps],
+	                    [sph*cth, sph*sth*sps + cph*cps, sph*sth*cps - cph*sps],
+	                    [-sth,    cth*sps,               cth*cps]])
+
+
+def transformMatrix(rotX, rotY, rotZ, trX, trY, trZ):
+	''' Return the 4x4 homogeneous matrix for a GM card's rotation followed by its translation
+	'''
+	matrix = numpy.identity(4)
+	matrix[:3, :3] = rotationMatrix(rotX, rotY, rotZ)
+	matrix[:3, 3]  = (trX, trY, trZ)
+	return matrix
+
+
+# =======================================================================================================
+# Compiled geometry
+# =======================================================================================================
+
+class Geometry:
+	def __init__(self, starts, ends, radii, tags, cards, sources=None):
+		''' Straight segments in nec2 order. starts and ends are (n, 3) arrays of endpoints in meters, radii
+			the wire radius of each segment, tags the tag number, and cards the index of the GW or GA card
+			(counting only those) that made each segment. A wire that a GM card copied counts as a card of
+			its own, numbered in order along the segments; sources is then the GW or GA card it was copied
+			from (the same as cards by default).
+		'''
+		self.starts  = numpy.ascontiguousarray(starts)
+		self.ends    = numpy.ascontiguousarray(ends)
+		self.radii   = numpy.ascontiguousarray(radii)
+		self.tags    = numpy.ascontiguousarray(tags)
+		self.cards   = numpy.ascontiguousarray(cards)
+		self.sources = self.cards if sources is None else numpy.ascontiguousarray(sources)
+		self.centers = 0.5 * (self.starts + self.ends)
+		self.lengths = numpy.sqrt(((self.ends - self.starts)**2).sum(axis=1))
+		self.units   = (self.ends - self.starts) / numpy.where(self.lengths > 0.0, self.lengths, 1.0)[:, None]
+		self.segments = segmentNumbers(self.tags)
+
+	def __len__(self):
+		return len(self.tags)
+
+	def segmentIndex(self, tag, segment):
+		''' Return the array index of segment number segment (1 based, as on an EX card) of the given tag
+		'''
+		matches = numpy.nonzero((self.tags == tag) & (self.segments == segment))[0]
+		if len(matches) == 0:
+			raise ValueError("tag {} has no segment {}".format(tag, segment))
+		return matches[0]
+
+	def cardRanges(self):
+		''' Return (first, last) arrays with the index range [first, last) of the segments of each card
+		'''
+		first = numpy.nonzero(numpy.r_[True, self.cards[1:] != self.cards[:-1]])[0]
+		last  = numpy.r_[first[1:], len(self.cards)]
+		return first, last
+
+
+def segmentNumbers(tags):
+	''' Return the 1 based number of each segment among the segments sharing its tag, in order
+	'''
+	order = numpy.argsort(tags, kind='stable')
+	sorted_ = tags[order]
+	groupStart = numpy.nonzero(numpy.r_[True, sorted_[1:] != sorted_[:-1]])[0]
+	rank = numpy.arange(len(tags)) - numpy.repeat(groupStart, numpy.diff(numpy.r_[groupStart, len(tags)]))
+	numbers = numpy.empty(len(tags), dtype=numpy.int64)
+	numbers[order] = rank + 1
+	return numbers
+
+
+# =======================================================================================================
+# Compiler
+# =======================================================================================================
+
+def _discretize(names, ints, floats):
+	''' Return (starts, ends, radii, tags, cards) for a block of GW and GA cards, before any GM cards
+	'''
+	counts = ints[:, 1].astype(numpy.int64)
+	card   = numpy.repeat(numpy.arange(len(names)), counts)
+	offset = numpy.r_[0, numpy.cumsum(counts)[:-1]]
+	local  = numpy.arange(counts.sum()) - offset[card]
+	t0     = (local / counts[card].astype(float))[:, None]
+	t1     = ((local + 1) / counts[card].astype(float))[:, None]
+	f      = floats[card]
+	isArc  = (numpy.array(names) == 'GA')[card]
+
+	# GW: straight line from (x1, y1, z1) to (x2, y2, z2)
+	p1, p2 = f[:, 0:3], f[:, 3:6]
+	starts = (1.0 - t0) * p1 + t0 * p2
+	ends   = (1.0 - t1) * p1 + t1 * p2
+
+	# GA: arc of radius f[0] from angle f[1] to f[2] (degrees) in the X-Z plane, centered on the origin
+	if isArc.any():
+		fa = f[isArc]
+		a0 = numpy.radians(fa[:, 1] + (fa[:, 2] - fa[:, 1]) * t0[isArc, 0])
+		a1 = numpy.radians(fa[:, 1] + (fa[:, 2] - fa[:, 1]) * t1[isArc, 0])
+		zero = numpy.zeros(len(fa))
+		starts[isArc] = fa[:, 0:1] * numpy.stack([numpy.cos(a0), zero, numpy.sin(a0)], axis=1)
+		ends[isArc]   = fa[:, 0:1] * numpy.stack([numpy.cos(a1), zero, numpy.sin(a1)], axis=1)
+
+	radii = numpy.where(isArc, f[:, 3], f[:, 6])
+	return starts, ends, radii, ints[card, 0].astype(numpy.int64), card
+
+
+def compileCards(cards):
+	''' Compile an iterable of (mnemonic, integer fields, float fields) cards in deck order into a Geometry.
+		GW and GA cards make segments; a GM card moves the segments defined before it, starting with the
+		first segment whose tag is its ITS field (all of them when ITS is 0), or with an NRPT field above 0
+		leaves them be and adds that many copies, each moved from the one before (see _replicate); a GX
+		card reflects the whole structure (see reflectGeometry), and has to come after every GW, GA, and GM
+		card. Other cards are ignored.
+	'''
+	names, ints, floats, moves, reflections = [], [], [], [], []
+	for name, i, f in cards:
+		if name in ('GW', 'GA', 'GM') and reflections:
+			raise ValueError("geometry cards after a GX card aren't supported")
+		if name in ('GW', 'GA'):
+			names.append(name)
+			ints.append(tuple(i[:2]))
+			floats.append(tuple(f[:7]) + (0.0,) * (7 - len(f[:7])))
+		elif name == 'GM':
+			moves.append((len(names), tuple(i), tuple(f)))
+		elif name == 'GX':
+			reflections.append(tuple(i) + (0,) * (2 - len(i)))
+	geometry = _compile(names, numpy.array(ints, dtype=numpy.int64).reshape(-1, 2),
+	                    numpy.array(floats, dtype=numpy.float64).reshape(-1, 7), moves)
+	for tagIncrement, planes in reflections:
+		geometry = reflectGeometry(geometry, planeAxes(planes), tagIncrement)
+	return geometry
+
+
+def compileGeometry(model):
+	''' Compile a Model's cards: its GW/GA cards followed by its GM cards, the same order getText() writes
+	'''
+	ints, floats = model.wires.columns()
+	moves = [(len(model.wires), i, f) for name, i, f in model.transforms]
+	return _compile(model.wires.names, ints, floats, moves)
+
+
+def _compile(names, ints, floats, moves):
+	''' Compile GW/GA cards given as a list of mnemonics and (n, 2) / (n, 7) field arrays, plus a list of
+		(number of GW/GA cards before it, integer fields, float fields) for each GM card
+	'''
+	if not names:
+		empty = numpy.zeros((0, 3))
+		return Geometry(empty, empty, numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+	starts, ends, radii, tags, card = _discretize(names, ints, floats)
+	cardEnds = numpy.r_[0, numpy.cumsum(ints[:, 1])]
+	if any(any(i[:2]) for cardsBefore, i, f in moves):
+		return _replicate(starts, ends, radii, tags, card, cardEnds, moves)
+
+	# Each GM card covers the segment range [first segment with tag ITS, segments defined before the card).
+	uniqueTags, firstIndex = numpy.unique(tags, return_index=True)
+	firstOfTag = dict(zip(uniqueTags.tolist(), firstIndex.tolist()))
+	ranges, matrices = [], []
+	for cardsBefore, i, f in moves:
+		its  = int(f[6])
+		stop = cardEnds[cardsBefore]
+		start = 0
+		if its != 0:
+			start = firstOfTag.get(its, stop)
+			if start >= stop:
+				raise ValueError("GM card refers to tag {} which has no segments before it".format(its))
+		if ranges and ranges[-1] == (start, stop):
+			matrices[-1] = transformMatrix(*f[:6]).dot(matrices[-1])  # same range as the last card, fold it in
+		else:
+			ranges.append((start, stop))
+			matrices.append(transformMatrix(*f[:6]))
+	if ranges:
+		pieces, cuts = _composeTransforms(ranges, matrices, len(tags))
+		piece = numpy.searchsorted(cuts, numpy.arange(len(tags)), side='right') - 1
+		for a in range(0, len(tags), CHUNK):
+			b = a + CHUNK
+			rotation, translation = pieces[piece[a:b], :3, :3], pieces[piece[a:b], :3, 3]
+			starts[a:b] = numpy.einsum('nij,nj->ni', rotation, starts[a:b]) + translation
+			ends[a:b]   = numpy.einsum('nij,nj->ni', rotation, ends[a:b]) + translation
+	return Geometry(starts, ends, radii, tags, card)
+
+
+def _replicate(starts, ends, radii, tags, card, cardEnds, moves):
+	''' Compile the discretized GW/GA cards by applying the GM cards one at a time, for decks where some of
+		them add tag increments (ITGI) or copies (NRPT). Like nec2, a copying GM card appends NRPT copies of
+		the segments from the first one with tag ITS to the end of the structure so far, the k-th moved by
+		the card's transform k times and with its nonzero tags increased by k * ITGI.
+	'''
+	# The structure as it's built: a list of blocks of (starts, ends, radii, tags, sources, wire ids)
+	blocks, done, wires = [], 0, len(cardEnds) - 1
+	def original(stop):
+		if stop > done:
+			blocks.append((starts[done:stop], ends[done:stop], radii[done:stop], tags[done:stop], card[done:stop], card[done:stop]))
+		return max(stop, done)
+	for cardsBefore, i, f in moves:
+		done = original(cardEnds[cardsBefore])
+		if len(blocks) > 1:
+			blocks = [tuple(numpy.concatenate(column) for column in zip(*blocks))]
+		if not blocks:
+			raise ValueError("GM card comes before any GW or GA card")
+		s, e, r, t, sources, ids = blocks[0]
+		i = tuple(i) + (0,) * (2 - len(i))
+		increment, copies, its = int(i[0]), int(i[1]), int(f[6])
+		start = 0
+		if its != 0:
+			found = numpy.nonzero(t == its)[0]
+			if not len(found):
+				raise ValueError("GM card refers to tag {} which has no segments before it".format(its))
+			start = found[0]
+		matrix = transformMatrix(*f[:6])
+		if copies == 0:
+			moved = lambda p: p[start:].dot(matrix[:3, :3].T) + matrix[:3, 3]
+			blocks[0] = (numpy.r_[s[:start], moved(s)], numpy.r_[e[:start], moved(e)], r,
+			             numpy.r_[t[:start], numpy.where(t[start:] != 0, t[start:] + increment, 0)], sources, ids)
+			continue
+		powers = [matrix]
+		for k in range(1, copies):
+			powers.append(matrix.dot(powers[-1]))
+		powers = numpy.array(powers)
+		count = len(t) - start
+		steps = numpy.repeat(numpy.arange(1, copies + 1), count)
+		copied = lambda p: (numpy.einsum('kij,nj->kni', powers[:, :3, :3], p[start:]) + powers[:, None, :3, 3]).reshape(-1, 3)
+		ids = ids[start:] - ids[start:].min()
+		blocks.append((copied(s), copied(e), numpy.tile(r[start:], copies),
+		               numpy.where(numpy.tile(t[start:], copies) != 0, numpy.tile(t[start:], copies) + increment * steps, 0),
+		               numpy.tile(sources[start:], copies), wires + numpy.tile(ids, copies) + (steps - 1) * (ids.max() + 1)))
+		wires += copies * (ids.max() + 1)
+	original(len(tags))
+	s, e, r, t, sources, ids = [numpy.concatenate(column) for column in zip(*blocks)]
+	cards = numpy.cumsum(numpy.r_[0, ids[1:] != ids[:-1]])  # wires numbered in order along the segments
+	return Geometry(s, e, r, t, cards, sources)
+
+
+def _composeTransforms(ranges, matrices, count):
+	''' Given the segment range and 4x4 matrix of each GM card in order, cut the count segments wherever a
+		range starts or stops and return (composite matrix of each piece, the cut points)
+	'''
+	starts = numpy.array([r[0] for r in ranges])
+	stops  = numpy.array([r[1] for r in ranges])
+	cuts   = numpy.unique(numpy.r_[0, count, starts, stops])
+	if (stops == stops[0]).all() and (numpy.diff(starts) >= 0).all():
+		# The usual case for a Model: every GM card applies through the end of the structure and the ranges
+		# start further along with each card, so each piece is covered by a leading run of the cards and its
+		# composite is a prefix product.
+		prefix = numpy.empty((len(matrices) + 1, 4, 4))
+		prefix[0] = numpy.identity(4)
+		for c, matrix in enumerate(matrices):
+			prefix[c+1] = matrix.dot(prefix[c])
+		covering = numpy.searchsorted(starts, cuts[:-1], side='right')
+		pieces = prefix[covering]
+		pieces[cuts[:-1] >= stops[0]] = numpy.identity(4)
+	else:
+		pieces = numpy.identity(4)[None].repeat(len(cuts) - 1, axis=0)
+		for (start, stop), matrix in zip(ranges, matrices):
+			covered = (cuts[:-1] >= start) & (cuts[:-1] < stop)
+			pieces[covered] = numpy.einsum('ij,njk->nik', matrix, pieces[covered])
+	return pieces, cuts
+
+
+# =======================================================================================================
+# Mirror symmetry
+# =======================================================================================================
+
+def planeAxes(planes):
+	''' Return the axes (0, 1, 2 for X, Y, Z) a GX card's I2 field reflects along: its decimal digits are
+		flags for X, Y, and Z, so 110 reflects x -> -x and y -> -y
+	'''
+	digits = '{:03d}'.format(int(planes))[-3:]
+	return tuple(axis for axis in range(3) if digits[axis] != '0')
+
+
+def axesPlanes(axes):
+	''' Return the GX card I2 field that reflects along each of axes
+	'''
+	return 100 * (0 in axes) + 10 * (1 in axes) + (2 in axes)
+
+
+def reflectGeometry(geometry, axes, tagIncrement):
+	''' Return the Geometry a GX card makes of geometry: the structure plus its mirror image along each of
+		axes in turn (Z first, then Y, then X, the order nec2 uses), the copies' nonzero tags increased by
+		tagIncrement, which doubles with each reflection
+	'''
+	starts, ends, radii, tags, cards = geometry.starts, geometry.ends, geometry.radii, geometry.tags, geometry.cards
+	sources = geometry.sources
+	for axis in (2, 1, 0):
+		if axis in axes:
+			flip = numpy.ones(3)
+			flip[axis] = -1.0
+			starts, ends = numpy.r_[starts, starts * flip], numpy.r_[ends, ends * flip]
+			radii = numpy.r_[radii, radii]
+			tags  = numpy.r_[tags, numpy.where(tags != 0, tags + tagIncrement, 0)]
+			cards = numpy.r_[cards, cards + (cards.max() + 1 if len(cards) else 0)]
+			sources = numpy.r_[sources, sources]
+			tagIncrement *= 2
+	return Geometry(starts, ends, radii, tags, cards, sources)
+
+
+def _segmentKeys(starts, ends, radii, quantum, offset):
+	''' Return a hashable key per segment, the same whichever way round it runs, from its endpoints and
+		radius rounded to quantum (on a grid shifted by offset quanta)
+	'''
+	a = numpy.rint(starts / quantum + offset).astype(numpy.int64).tolist()
+	b = numpy.rint(ends / quantum + offset).astype(numpy.int64).tolist()
+	r = numpy.rint(radii / quantum).astype(numpy.int64).tolist()
+	return [(tuple(p), tuple(q), w) if p <= q else (tuple(q), tuple(p), w) for p, q, w in zip(a, b, r)]
+
+
+def matchSegments(starts, ends, radii, others, tolerance=1e-6):
+	''' Return the index of the segment of others (a Geometry) that coincides with each of the segments
+		given by their endpoints and radii, whichever way round it runs, or -1 where there's none.
+		Coordinates match to tolerance times the size of the structure.
+	'''
+	image = numpy.full(len(starts), -1, dtype=numpy.int64)
+	if not len(starts) or not len(others):
+		return image
+	quantum = tolerance * max(numpy.abs(others.starts).max(), numpy.abs(others.ends).max(), others.radii.max()) or tolerance
+	for offset in (0.0, 0.5):  # a second, shifted grid catches pairs that rounding split across a grid line
+		missing = numpy.nonzero(image < 0)[0]
+		if not len(missing):
+			break
+		lookup = dict(zip(_segmentKeys(others.starts, others.ends, others.radii, quantum, offset), range(len(others))))
+		keys = _segmentKeys(starts[missing], ends[missing], radii[missing], quantum, offset)
+		image[missing] = [lookup.get(key, -1) for key in keys]
+	return image
+
+
+def mirrorMap(geometry, axis, tolerance=1e-6):
+	''' Return (image, reversed): the index of each segment's mirror image in the plane through the origin
+		normal to axis (0, 1, 2 for X, Y, Z), and whether the image runs the opposite way. Returns None if
+		any segment has no image.
+	'''
+	flip = numpy.ones(3)
+	flip[axis] = -1.0
+	mirrored = geometry.starts * flip
+	image = matchSegments(mirrored, geometry.ends * flip, geometry.radii, geometry, tolerance)
+	if (image < 0).any() or (image[image] != numpy.arange(len(image))).any():
+		return None
+	reversed_ = ((mirrored - geometry.starts[image])**2).sum(axis=1) > ((mirrored - geometry.ends[image])**2).sum(axis=1)
+	return image, reversed_
+
+
+def symmetryPlanes(geometry, tolerance=1e-6):
+	''' Return the axes (0, 1, 2 for X, Y, Z) along which the geometry is its own mirror image, reflected in
+		the coordinate plane through the origin
+	'''
+	return tuple(axis for axis in range(3) if mirrorMap(geometry, axis, tolerance) is not None)
+
+
+def reflectedCards(flat, exTag, exSegment, axes, tolerance=1e-6):
+	''' Return (names, ints, floats, tag increment, EX tag, EX segment) for a GX deck that builds the same
+		segments as the GW cards in flat (a CardStore, e.g. from Model.flatCards()): the columns of the
+		cards for just the part of the structure on the EX segment's side of each plane in axes, which a GX
+		card with that tag increment reflects back into the whole. Wires that cross a plane are cut there,
+		which only works where the plane falls on a segment boundary. Returns None if the structure can't
+		be written that way: it isn't symmetric, a wire lies in a plane or is cut mid segment, or the EX
+		segment straddles a plane.
+	'''
+	original = compileCards(flat)
+	if not axes or not len(original):
+		return None
+	feed = original.centers[original.segmentIndex(exTag, exSegment)]
+	near = tolerance * max(numpy.abs(original.starts).max(), numpy.abs(original.ends).max())
+	ints, floats = flat.columns()
+	for axis in axes:
+		side = numpy.sign(feed[axis]) if abs(feed[axis]) > near else 0.0
+		if side == 0.0:
+			return None
+		a1, a2 = side * floats[:, axis], side * floats[:, axis + 3]
+		if ((numpy.abs(a1) <= near) & (numpy.abs(a2) <= near)).any():
+			return None  # a wire in the plane would be its own reflection
+		inside  = (a1 > near) | (a2 > near)
+		outside = (a1 < -near) | (a2 < -near)
+		ints, floats = ints[inside].copy(), floats[inside].copy()
+		for row in numpy.nonzero(outside[inside])[0]:
+			# The wire crosses the plane: keep the whole segments on the feed's side
+			segments = ints[row, 1]
+			start, end = side * floats[row, axis], side * floats[row, axis + 3]
+			t = start / (start - end)
+			cut = int(round(t * segments))
+			if cut <= 0 or cut >= segments or abs(t * segments - cut) > 1e-6 * segments:
+				return None
+			point = floats[row, 0:3] + (floats[row, 3:6] - floats[row, 0:3]) * (float(cut) / segments)
+			point[axis] = 0.0
+			if start > 0.0:
+				floats[row, 3:6], ints[row, 1] = point, cut
+			else:
+				floats[row, 0:3], ints[row, 1] = point, segments - cut
+	names = ['GW'] * len(ints)
+	tagIncrement = int(ints[:, 0].max())
+	half = _compile(names, ints, floats, [])
+	rebuilt = reflectGeometry(half, axes, tagIncrement)
+	image = matchSegments(rebuilt.starts, rebuilt.ends, rebuilt.radii, original, tolerance)
+	if len(rebuilt) != len(original) or (image < 0).any() or len(numpy.unique(image)) != len(image):
+		return None
+	i = original.segmentIndex(exTag, exSegment)
+	feedIndex = matchSegments(original.starts[i:i+1], original.ends[i:i+1], original.radii[i:i+1], half, tolerance)[0]
+	if feedIndex < 0:
+		return None
+	return names, ints, floats, tagIncrement, int(half.tags[feedIndex]), int(half.segments[feedIndex])
@@ -0,0 +1,189 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Wire connectivity. Whether a model's wires are joined where they're meant to be (a GW wire's end and the
+end of the arc that addArc rotated and translated next to it, say) comes down to floating point
+coordinates agreeing after the GM transforms, so ends are snapped together within a tolerance instead of
+compared exactly. Every wire end is hashed to a cell of a grid as fine as the largest snapping distance,
+compared only with the ends in the 27 cells around it, and the close pairs are merged into junction nodes,
+in time linear in the number of wires. A wire end can also land on the joint between two segments inside
+another wire, which nec2 treats as a junction too; those joints are the node's taps.
+
+The result is a JunctionGraph of flat arrays: the node of each wire end, the position and multiplicity
+(segment ends meeting) of each node, and the wires at each node, with queries such as which wires touch a
+given tag.
+
+Usage:
+
+  graph = nec2junction.junctionGraph(nec2geometry.compileGeometry(model))
+  graph.touching(3)        # tags of the wires joined to tag 3
+  graph.junctions()        # nodes where wires meet
+  graph.freeEnds()         # wire ends that aren't joined to anything
+'''
+
+import numpy
+
+
+JUNCTION_TOLERANCE = 1e-3  # Ends closer than this times the shorter of their segments are joined
+MAX_CELLS          = 1 << 20  # Grid cells per axis at most, so packed cell keys fit in 64 bits
+
+
+# =======================================================================================================
+# Junction graph
+# =======================================================================================================
+
+class JunctionGraph:
+	def __init__(self, geometry, endNodes, tapSegments, tapNodes, positions):
+		''' Connectivity of the wires (GW/GA cards) of a compiled nec2geometry.Geometry. endNodes is the
+			(wires, 2) node index of the start and end of each wire, tapSegments the segments whose end is a
+			joint inside a wire that another wire's end landed on, and tapNodes their nodes. positions holds
+			each node's location, the average of the ends snapped into it.
+		'''
+		self.geometry    = geometry
+		self.first, self.last = geometry.cardRanges()
+		self.tags        = geometry.tags[self.first]
+		self.endNodes    = endNodes
+		self.tapSegments = tapSegments
+		self.tapNodes    = tapNodes
+		self.positions   = positions
+		count = len(positions)
+		self.multiplicity = (numpy.bincount(endNodes.ravel(), minlength=count) +
+		                     2 * numpy.bincount(tapNodes, minlength=count))  # segment ends meeting at each node
+
+		# The wires at each node (a wire twice if both its ends are there), as offsets into members
+		wires = numpy.r_[numpy.repeat(numpy.arange(len(endNodes)), 2), geometry.cards[tapSegments]]
+		nodes = numpy.r_[endNodes.ravel(), tapNodes]
+		order = numpy.argsort(nodes, kind='stable')
+		self.members = wires[order]
+		self.offsets = numpy.r_[0, numpy.cumsum(numpy.bincount(nodes, minlength=count))]
+
+	def __len__(self):
+		return len(self.positions)
+
+	def wiresAt(self, node):
+		''' Return the wire indices (GW/GA card numbers) at a node
+		'''
+		return self.members[self.offsets[node]:self.offsets[node + 1]]
+
+	def junctions(self):
+		''' Return the nodes where more than one segment end meets another wire
+		'''
+		return numpy.nonzero(self.multiplicity > 1)[0]
+
+	def freeEnds(self):
+		''' Return (wires, sides) of the wire ends that aren't joined to anything (side 0 is a wire's start)
+		'''
+		wires, sides = numpy.nonzero(self.multiplicity[self.endNodes] == 1)
+		return wires, sides
+
+	def neighbors(self, wire):
+		''' Return the other wires joined to a wire, at its ends or by a tap
+		'''
+		nodes = numpy.r_[self.endNodes[wire], self.tapNodes[self.geometry.cards[self.tapSegments] == wire]]
+		found = numpy.concatenate([self.wiresAt(node) for node in nodes]) if len(nodes) else numpy.zeros(0, dtype=int)
+		return numpy.setdiff1d(found, [wire])
+
+	def touching(self, tag):
+		''' Return the tags of the wires joined to the wires with the given tag
+		'''
+		wires = numpy.nonzero(self.tags == tag)[0]
+		if not len(wires):
+			raise ValueError("no wire has tag {}".format(tag))
+		others = numpy.unique(numpy.concatenate([self.neighbors(w) for w in wires]))
+		return numpy.setdiff1d(self.tags[others], [tag])
+
+	def components(self):
+		''' Return the index of the connected structure each wire belongs to, numbered from 0 in order of
+			each structure's first wire
+		'''
+		count = len(self.endNodes)
+		edges = [(numpy.arange(count), self.endNodes[:, 0] + count), (numpy.arange(count), self.endNodes[:, 1] + count),
+		         (self.geometry.cards[self.tapSegments], self.tapNodes + count)]
+		a = numpy.concatenate([e[0] for e in edges])
+		b = numpy.concatenate([e[1] for e in edges])
+		labels = _mergeLabels(count + len(self), a, b)[:count]
+		return numpy.unique(labels, return_inverse=True)[1].ravel()
+
+
+# =======================================================================================================
+# Building the graph
+# =======================================================================================================
+
+def _mergeLabels(count, a, b):
+	''' Return, for count items joined by the pairs (a[k], b[k]), the smallest index in each one's group
+	'''
+	labels = numpy.arange(count)
+	while True:
+		low = numpy.minimum(labels[a], labels[b])
+		before = labels.copy()
+		numpy.minimum.at(labels, a, low)
+		numpy.minimum.at(labels, b, low)
+		labels = labels[labels]  # point every item at its label's label
+		if (labels == before).all():
+			return labels
+
+
+def _closePairs(points, scales, others, otherScales, tolerance, same):
+	''' Return (i, j) for every point i and other point j closer than tolerance times the smaller of their
+		scales, using a grid hash. With same, others is points itself and only pairs i < j are returned.
+	'''
+	if not len(points) or not len(others):
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	everything = numpy.concatenate([points, others])
+	low, high = everything.min(axis=0), everything.max(axis=0)
+	cell = max(tolerance * max(scales.max(), otherScales.max()), (high - low).max() / MAX_CELLS, 1e-300)
+	size = numpy.floor((high - low) / cell).astype(numpy.int64) + 3
+	pack = lambda c: (c[:, 0] * size[1] + c[:, 1]) * size[2] + c[:, 2]
+	keys = pack(numpy.floor((others - low) / cell).astype(numpy.int64) + 1)
+	order = numpy.argsort(keys, kind='stable')
+	sortedKeys = keys[order]
+	cells = numpy.floor((points - low) / cell).astype(numpy.int64) + 1
+	pairs = []
+	for dx in (-1, 0, 1):
+		for dy in (-1, 0, 1):
+			for dz in (-1, 0, 1):
+				wanted = pack(cells + (dx, dy, dz))
+				begin = numpy.searchsorted(sortedKeys, wanted, side='left')
+				end   = numpy.searchsorted(sortedKeys, wanted, side='right')
+				counts = end - begin
+				i = numpy.repeat(numpy.arange(len(points)), counts)
+				j = order[numpy.repeat(begin - numpy.r_[0, numpy.cumsum(counts)[:-1]], counts) + numpy.arange(counts.sum())]
+				pairs.append((i, j))
+	i = numpy.concatenate([p[0] for p in pairs])
+	j = numpy.concatenate([p[1] for p in pairs])
+	if same:
+		i, j = i[i < j], j[i < j]
+	distance = numpy.sqrt(((points[i] - others[j])**2).sum(axis=1))
+	close = distance <= tolerance * numpy.minimum(scales[i], otherScales[j])
+	return i[close], j[close]
+
+
+def junctionGraph(geometry, tolerance=JUNCTION_TOLERANCE):
+	''' Snap the wire ends of a compiled nec2geometry.Geometry into junction nodes and return the
+		JunctionGraph. Ends closer than tolerance times the shorter of their segments are joined, and so are
+		chains of them.
+	'''
+	first, last = geometry.cardRanges()
+	wires = len(first)
+	# Wire ends in the order starts of every wire, then ends of every wire
+	segments = numpy.r_[first, last - 1]
+	points   = numpy.concatenate([geometry.starts[first], geometry.ends[last - 1]])
+	scales   = geometry.lengths[segments]
+	i, j = _closePairs(points, scales, points, scales, tolerance, True)
+	labels = _mergeLabels(len(points), i, j)
+	roots, nodes = numpy.unique(labels, return_inverse=True)
+	nodes = nodes.ravel()  # numbered in order of each node's first end
+	positions = numpy.zeros((len(roots), 3))
+	numpy.add.at(positions, nodes, points)
+	positions /= numpy.bincount(nodes, minlength=len(roots))[:, None]
+
+	# Joints inside wires that a wire end landed on
+	inside = numpy.ones(len(geometry), dtype=bool)
+	inside[last - 1] = False
+	joints = numpy.nonzero(inside)[0]
+	jointScales = numpy.minimum(geometry.lengths[joints], geometry.lengths[numpy.minimum(joints + 1, len(geometry) - 1)])
+	e, k = _closePairs(points, scales, geometry.ends[joints], jointScales, tolerance, False)
+	tapSegments, index = numpy.unique(joints[k], return_index=True)
+	tapNodes = nodes[e[index]]
+	return JunctionGraph(geometry, nodes.reshape(2, wires).T.copy(), tapSegments, tapNodes, positions)
@@ -0,0 +1,223 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Pattern figures of merit without keeping patterns around. A PatternMetrics takes the gain samples of one
+frequency in any order and in blocks of any size, and keeps only running reductions: the peak, and the
+highest gain seen in each cell of a fixed theta x phi grid. From those it works out the peak gain and its
+direction, front-to-back ratio, -3 dB beamwidths in azimuth and elevation, and the sidelobe level. At the
+default 2 degree resolution that's 65 KB while a frequency is being accumulated, however many samples
+go in, and nine numbers once it's done (see metricsArrays).
+
+Samples can come from the built in far field calculation (farFieldMetrics) or from the RP tables of a
+nec2c output file (outputMetrics), one frequency at a time.
+
+Usage:
+
+  result = nec2solver.solve(model, 145.5, 0.05, 40)
+  for metrics in nec2metrics.farFieldMetrics(result):
+      metrics.frequency, metrics.gain, metrics.frontToBack, metrics.azimuthBeamwidth
+
+  nec2metrics.outputMetrics('yagi.out')
+'''
+
+import math
+
+import numpy
+
+from nec2pattern import decibels, farField, inputPower, intensity
+
+
+DIRECTIONS_PER_BLOCK = 1 << 16  # Far field directions evaluated per block by farFieldMetrics
+METRIC_FIELDS = ('frequency', 'gain', 'theta', 'phi', 'frontToBack', 'azimuthBeamwidth', 'elevationBeamwidth',
+                 'sidelobeLevel', 'samples')
+
+
+# =======================================================================================================
+# Metrics
+# =======================================================================================================
+
+class Metrics:
+	def __init__(self, frequency, gain, theta, phi, frontToBack, azimuthBeamwidth, elevationBeamwidth,
+	             sidelobeLevel, samples):
+		''' Figures of merit for one frequency: peak gain in dBi and its theta, phi in degrees; front-to-back
+			ratio in dB (peak over the gain in the opposite direction); -3 dB beamwidths in degrees of the
+			azimuth and elevation cuts through the peak; sidelobe level in dB relative to the peak (the
+			highest gain outside both the main lobe and the lobe around the opposite direction, each out to
+			its first minima, so it's nan for a pattern with just those two); and the number of samples they
+			came from. Figures the samples can't determine are nan.
+		'''
+		self.frequency          = frequency
+		self.gain               = gain
+		self.theta              = theta
+		self.phi                = phi
+		self.frontToBack        = frontToBack
+		self.azimuthBeamwidth   = azimuthBeamwidth
+		self.elevationBeamwidth = elevationBeamwidth
+		self.sidelobeLevel      = sidelobeLevel
+		self.samples            = samples
+
+
+def metricsArrays(metrics):
+	''' Return a dict with one array per field of METRIC_FIELDS, for a list of Metrics (one per frequency)
+	'''
+	return dict((name, numpy.array([getattr(m, name) for m in metrics], dtype=float)) for name in METRIC_FIELDS)
+
+
+# =======================================================================================================
+# Running reductions
+# =======================================================================================================
+
+class PatternMetrics:
+	def __init__(self, frequency, resolution=2.0):
+		''' Accumulate gain samples for one frequency (in MHz) into a table of the highest gain in each cell
+			of a theta x phi grid with cells resolution degrees wide
+		'''
+		self.frequency  = frequency
+		self.resolution = resolution
+		self.samples    = 0
+		self.gain, self.theta, self.phi = -numpy.inf, numpy.nan, numpy.nan
+		self.table = numpy.full((int(round(180.0 / resolution)) + 1, int(round(360.0 / resolution))), -numpy.inf,
+		                        dtype=numpy.float32)
+
+	def add(self, theta, phi, gain):
+		''' Fold in a block of samples: equal length arrays of theta and phi in degrees and gain in dBi.
+			Angles outside theta 0-180 and phi 0-360 are mapped onto the equivalent direction.
+		'''
+		theta = numpy.mod(numpy.ravel(numpy.asarray(theta, dtype=float)), 360.0)
+		phi   = numpy.ravel(numpy.asarray(phi, dtype=float))
+		gain  = numpy.ravel(numpy.asarray(gain, dtype=float))
+		if not len(gain):
+			return
+		over = theta > 180.0
+		theta = numpy.where(over, 360.0 - theta, theta)
+		phi = numpy.mod(numpy.where(over, phi + 180.0, phi), 360.0)
+		i = numpy.argmax(gain)
+		if gain[i] > self.gain:
+			self.gain, self.theta, self.phi = gain[i], theta[i], phi[i]
+		self.samples += len(gain)
+		rows, columns = self.table.shape
+		cells = numpy.rint(theta / self.resolution).astype(int) * columns
+		cells += numpy.rint(phi / self.resolution).astype(int) % columns
+		order = numpy.lexsort((gain, cells))
+		order = order[numpy.r_[cells[order][1:] != cells[order][:-1], True]]  # the highest gain in each cell
+		table = self.table.reshape(-1)
+		table[cells[order]] = numpy.maximum(table[cells[order]], gain[order])
+
+	def metrics(self):
+		''' Return the Metrics of the samples so far. Beamwidths and sidelobes come from the azimuth cut through
+			the peak and the elevation cut through the peak (continued over the poles to the far side), the
+			front-to-back ratio from the elevation cut at the direction opposite the peak.
+		'''
+		if not self.samples:
+			return Metrics(self.frequency, *([numpy.nan] * 7 + [0]))
+		rows, columns = self.table.shape
+		row = int(round(self.theta / self.resolution))
+		column = int(round(self.phi / self.resolution)) % columns
+		opposite = (column + columns // 2) % columns
+		theta = numpy.arange(rows) * self.resolution
+		azimuth = _cut(numpy.arange(columns) * self.resolution, self.table[row])
+		elevation = _cut(numpy.r_[theta, 360.0 - theta[::-1]], numpy.r_[self.table[:, column], self.table[::-1, opposite]])
+		azimuthWidth, azimuthSidelobe = _lobe(azimuth[0], azimuth[1], self.phi + 180.0)
+		elevationWidth, elevationSidelobe = _lobe(elevation[0], elevation[1], self.theta + 180.0)
+		back = numpy.interp(self.theta + 180.0, elevation[0], elevation[1], period=360.0) if len(elevation[0]) else numpy.nan
+		sidelobes = [s for s in (azimuthSidelobe, elevationSidelobe) if not math.isnan(s)]
+		sidelobe = max(sidelobes) - self.gain if sidelobes else numpy.nan
+		return Metrics(self.frequency, self.gain, self.theta, self.phi, self.gain - back, azimuthWidth,
+		               elevationWidth, sidelobe, self.samples)
+
+
+def _cut(angles, gains):
+	''' Return the (angles, gains) of the cells of a cut that hold samples
+	'''
+	filled = numpy.isfinite(gains)
+	return angles[filled], gains[filled].astype(float)
+
+
+def _lobe(angles, gains, back):
+	''' Return (beamwidth, highest sidelobe gain) of a circular cut sampled at angles (degrees, repeating
+		every 360): the -3 dB width of the lobe around the highest sample, and the highest sample outside the
+		first minima of both that lobe and the one around the angle back, or nan where there's none
+	'''
+	n = len(angles)
+	if n < 2:
+		return numpy.nan, numpy.nan
+	index = numpy.arange(n)
+	order = numpy.argsort(angles, kind='stable')
+	angles, gains = angles[order], gains[order]
+	extended = numpy.r_[angles - 360.0, angles, angles + 360.0]
+	source = numpy.r_[index, index, index]
+	g = gains[source]
+	peak = n + numpy.argmax(gains)
+	threshold = g[peak] - 3.0
+	crossings, edges = [], []
+	for walk in (numpy.arange(peak, len(g)), numpy.arange(peak, -1, -1)):
+		walk = walk[numpy.abs(extended[walk] - extended[peak]) < 360.0]
+		below = numpy.nonzero(g[walk] < threshold)[0]
+		if not len(below):
+			return numpy.nan, numpy.nan
+		k = below[0]
+		a, b = walk[k - 1], walk[k]
+		crossings.append(extended[a] + (extended[b] - extended[a]) * (g[a] - threshold) / (g[a] - g[b]))
+		rising = numpy.nonzero(numpy.diff(g[walk[k:]]) > 0.0)[0]
+		edges.append(walk[k + rising[0]] if len(rising) else walk[-1])
+	inLobe = numpy.zeros(n, dtype=bool)
+	inLobe[source[edges[1]:edges[0] + 1]] = True
+
+	# The back lobe runs from the sample nearest back, uphill if it's on a slope, to the first minimum past
+	# it on either side
+	start = n + numpy.argmin(numpy.abs(numpy.mod(angles - back + 180.0, 360.0) - 180.0))
+	ends = []
+	for walk in (numpy.arange(start, len(g)), numpy.arange(start, -1, -1)):
+		walk = walk[numpy.abs(extended[walk] - extended[start]) < 360.0]
+		steps = numpy.diff(g[walk])
+		falling = numpy.nonzero(steps < 0.0)[0]
+		first = falling[0] if len(falling) else len(steps)
+		rising = numpy.nonzero(steps[first:] > 0.0)[0]
+		ends.append(walk[first + rising[0]] if len(rising) else walk[-1])
+	inLobe[source[ends[1]:ends[0] + 1]] = True
+	outside = gains[~inLobe]
+	return crossings[0] - crossings[1], (outside.max() if len(outside) else numpy.nan)
+
+
+# =======================================================================================================
+# Sample sources
+# =======================================================================================================
+
+def farFieldMetrics(result, theta=None, phi=None, resolution=2.0, index=None):
+	''' Return the Metrics of each frequency of a nec2solver.Result (or only frequency number index),
+		computing the far field on the theta x phi grid (degrees, default every 2 degrees) a block of rows
+		at a time, so no frequency's pattern is ever held whole
+	'''
+	theta = numpy.arange(0.0, 181.0, 2.0) if theta is None else numpy.asarray(theta, dtype=float)
+	phi   = numpy.arange(0.0, 360.0, 2.0) if phi is None else numpy.asarray(phi, dtype=float)
+	rows  = max(1, DIRECTIONS_PER_BLOCK // max(len(phi), 1))
+	indices = range(len(result.frequencies)) if index is None else [index]
+	metrics = []
+	for i in indices:
+		accumulator = PatternMetrics(result.frequencies[i], resolution)
+		power = inputPower(result, i)
+		for a in range(0, len(theta), rows):
+			tt, pp = numpy.meshgrid(theta[a:a + rows], phi, indexing='ij')
+			eTheta, ePhi = farField(result, tt.ravel(), pp.ravel(), i)
+			accumulator.add(tt, pp, decibels(4.0 * math.pi * intensity(eTheta, ePhi) / power))
+		metrics.append(accumulator.metrics())
+	return metrics
+
+
+def recordMetrics(records, resolution=2.0):
+	''' Generate the Metrics of each nec2output.Record that has a radiation pattern, e.g. as they stream out
+		of nec2output.iterRecords()
+	'''
+	for record in records:
+		if record.pattern is not None and len(record.pattern):
+			accumulator = PatternMetrics(record.frequency, resolution)
+			accumulator.add(record.pattern.theta, record.pattern.phi, record.pattern.gains[:, 2])
+			yield accumulator.metrics()
+
+
+def outputMetrics(fileName, resolution=2.0):
+	''' Return the Metrics of each frequency in a nec2c output file, reading it one frequency at a time
+	'''
+	from nec2output import iterRecords
+	return list(recordMetrics(iterRecords(fileName), resolution))
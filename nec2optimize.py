@@ -0,0 +1,344 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Tune geometry parameters automatically instead of editing a correction factor and re-checking xnec2c.
+Give it a function that builds a Model from named parameters, the range each parameter may take, and an
+objective (lowest SWR at a frequency, or closest match to a target impedance), and one of three derivative
+free methods searches for the best values:
+
+  golden      golden-section search, for a single parameter
+  neldermead  Nelder-Mead simplex, for a few parameters
+  bayesian    Gaussian process model of the objective with expected improvement, for when every solve is
+              expensive
+
+Each method hands out independent solves in batches to a pool of worker processes, stops early once the
+objective reaches a goal or stops improving, and reports how many solves it took.
+
+Usage:
+
+  def buildYagi(correctionFactor):
+      ...
+      return model
+
+  best = nec2optimize.optimize(buildYagi, {'correctionFactor': (0.90, 0.98)}, nec2optimize.SwrObjective(146.31))
+  best.parameters, best.value, best.solves
+'''
+
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import nec2solver
+
+
+# =======================================================================================================
+# Objectives
+# =======================================================================================================
+
+class SwrObjective:
+	def __init__(self, targetMHz, z0=50.0):
+		''' Minimize the SWR at targetMHz on a line with characteristic impedance z0
+		'''
+		self.targetMHz = targetMHz
+		self.z0        = z0
+
+	def __call__(self, impedance):
+		return float(nec2solver.swr(impedance, self.z0))
+
+
+class ImpedanceObjective:
+	def __init__(self, targetMHz, target):
+		''' Minimize the distance |Z - target| in ohms between the input impedance at targetMHz and target
+		'''
+		self.targetMHz = targetMHz
+		self.target    = complex(target)
+
+	def __call__(self, impedance):
+		return float(abs(impedance - self.target))
+
+
+def _score(build, parameters, objective):
+	''' Solve one variant at the objective's frequency and return (objective value, input impedance)
+	'''
+	result = nec2solver.solve(build(**parameters), objective.targetMHz, 0.0, 1)
+	impedance = complex(result.impedance[0])
+	return objective(impedance), impedance
+
+
+# =======================================================================================================
+# Bookkeeping shared by the methods
+# =======================================================================================================
+
+class OptimizeResult:
+	def __init__(self, names):
+		''' Outcome of an optimization: the best parameters, their objective value and impedance, how many
+			solves it took, why it stopped, and the history of (parameters, value) for every solve
+		'''
+		self.names      = names
+		self.parameters = None
+		self.value      = math.inf
+		self.impedance  = None
+		self.solves     = 0
+		self.elapsed    = 0.0
+		self.stopReason = ''
+		self.history    = []
+
+
+class _StopSearch(Exception):
+	pass
+
+
+class _Evaluator:
+	def __init__(self, build, bounds, objective, fixed, pool, maxSolves, goal, result):
+		''' Evaluate batches of points (in the unit cube, one axis per bounded parameter) through the worker
+			pool, remembering every value and stopping the search when the solve budget runs out or a value
+			reaches the goal
+		'''
+		self.build     = build
+		self.names     = sorted(bounds)
+		self.low       = numpy.array([bounds[name][0] for name in self.names], dtype=float)
+		self.high      = numpy.array([bounds[name][1] for name in self.names], dtype=float)
+		self.objective = objective
+		self.fixed     = fixed or {}
+		self.pool      = pool
+		self.maxSolves = maxSolves
+		self.goal      = goal
+		self.result    = result
+		self.memo      = {}
+
+	def parameters(self, point):
+		values = self.low + numpy.clip(point, 0.0, 1.0) * (self.high - self.low)
+		parameters = dict(self.fixed)
+		parameters.update(zip(self.names, values.tolist()))
+		return parameters
+
+	def __call__(self, points):
+		''' Return the objective value at each point, solving the ones not seen before in parallel
+		'''
+		points = [numpy.clip(numpy.asarray(p, dtype=float), 0.0, 1.0) for p in points]
+		keys = [tuple(numpy.round(p, 12).tolist()) for p in points]
+		pending = []
+		for key in keys:
+			if key not in self.memo and key not in pending:
+				pending.append(key)
+		if self.result.solves + len(pending) > self.maxSolves:
+			pending = pending[:max(self.maxSolves - self.result.solves, 0)]
+			if not pending:
+				raise _StopSearch('solve budget of {} used up'.format(self.maxSolves))
+		jobs = [self.parameters(numpy.array(key)) for key in pending]
+		if self.pool is None:
+			outcomes = [_score(self.build, parameters, self.objective) for parameters in jobs]
+		else:
+			futures = [self.pool.submit(_score, self.build, parameters, self.objective) for parameters in jobs]
+			outcomes = [future.result() for future in futures]
+		for key, parameters, (value, impedance) in zip(pending, jobs, outcomes):
+			self.memo[key] = value
+			self.result.solves += 1
+			self.result.history.append((parameters, value))
+			if value < self.result.value:
+				self.result.value, self.result.parameters, self.result.impedance = value, parameters, impedance
+		if self.goal is not None and self.result.value <= self.goal:
+			raise _StopSearch('reached the goal of {}'.format(self.goal))
+		if any(key not in self.memo for key in keys):
+			raise _StopSearch('solve budget of {} used up'.format(self.maxSolves))
+		return numpy.array([self.memo[key] for key in keys])
+
+
+# =======================================================================================================
+# Methods
+# =======================================================================================================
+
+GOLDEN = (math.sqrt(5.0) - 1.0) / 2.0
+
+
+def _golden(evaluate, dimensions, tolerance, patience, workers):
+	''' Golden-section search on [0, 1]. The first two probes are solved together; every step after that
+		needs just one new solve, so extra workers don't help it.
+	'''
+	if dimensions != 1:
+		raise ValueError("golden-section search takes exactly one parameter")
+	a, b = 0.0, 1.0
+	c, d = b - GOLDEN * (b - a), a + GOLDEN * (b - a)
+	fc, fd = evaluate([[c], [d]])
+	while b - a > tolerance:
+		if fc < fd:
+			b, d, fd = d, c, fc
+			c = b - GOLDEN * (b - a)
+			fc = evaluate([[c]])[0]
+		else:
+			a, c, fc = c, d, fd
+			d = a + GOLDEN * (b - a)
+			fd = evaluate([[d]])[0]
+	return 'bracket narrowed to {}'.format(tolerance)
+
+
+def _nelderMead(evaluate, dimensions, tolerance, patience, workers):
+	''' Nelder-Mead simplex search in the unit cube. The starting simplex and any shrink step are solved as
+		one batch, and with more than one worker the reflection, expansion, and both contractions are solved
+		together speculatively, so each iteration takes a single round trip to the pool.
+	'''
+	simplex = numpy.vstack([numpy.full(dimensions, 0.5), 0.5 + 0.25 * numpy.identity(dimensions)])
+	values  = evaluate(simplex)
+	best, stale = values.min(), 0
+	while True:
+		order = numpy.argsort(values)
+		simplex, values = simplex[order], values[order]
+		if numpy.abs(simplex[1:] - simplex[0]).max() < tolerance:
+			return 'simplex shrank to {}'.format(tolerance)
+		centroid = simplex[:-1].mean(axis=0)
+		worst = simplex[-1]
+		reflect = centroid + (centroid - worst)
+		candidates = {'reflect': reflect}
+		if workers > 1:
+			candidates['expand'] = centroid + 2.0 * (centroid - worst)
+			candidates['outside'] = centroid + 0.5 * (centroid - worst)
+			candidates['inside'] = centroid - 0.5 * (centroid - worst)
+		computed = dict(zip(candidates, evaluate(list(candidates.values()))))
+
+		def value(name, point):
+			if name not in computed:
+				candidates[name] = point
+				computed[name] = evaluate([point])[0]
+			return computed[name]
+
+		fr = computed['reflect']
+		if fr < values[0]:
+			fe = value('expand', centroid + 2.0 * (centroid - worst))
+			simplex[-1], values[-1] = (candidates['expand'], fe) if fe < fr else (reflect, fr)
+		elif fr < values[-2]:
+			simplex[-1], values[-1] = reflect, fr
+		else:
+			if fr < values[-1]:
+				name, point = 'outside', centroid + 0.5 * (centroid - worst)
+				limit = fr
+			else:
+				name, point = 'inside', centroid - 0.5 * (centroid - worst)
+				limit = values[-1]
+			fc = value(name, point)
+			if fc < limit:
+				simplex[-1], values[-1] = candidates[name], fc
+			else:
+				simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+				values[1:] = evaluate(simplex[1:])
+		if values.min() < best - tolerance * max(abs(best), 1.0):
+			best, stale = values.min(), 0
+		else:
+			stale += 1
+			if stale >= patience:
+				return 'no improvement in {} iterations'.format(patience)
+
+
+def _bayesian(evaluate, dimensions, tolerance, patience, workers):
+	''' Bayesian optimization: fit a Gaussian process (squared exponential kernel, length scale picked by
+		marginal likelihood from a short list) to every value so far, then solve the batch of candidates with
+		the highest expected improvement. Batches of more than one point pretend each pick came back at the
+		model's mean ("kriging believer") before choosing the next.
+	'''
+	random = numpy.random.RandomState(1)
+	batch  = max(workers, 1)
+	points = list(random.uniform(size=(max(2 * dimensions + 1, batch), dimensions)))
+	values = list(evaluate(points))
+	best, stale = min(values), 0
+	while True:
+		x, y = numpy.array(points), numpy.array(values)
+		picks = []
+		for i in range(batch):
+			gp = _GaussianProcess(x, y)
+			candidates = numpy.vstack([random.uniform(size=(512 * dimensions, dimensions)),
+			                           numpy.clip(x[numpy.argmin(y)] + 0.05 * random.normal(size=(64, dimensions)), 0.0, 1.0)])
+			mean, sigma = gp.predict(candidates)
+			improvement = _expectedImprovement(mean, sigma, y.min())
+			pick = candidates[numpy.argmax(improvement)]
+			picks.append(pick)
+			x = numpy.vstack([x, pick])
+			y = numpy.r_[y, gp.predict(pick[None])[0]]
+		new = evaluate(picks)
+		points.extend(picks)
+		values.extend(new)
+		if min(values) < best - tolerance * max(abs(best), 1.0):
+			best, stale = min(values), 0
+		else:
+			stale += 1
+			if stale >= patience:
+				return 'no improvement in {} rounds'.format(patience)
+
+
+class _GaussianProcess:
+	def __init__(self, x, y):
+		''' Zero mean GP on standardized values with a squared exponential kernel
+		'''
+		self.x = x
+		self.shift, self.scale = y.mean(), y.std() or 1.0
+		z = (y - self.shift) / self.scale
+		best = None
+		for length in (0.05, 0.1, 0.2, 0.4, 0.8):
+			K = self._kernel(x, x, length) + 1e-6 * numpy.identity(len(x))
+			try:
+				L = numpy.linalg.cholesky(K)
+			except numpy.linalg.LinAlgError:
+				continue
+			alpha = numpy.linalg.solve(L.T, numpy.linalg.solve(L, z))
+			likelihood = -0.5 * z.dot(alpha) - numpy.log(numpy.diag(L)).sum()
+			if best is None or likelihood > best[0]:
+				best = (likelihood, length, L, alpha)
+		_, self.length, self.L, self.alpha = best
+
+	def _kernel(self, a, b, length):
+		distance = ((a[:, None, :] - b[None, :, :])**2).sum(axis=2)
+		return numpy.exp(-0.5 * distance / length**2)
+
+	def predict(self, points):
+		''' Return the mean and standard deviation at points, in the units of the original values
+		'''
+		k = self._kernel(points, self.x, self.length)
+		mean = k.dot(self.alpha)
+		v = numpy.linalg.solve(self.L, k.T)
+		variance = numpy.maximum(1.0 - (v**2).sum(axis=0), 1e-12)
+		return self.shift + self.scale * mean, self.scale * numpy.sqrt(variance)
+
+
+def _expectedImprovement(mean, sigma, best):
+	z = (best - mean) / sigma
+	cdf = 0.5 * (1.0 + numpy.vectorize(math.erf)(z / math.sqrt(2.0)))
+	pdf = numpy.exp(-0.5 * z**2) / math.sqrt(2.0 * math.pi)
+	return (best - mean) * cdf + sigma * pdf
+
+
+METHODS = {'golden': _golden, 'neldermead': _nelderMead, 'bayesian': _bayesian}
+
+
+# =======================================================================================================
+# Entry point
+# =======================================================================================================
+
+def optimize(build, bounds, objective, method=None, fixed=None, workers=None, maxSolves=200, goal=None,
+             tolerance=1e-4, patience=10):
+	''' Search for the build(**parameters) that minimizes objective, where bounds maps each parameter being
+		tuned to its (low, high) range and fixed holds any other arguments build needs. method is 'golden',
+		'neldermead', or 'bayesian' (default: golden for one parameter, Nelder-Mead otherwise). The search
+		stops once the objective reaches goal, after patience iterations without improving by tolerance
+		(relative), when the search has converged to tolerance (as a fraction of each range), or after
+		maxSolves solves. Returns an OptimizeResult.
+	'''
+	names = sorted(bounds)
+	method = method or ('golden' if len(names) == 1 else 'neldermead')
+	if method not in METHODS:
+		raise ValueError("unknown method {!r}, expected one of {}".format(method, ', '.join(sorted(METHODS))))
+	workers = workers or multiprocessing.cpu_count()
+	result = OptimizeResult(names)
+	t0 = time.time()
+	pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+	try:
+		evaluate = _Evaluator(build, bounds, objective, fixed, pool, maxSolves, goal, result)
+		result.stopReason = METHODS[method](evaluate, len(names), tolerance, patience, workers)
+	except _StopSearch as stop:
+		result.stopReason = str(stop)
+	finally:
+		if pool is not None:
+			pool.shutdown()
+	result.elapsed = time.time() - t0
+	return result
@@ -0,0 +1,314 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Streaming reader for nec2c output files. A sweep with a fine RP grid can make an output file of hundreds
+of megabytes, so this reads it a line at a time and hands back one record per frequency: the antenna input
+parameters, the segment currents, and the radiation pattern. Nothing but the current frequency's tables is
+held in memory.
+
+Usage:
+
+  for record in nec2output.iterRecords('2m-fd-fed-yagi.out'):
+      record.frequency, record.impedance, record.currents, record.pattern
+
+  arrays = nec2output.writeArrays('2m-fd-fed-yagi.out', 'yagi-arrays')  # dict of numpy.memmap
+  arrays = nec2output.openArrays('yagi-arrays')                         # reopen them later
+'''
+
+import json
+import os
+import re
+
+import numpy
+
+from nec2utils import openCardFile
+
+
+# =======================================================================================================
+# Records
+# =======================================================================================================
+
+SENSES = ('LINEAR', 'RIGHT', 'LEFT')  # Polarization sense column of a pattern table, stored as an index
+
+
+class Sources:
+	def __init__(self, rows):
+		''' Antenna input parameters table: one row per voltage source
+		'''
+		rows = numpy.array(rows, dtype=float).reshape(-1, 11)
+		self.rows      = rows
+		self.tags      = rows[:, 0].astype(numpy.int64)
+		self.segments  = rows[:, 1].astype(numpy.int64)
+		self.voltage   = rows[:, 2] + 1j * rows[:, 3]
+		self.current   = rows[:, 4] + 1j * rows[:, 5]
+		self.impedance = rows[:, 6] + 1j * rows[:, 7]
+		self.admittance = rows[:, 8] + 1j * rows[:, 9]
+		self.power     = rows[:, 10]
+
+	def __len__(self):
+		return len(self.tags)
+
+
+class Currents:
+	def __init__(self, rows):
+		''' Currents and location table: one row per segment, centers and lengths in wavelengths
+		'''
+		rows = numpy.array(rows, dtype=float).reshape(-1, 10)
+		self.rows     = rows
+		self.segments = rows[:, 0].astype(numpy.int64)
+		self.tags     = rows[:, 1].astype(numpy.int64)
+		self.centers  = rows[:, 2:5]
+		self.lengths  = rows[:, 5]
+		self.current  = rows[:, 6] + 1j * rows[:, 7]
+
+	def __len__(self):
+		return len(self.tags)
+
+
+class Pattern:
+	def __init__(self, rows, senses):
+		''' Radiation pattern table: one row per (theta, phi) point. gains holds the vertical, horizontal,
+			and total gain in dB, and eTheta / ePhi the complex far field in volts/m.
+		'''
+		rows = numpy.array(rows, dtype=float).reshape(-1, 11)
+		self.rows       = rows
+		self.theta      = rows[:, 0]
+		self.phi        = rows[:, 1]
+		self.gains      = rows[:, 2:5]
+		self.axialRatio = rows[:, 5]
+		self.tilt       = rows[:, 6]
+		self.senses     = numpy.array(senses, dtype=numpy.int8)
+		self.eTheta     = _phasor(rows[:, 7], rows[:, 8])
+		self.ePhi       = _phasor(rows[:, 9], rows[:, 10])
+
+	def __len__(self):
+		return len(self.theta)
+
+
+class Record:
+	def __init__(self, frequency):
+		''' Everything the output file has to say about one frequency (in MHz). Tables the run didn't ask
+			for are None.
+		'''
+		self.frequency = frequency
+		self.sources   = None
+		self.currents  = None
+		self.pattern   = None
+
+	@property
+	def impedance(self):
+		''' Input impedance at the first source, in ohms
+		'''
+		return self.sources.impedance[0] if self.sources is not None and len(self.sources) else None
+
+
+def recordArrays(records):
+	''' Return a dict of arrays holding the tables of a list of records, for numpy.savez()
+	'''
+	arrays = {'frequencies': numpy.array([r.frequency for r in records], dtype=float)}
+	for i, record in enumerate(records):
+		for name in ('sources', 'currents', 'pattern'):
+			table = getattr(record, name)
+			if table is not None:
+				arrays['{}{}'.format(name, i)] = table.rows
+		if record.pattern is not None:
+			arrays['senses{}'.format(i)] = record.pattern.senses
+	return arrays
+
+
+def arrayRecords(arrays):
+	''' Rebuild the list of records saved by recordArrays()
+	'''
+	records = []
+	for i, frequency in enumerate(arrays['frequencies']):
+		record = Record(float(frequency))
+		if 'sources{}'.format(i) in arrays:
+			record.sources = Sources(arrays['sources{}'.format(i)])
+		if 'currents{}'.format(i) in arrays:
+			record.currents = Currents(arrays['currents{}'.format(i)])
+		if 'pattern{}'.format(i) in arrays:
+			record.pattern = Pattern(arrays['pattern{}'.format(i)], arrays['senses{}'.format(i)])
+		records.append(record)
+	return records
+
+
+def _phasor(magnitude, phaseDegrees):
+	return magnitude * numpy.exp(1j * numpy.radians(phaseDegrees))
+
+
+# =======================================================================================================
+# Parsing
+# =======================================================================================================
+
+_GLUED = re.compile(r'(?<=[0-9.])(?=-)')  # Fortran style fields can run together: "1.0E+00-2.5E-01"
+
+_SECTIONS = (
+	('ANTENNA INPUT PARAMETERS', 'sources'),
+	('CURRENTS AND LOCATION',    'currents'),
+	('RADIATION PATTERNS',       'pattern'),
+)
+_WIDTHS = {'sources': 11, 'currents': 10, 'pattern': 12}
+
+
+def _tokens(line, width):
+	''' Return the fields of a table row, or None if the line isn't a row of a table this wide
+	'''
+	tokens = line.split()
+	if len(tokens) != width:
+		tokens = _GLUED.sub(' ', line).split()
+		if len(tokens) != width:
+			return None
+	try:
+		float(tokens[0])
+	except ValueError:
+		return None
+	return tokens
+
+
+def _frequency(line):
+	''' Return the frequency from a "FREQUENCY= 1.4630E+02 MHZ" line, or None
+	'''
+	text = line.split('FREQUENCY', 1)[1].lstrip(' =:')
+	try:
+		return float(text.split()[0])
+	except (ValueError, IndexError):
+		return None
+
+
+def iterRecords(fileName):
+	''' Generate a Record for each frequency in a nec2c output file (gzip compressed if the name ends in .gz)
+	'''
+	outputFile = openCardFile(fileName, 'r')
+	try:
+		for record in _records(outputFile):
+			yield record
+	finally:
+		outputFile.close()
+
+
+def _records(lines):
+	record, section, rows, senses = None, None, [], []
+	for line in lines:
+		if 'FREQUENCY' in line and ('=' in line or ':' in line) and 'MHZ' in line.upper():
+			frequency = _frequency(line)
+			if frequency is not None:
+				_finish(record, section, rows, senses)
+				section, rows, senses = None, [], []
+				if record is not None:
+					yield record
+				record = Record(frequency)
+				continue
+		if record is None:
+			continue
+		for title, name in _SECTIONS:
+			if title in line:
+				_finish(record, section, rows, senses)
+				section, rows, senses = name, [], []
+				break
+		if section is None:
+			continue
+		tokens = _tokens(line, _WIDTHS[section])
+		if tokens is None:
+			if rows:
+				_finish(record, section, rows, senses)  # first line that isn't a row ends the table
+				section, rows, senses = None, [], []
+			continue
+		if section == 'pattern':
+			senses.append(SENSES.index(tokens[7]) if tokens[7] in SENSES else -1)
+			del tokens[7]
+		rows.append(tokens)
+	_finish(record, section, rows, senses)
+	if record is not None:
+		yield record
+
+
+def _finish(record, section, rows, senses):
+	''' Store a completed table in the record
+	'''
+	if record is None or section is None or not rows:
+		return
+	if section == 'sources':
+		record.sources = Sources(rows)
+	elif section == 'currents':
+		record.currents = Currents(rows)
+	else:
+		record.pattern = Pattern(rows, senses)
+
+
+# =======================================================================================================
+# Memory mapped arrays
+# =======================================================================================================
+
+_INDEX = 'arrays.json'
+
+
+def writeArrays(fileName, directory):
+	''' Stream a nec2c output file into raw arrays in directory, one frequency at a time, and return them as
+		a dict of read-only numpy.memmap:
+
+		  frequencies (F,)     MHz
+		  impedance   (F,)     complex input impedance at the first source
+		  currents    (F, S)   complex segment currents
+		  theta, phi  (P,)     pattern angles in degrees
+		  gains       (F, P, 3) vertical, horizontal, and total gain in dB
+		  eTheta, ePhi (F, P)  complex far field
+
+		Every frequency must have the same number of segments and pattern points.
+	'''
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	files, shapes, dtypes, counts = {}, {}, {}, {}
+
+	def append(name, values, dtype):
+		values = numpy.array(values, dtype=dtype)
+		if name not in files:
+			files[name] = open(os.path.join(directory, name + '.dat'), 'wb')
+			shapes[name] = list(values.shape)
+			dtypes[name] = numpy.dtype(dtype).str
+			counts[name] = 0
+		elif list(values.shape) != shapes[name]:
+			raise ValueError("{} changes shape from {} to {} between frequencies".format(name, shapes[name], list(values.shape)))
+		values.tofile(files[name])
+		counts[name] += 1
+
+	try:
+		for record in iterRecords(fileName):
+			append('frequencies', record.frequency, numpy.float64)
+			if record.sources is not None:
+				append('impedance', record.impedance, numpy.complex128)
+			if record.currents is not None:
+				append('currents', record.currents.current, numpy.complex128)
+			if record.pattern is not None:
+				if 'gains' not in files:
+					numpy.save(os.path.join(directory, 'theta.npy'), record.pattern.theta)
+					numpy.save(os.path.join(directory, 'phi.npy'), record.pattern.phi)
+				append('gains', record.pattern.gains, numpy.float64)
+				append('eTheta', record.pattern.eTheta, numpy.complex128)
+				append('ePhi', record.pattern.ePhi, numpy.complex128)
+	finally:
+		for f in files.values():
+			f.close()
+
+	index = {}
+	for name in files:
+		index[name] = {'dtype': dtypes[name], 'shape': [counts[name]] + shapes[name]}
+	with open(os.path.join(directory, _INDEX), 'w') as f:
+		json.dump(index, f, indent=1, sort_keys=True)
+	return openArrays(directory)
+
+
+def openArrays(directory, mode='r'):
+	''' Reopen the arrays written by writeArrays()
+	'''
+	with open(os.path.join(directory, _INDEX)) as f:
+		index = json.load(f)
+	arrays = {}
+	for name, entry in index.items():
+		path = os.path.join(directory, name + '.dat')
+		arrays[name] = numpy.memmap(path, dtype=entry['dtype'], mode=mode, shape=tuple(entry['shape']))
+	for name in ('theta', 'phi'):
+		path = os.path.join(directory, name + '.npy')
+		if os.path.exists(path):
+			arrays[name] = numpy.load(path, mmap_mode='r')
+	return arrays
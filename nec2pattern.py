@@ -0,0 +1,397 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Far field radiation patterns from the segment currents of a nec2solver.Result. Each segment radiates as
+a uniform current filament, so the field in a direction is a sum over segments of I * length * phase *
+sinc, evaluated for a whole block of directions at once. Blocks are sized to keep the (directions x
+segments) temporaries under CHUNK_ELEMENTS, so a 1 degree (or finer) grid costs time but not memory.
+
+Fields are r * E in volts (the 1/r and exp(-jkr) factors left out, as in nec2's output), for the 1 volt
+source. Gains are power gains relative to the input power, like nec2's POWER GAINS; directivity is
+relative to the power actually radiated, found by integrating over the whole sphere.
+
+Usage:
+
+  result = nec2solver.solve(model, 146.3, 0.0, 1)
+  pattern = nec2pattern.pattern(result, theta=numpy.arange(0, 181), phi=numpy.arange(0, 360))
+  pattern.gain.max(), pattern.directivity, pattern.axialRatio
+'''
+
+import math
+
+import numpy
+
+from nec2solver import CVEL, MU0
+
+
+CHUNK_ELEMENTS = 1 << 20        # Directions x segments evaluated per block
+ETA0 = MU0 * CVEL * 1.0e6       # Impedance of free space
+SENSES = ('LINEAR', 'RIGHT', 'LEFT')  # Same order as nec2output.SENSES
+LINEAR_AXIAL_RATIO = 1e-5       # Axial ratios below this count as linear polarization
+
+
+# =======================================================================================================
+# Fields
+# =======================================================================================================
+
+def directions(theta, phi):
+	''' Return the (n, 3) unit vectors, and the theta and phi unit vectors, for angles in degrees
+	'''
+	t, p = numpy.radians(theta), numpy.radians(phi)
+	st, ct, sp, cp = numpy.sin(t), numpy.cos(t), numpy.sin(p), numpy.cos(p)
+	r     = numpy.stack([st * cp, st * sp, ct], axis=1)
+	tHat  = numpy.stack([ct * cp, ct * sp, -st], axis=1)
+	pHat  = numpy.stack([-sp, cp, numpy.zeros_like(p)], axis=1)
+	return r, tHat, pHat
+
+
+def farField(result, theta, phi, index=0):
+	''' Return (eTheta, ePhi), the complex far field r * E at the angle pairs theta, phi (equal length arrays
+		in degrees) for frequency number index of the result
+	'''
+	theta = numpy.ravel(numpy.asarray(theta, dtype=float))
+	phi   = numpy.ravel(numpy.asarray(phi, dtype=float))
+	geometry = result.geometry
+	k = 2.0 * math.pi * result.frequencies[index] / CVEL
+	moments = (result.currents[index] * geometry.lengths)[:, None] * geometry.units  # I * length * direction
+	eTheta = numpy.empty(len(theta), dtype=complex)
+	ePhi   = numpy.empty(len(theta), dtype=complex)
+	block  = max(1, CHUNK_ELEMENTS // max(len(geometry), 1))
+	for a in range(0, len(theta), block):
+		b = a + block
+		r, tHat, pHat = directions(theta[a:b], phi[a:b])
+		phase = numpy.exp(1j * k * r.dot(geometry.centers.T))
+		phase *= numpy.sinc(k * r.dot(geometry.units.T) * geometry.lengths[None, :] / (2.0 * math.pi))
+		field = phase.dot(moments)  # (block, 3) vector sum of the segment moments
+		eTheta[a:b] = (field * tHat).sum(axis=1)
+		ePhi[a:b]   = (field * pHat).sum(axis=1)
+	factor = -1j * k * ETA0 / (4.0 * math.pi)
+	return factor * eTheta, factor * ePhi
+
+
+def intensity(eTheta, ePhi):
+	''' Return the radiation intensity (watts per steradian) of r * E field components
+	'''
+	return (numpy.abs(eTheta)**2 + numpy.abs(ePhi)**2) / (2.0 * ETA0)
+
+
+def radiatedPower(result, index=0, order=None):
+	''' Return the total radiated power in watts, by Gauss-Legendre quadrature in cos(theta) and the
+		trapezoid rule in phi. order defaults to enough points to resolve the structure's size in wavelengths.
+	'''
+	if order is None:
+		extent = numpy.ptp(result.geometry.centers, axis=0).max() if len(result.geometry) else 0.0
+		order = int(16 + 4 * math.ceil(2.0 * extent * result.frequencies[index] / CVEL))
+	x, w = numpy.polynomial.legendre.leggauss(order)
+	phi = numpy.arange(2 * order) * (360.0 / (2 * order))
+	theta = numpy.degrees(numpy.arccos(x))
+	tt, pp = numpy.meshgrid(theta, phi, indexing='ij')
+	eTheta, ePhi = farField(result, tt.ravel(), pp.ravel(), index)
+	u = intensity(eTheta, ePhi).reshape(tt.shape)
+	return (u.sum(axis=1) * (2.0 * math.pi / (2 * order))).dot(w)
+
+
+def inputPower(result, index=0):
+	''' Return the power delivered by the 1 volt source, in watts
+	'''
+	return 0.5 * (1.0 / result.impedance[index]).real
+
+
+def polarization(eTheta, ePhi):
+	''' Return (axial ratio, tilt in degrees, sense index into SENSES) of the polarization ellipse. The axial
+		ratio is minor / major axis; tilt is measured from the theta direction toward phi.
+	'''
+	s0 = numpy.abs(eTheta)**2 + numpy.abs(ePhi)**2
+	s1 = numpy.abs(eTheta)**2 - numpy.abs(ePhi)**2
+	s2 = 2.0 * (eTheta * ePhi.conj()).real
+	s3 = 2.0 * (eTheta * ePhi.conj()).imag
+	safe = numpy.where(s0 > 0.0, s0, 1.0)
+	chi = 0.5 * numpy.arcsin(numpy.clip(s3 / safe, -1.0, 1.0))
+	axialRatio = numpy.abs(numpy.tan(chi))
+	tilt = numpy.degrees(0.5 * numpy.arctan2(s2, s1))
+	sense = numpy.where(axialRatio < LINEAR_AXIAL_RATIO, 0, numpy.where(s3 > 0.0, 1, 2)).astype(numpy.int8)
+	return axialRatio, tilt, sense
+
+
+def decibels(ratio):
+	''' Return 10 log10(ratio), with -999.99 (nec2's floor) where the ratio is zero
+	'''
+	ratio = numpy.asarray(ratio, dtype=float)
+	return numpy.where(ratio > 0.0, 10.0 * numpy.log10(numpy.where(ratio > 0.0, ratio, 1.0)), -999.99)
+
+
+# =======================================================================================================
+# Patterns on a grid
+# =======================================================================================================
+
+class Pattern:
+	def __init__(self, frequency, theta, phi, eTheta, ePhi, inputPower, radiatedPower):
+		''' Far field on a theta x phi grid (1-D axes in degrees; 2-D arrays indexed [theta, phi]). Gains and
+			directivities are in dBi: gain, gainTheta ("vertical"), and gainPhi ("horizontal") relative to the
+			input power, directivity relative to the radiated power. Polarization comes from polarization().
+		'''
+		self.frequency     = frequency
+		self.theta         = theta
+		self.phi           = phi
+		self.eTheta        = eTheta
+		self.ePhi          = ePhi
+		self.inputPower    = inputPower
+		self.radiatedPower = radiatedPower
+		uTheta = numpy.abs(eTheta)**2 / (2.0 * ETA0)
+		uPhi   = numpy.abs(ePhi)**2 / (2.0 * ETA0)
+		self.gainTheta   = decibels(4.0 * math.pi * uTheta / inputPower)
+		self.gainPhi     = decibels(4.0 * math.pi * uPhi / inputPower)
+		self.gain        = decibels(4.0 * math.pi * (uTheta + uPhi) / inputPower)
+		self.directivity = decibels(4.0 * math.pi * (uTheta + uPhi) / radiatedPower)
+		self.axialRatio, self.tilt, self.sense = polarization(eTheta, ePhi)
+
+	@property
+	def efficiency(self):
+		''' Radiated over input power. The solver's wires are lossless, so anything but 1 is discretization
+			error.
+		'''
+		return self.radiatedPower / self.inputPower
+
+	def maximum(self):
+		''' Return (gain in dBi, theta, phi) at the grid's highest gain
+		'''
+		i, j = numpy.unravel_index(numpy.argmax(self.gain), self.gain.shape)
+		return self.gain[i, j], self.theta[i], self.phi[j]
+
+
+def pattern(result, theta, phi, index=0):
+	''' Return the Pattern of frequency number index of a nec2solver.Result on the grid of theta and phi
+		values (degrees)
+	'''
+	theta = numpy.asarray(theta, dtype=float)
+	phi   = numpy.asarray(phi, dtype=float)
+	tt, pp = numpy.meshgrid(theta, phi, indexing='ij')
+	eTheta, ePhi = farField(result, tt.ravel(), pp.ravel(), index)
+	shape = (len(theta), len(phi))
+	return Pattern(result.frequencies[index], theta, phi, eTheta.reshape(shape), ePhi.reshape(shape),
+	               inputPower(result, index), radiatedPower(result, index))
+
+
+def rpAngles(model):
+	''' Return the theta and phi axes of the grid the model's RP card asks for
+	'''
+	theta = model.RP_THETS + model.RP_DTH * numpy.arange(model.RP_NTH)
+	phi   = model.RP_PHIS + model.RP_DPH * numpy.arange(model.RP_NPH)
+	return theta, phi
+
+
+def rpPattern(model, result, index=0):
+	''' Return the Pattern on the grid of the model's RP card
+	'''
+	theta, phi = rpAngles(model)
+	return pattern(result, theta, phi, index)
+
+
+# =======================================================================================================
+# Adaptive sampling
+# =======================================================================================================
+
+class ScatteredPattern:
+	def __init__(self, frequency, theta, phi, eTheta, ePhi, inputPower, cells, corners):
+		''' Far field at scattered (theta, phi) samples in degrees, as found by adaptivePattern(). gain is the
+			total power gain in dBi at each sample. cells is the (n, 4) array of the leaf cells' theta0, theta1,
+			phi0, phi1, which tile the sampled range, and corners the (n, 4) sample indices at their
+			(theta0, phi0), (theta0, phi1), (theta1, phi0), (theta1, phi1) corners.
+		'''
+		self.frequency  = frequency
+		self.theta      = theta
+		self.phi        = phi
+		self.eTheta     = eTheta
+		self.ePhi       = ePhi
+		self.inputPower = inputPower
+		self.cells      = cells
+		self.corners    = corners
+		self.gain       = decibels(4.0 * math.pi * intensity(eTheta, ePhi) / inputPower)
+		self.axialRatio, self.tilt, self.sense = polarization(eTheta, ePhi)
+
+	def __len__(self):
+		return len(self.theta)
+
+	def interpolate(self, theta, phi):
+		''' Return the gain in dBi at the angles theta, phi (equal length arrays, or scalars), interpolated
+			bilinearly in dB across the leaf cell containing each point. Points outside every cell are nan.
+		'''
+		theta = numpy.atleast_1d(numpy.asarray(theta, dtype=float))
+		phi   = numpy.atleast_1d(numpy.asarray(phi, dtype=float))
+		gain  = numpy.full(len(theta), numpy.nan)
+		t0, t1, p0, p1 = self.cells.T
+		block = max(1, CHUNK_ELEMENTS // max(len(self.cells), 1))
+		for a in range(0, len(theta), block):
+			t, p = theta[a:a+block, None], phi[a:a+block, None]
+			inside = (t >= t0) & (t <= t1) & (p >= p0) & (p <= p1)
+			found = inside.any(axis=1)
+			cell = numpy.argmax(inside, axis=1)
+			u = (theta[a:a+block] - t0[cell]) / (t1[cell] - t0[cell])
+			v = (phi[a:a+block] - p0[cell]) / (p1[cell] - p0[cell])
+			g = self.gain[self.corners[cell]]
+			value = (1-u)*(1-v)*g[:, 0] + (1-u)*v*g[:, 1] + u*(1-v)*g[:, 2] + u*v*g[:, 3]
+			gain[a:a+block] = numpy.where(found, value, numpy.nan)
+		return gain
+
+	def elevationCut(self, phi, count=721):
+		''' Return (theta, gain) along a constant phi cut, interpolated at count points
+		'''
+		theta = numpy.linspace(self.cells[:, 0].min(), self.cells[:, 1].max(), count)
+		return theta, self.interpolate(theta, numpy.full(count, float(phi)))
+
+	def azimuthCut(self, theta, count=1441):
+		''' Return (phi, gain) along a constant theta cut, interpolated at count points
+		'''
+		phi = numpy.linspace(self.cells[:, 2].min(), self.cells[:, 3].max(), count)
+		return phi, self.interpolate(numpy.full(count, float(theta)), phi)
+
+	def maximum(self):
+		''' Return (gain in dBi, theta, phi) at the highest sample
+		'''
+		i = numpy.argmax(self.gain)
+		return self.gain[i], self.theta[i], self.phi[i]
+
+	def metrics(self, resolution=1.0):
+		''' Return the nec2metrics.Metrics of the pattern (peak gain, front-to-back ratio, beamwidths and
+			sidelobe level), from the samples and the interpolated gain every resolution degrees across the
+			sampled range
+		'''
+		from nec2metrics import PatternMetrics
+		accumulator = PatternMetrics(self.frequency, resolution)
+		accumulator.add(self.theta, self.phi, self.gain)
+		theta = numpy.arange(self.cells[:, 0].min(), self.cells[:, 1].max() + 0.5 * resolution, resolution)
+		phi   = numpy.arange(self.cells[:, 2].min(), self.cells[:, 3].max() + 0.5 * resolution, resolution)
+		tt, pp = numpy.meshgrid(theta, phi, indexing='ij')
+		gain = self.interpolate(tt.ravel(), pp.ravel())
+		found = numpy.isfinite(gain)
+		accumulator.add(tt.ravel()[found], pp.ravel()[found], gain[found])
+		return accumulator.metrics()
+
+
+def _gridNulls(g, theta, phi, tolerance):
+	''' Return a mask of the samples of a theta x phi grid of gains that are no higher than any of their eight
+		neighbours and more than tolerance below the highest of them. Phi wraps around when the grid covers
+		the whole circle, and a row at a pole, being all one direction, counts once with the whole next row
+		as its neighbours.
+	'''
+	full = phi[-1] - phi[0] >= 360.0 - 1e-9
+	core = g[:, :-1] if full else g
+	rows, columns = core.shape
+	lowest, highest = numpy.full(core.shape, numpy.inf), numpy.full(core.shape, -numpy.inf)
+	for a in (-1, 0, 1):
+		for b in (-1, 0, 1):
+			if a or b:
+				i, j = numpy.arange(rows)[:, None] + a, numpy.arange(columns)[None, :] + b
+				valid = (i >= 0) & (i < rows) & (full | ((j >= 0) & (j < columns)))
+				neighbour = core[numpy.clip(i, 0, rows - 1), j % columns]
+				lowest  = numpy.where(valid, numpy.minimum(lowest, neighbour), lowest)
+				highest = numpy.where(valid, numpy.maximum(highest, neighbour), highest)
+	nulls = (core <= lowest) & (core < highest - tolerance)
+	for row, adjacent in ((0, 1), (rows - 1, rows - 2)):
+		if theta[row] in (0.0, 180.0):
+			nulls[row] = False
+			nulls[row, 0] = core[row, 0] <= core[adjacent].min() and core[row, 0] < core[adjacent].max() - tolerance
+	return numpy.c_[nulls, numpy.zeros((rows, 1), dtype=bool)] if full else nulls
+
+
+def adaptivePattern(model, result, index=0, tolerance=0.25, minStep=0.25, dynamicRange=50.0, maxEvaluations=500):
+	''' Sample the far field of frequency number index of a nec2solver.Result adaptively, spending samples
+		only where the figures of merit come from. Start from the cells of the model's RP grid (theta limited
+		to 0-180 degrees) and split into four only the cells that hold the best sample so far, the direction
+		opposite it (unless that's a sample already), a crossing of the -3 dB contour, or a null: a sample
+		lower than every sample around it, followed down for as long as splitting the cells around it finds
+		a lower one. A cell stops splitting once the gain at its center is within tolerance dB of the average
+		of its corners, once it's minStep degrees wide, or once maxEvaluations directions have been
+		evaluated; the rest of the pattern stays at the start grid. Gains more than dynamicRange dB below the
+		best sample are treated as that floor, so deep nulls are located without chasing them to -100 dB.
+		Each round of splits is evaluated as one vectorized batch. A coarse start grid (e.g.
+		model.setRadiationPattern(7, 13, thetaStep=30.0, phiStep=30.0)) needs the fewest evaluations; use
+		metrics() on the result for gain, beamwidths and front-to-back. Returns a ScatteredPattern.
+	'''
+	theta, phi = rpAngles(model)
+	theta = numpy.unique(numpy.clip(theta, 0.0, 180.0))
+	phi   = numpy.unique(phi)
+	if len(theta) < 2 or len(phi) < 2:
+		raise ValueError("the RP grid needs at least two theta and two phi values to make cells")
+	power = inputPower(result, index)
+	keys, thetas, phis = {}, [], []
+	eThetas, ePhis, gain = numpy.zeros(0, dtype=complex), numpy.zeros(0, dtype=complex), numpy.zeros(0)
+
+	def sample(t, p):
+		key = (round(t, 9), round(p, 9))
+		if key not in keys:
+			keys[key] = len(thetas)
+			thetas.append(t)
+			phis.append(p)
+		return keys[key]
+
+	def evaluate():
+		''' Evaluate every sample added since the last call, as one batch
+		'''
+		if len(gain) == len(thetas):
+			return eThetas, ePhis, gain
+		eTheta, ePhi = farField(result, thetas[len(gain):], phis[len(gain):], index)
+		return (numpy.r_[eThetas, eTheta], numpy.r_[ePhis, ePhi],
+		        numpy.r_[gain, decibels(4.0 * math.pi * intensity(eTheta, ePhi) / power)])
+
+	def inside(cell, t, p):
+		p = numpy.mod(p - phi[0], 360.0) + phi[0]
+		across = ((p >= cell[2]) & (p <= cell[3])) | ((p + 360.0 >= cell[2]) & (p + 360.0 <= cell[3]))
+		return (t >= cell[0]) & (t <= cell[1]) & across
+
+	# The RP grid's cells, each with a sample at its center
+	corners = lambda c: [sample(c[0], c[2]), sample(c[0], c[3]), sample(c[1], c[2]), sample(c[1], c[3])]
+	grid = numpy.array([[sample(t, p) for p in phi] for t in theta])
+	cells = [(theta[i], theta[i+1], phi[j], phi[j+1]) for i in range(len(theta) - 1) for j in range(len(phi) - 1)]
+	cellCorners = [corners(c) for c in cells]
+	centers = [sample(0.5 * (c[0] + c[1]), 0.5 * (c[2] + c[3])) for c in cells]
+	eThetas, ePhis, gain = evaluate()
+
+	# The nulls to start from are the grid samples below all of their neighbours
+	nulls = sorted(set(grid[_gridNulls(numpy.maximum(gain[grid], gain.max() - dynamicRange), theta, phi, tolerance)]))
+
+	# Then split the cells that hold a feature into quarters for as long as their centers disagree with
+	# their corners
+	leaves, leafCorners = [], []
+	while cells:
+		best = int(numpy.argmax(gain))
+		floor, contour = gain[best] - dynamicRange, gain[best] - 3.0
+		targets = [(thetas[best], phis[best])] + [(thetas[k], phis[k]) for k in nulls]
+		back = (180.0 - thetas[best], phi[0] + (phis[best] + 180.0 - phi[0]) % 360.0)
+		if (round(back[0], 9), round(back[1], 9)) not in keys:
+			targets.append(back)
+		targets = numpy.array(targets)
+		splits = []
+		for cell, corner, center in zip(cells, cellCorners, centers):
+			s = gain[corner + [center]]
+			g = numpy.maximum(s, floor)
+			feature = s.min() < contour < s.max() or inside(cell, targets[:, 0], targets[:, 1]).any()
+			wide = min(cell[1] - cell[0], cell[3] - cell[2]) > 2.0 * minStep
+			if feature and wide and abs(g[4] - g[:4].mean()) > tolerance and len(thetas) < maxEvaluations:
+				splits.append(cell)
+			else:
+				leaves.append(cell)
+				leafCorners.append(corner)
+		cells, cellCorners, centers = [], [], []
+		for t0, t1, p0, p1 in splits:
+			tm, pm = 0.5 * (t0 + t1), 0.5 * (p0 + p1)
+			for child in ((t0, tm, p0, pm), (t0, tm, pm, p1), (tm, t1, p0, pm), (tm, t1, pm, p1)):
+				cells.append(child)
+				cellCorners.append(corners(child))
+				centers.append(sample(0.5 * (child[0] + child[1]), 0.5 * (child[2] + child[3])))
+		eThetas, ePhis, gain = evaluate()
+
+		# Each null moves to the lowest sample of the new cells around it, and is left alone once it stays put
+		moved = set()
+		for k in nulls:
+			around = [corner + [center] for cell, corner, center in zip(cells, cellCorners, centers)
+			          if inside(cell, thetas[k], phis[k])]
+			around = sum(around, [k])
+			lowest = around[int(numpy.argmin(gain[around]))]
+			if lowest != k:
+				moved.add(lowest)
+		nulls = sorted(moved)
+
+	return ScatteredPattern(result.frequencies[index], numpy.array(thetas), numpy.array(phis), eThetas, ePhis, power,
+	                        numpy.array(leaves), numpy.array(leafCorners))
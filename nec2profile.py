@@ -0,0 +1,271 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Instrumentation for the hot paths: building geometry (Model.addWire, addArc), rendering cards (getText),
+file I/O (writeCardsToFile, writeModelToFile, parseDeck, readDeck), and simulation (nec2solver.solve and
+its matrix fills and solves, nec2runner.runJob). While a Profiler is enabled each of those is wrapped to
+count calls and add up wall clock time, CPU time, time not spent in other hooked calls, and bytes of text
+produced or written. Disabled, the original functions are put back, so there's no overhead at all.
+
+Functions are wrapped where they're defined and wherever they've already been imported by name (e.g.
+"from nec2utils import *"), so a script imported before enable() is covered too.
+
+Usage:
+
+  with nec2profile.profiling() as profiler:
+      runpy.run_path('2m-fd-fed-yagi.py')
+  sys.stdout.write(profiler.report())
+  profiler.writeJson('profile.json')
+  profiler.writeStats('profile.prof')   # python -m pstats profile.prof, snakeviz, ...
+
+or from the console:
+
+  $ python nec2profile.py --json profile.json --stats profile.prof 2m-fd-fed-yagi.py
+'''
+
+import argparse
+import contextlib
+import functools
+import importlib
+import json
+import marshal
+import os
+import runpy
+import sys
+import threading
+import time
+
+
+def _textSize(args, result):
+	return len(result)
+
+
+def _fileSize(args, result):
+	return os.path.getsize(args[0]) if args and isinstance(args[0], str) and os.path.exists(args[0]) else None
+
+
+# (module, attribute, bytes(args, result) or None) for each function the profiler wraps
+HOOKS = (('nec2utils',  'Model.addWire',     None),
+         ('nec2utils',  'Model.addArc',      None),
+         ('nec2utils',  'Model.getText',     _textSize),
+         ('nec2utils',  'Model.writeTo',     None),
+         ('nec2utils',  'writeCardsToFile',  _fileSize),
+         ('nec2utils',  'writeModelToFile',  _fileSize),
+         ('nec2deck',   'parseDeck',         None),
+         ('nec2deck',   'readDeck',          None),
+         ('nec2solver', 'solve',             None),
+         ('nec2solver', 'Solver.matrix',     None),
+         ('nec2solver', 'Solver.currents',   None),
+         ('nec2runner', 'runJob',            None))
+
+
+# =======================================================================================================
+# Profiler
+# =======================================================================================================
+
+class Stat:
+	def __init__(self, function):
+		''' Totals for one hooked function: calls, wall and CPU seconds (including hooked calls it made),
+			own seconds (wall time excluding them), bytes, and calls from each other hooked function
+		'''
+		self.function = function
+		self.calls    = 0
+		self.wall     = 0.0
+		self.cpu      = 0.0
+		self.own      = 0.0
+		self.bytes    = 0
+		self.callers  = {}  # caller name -> [calls, own seconds, wall seconds]
+
+
+class Profiler:
+	def __init__(self, hooks=HOOKS):
+		self.hooks   = hooks
+		self.stats   = {}
+		self.enabled = False
+		self._lock    = threading.Lock()
+		self._local   = threading.local()
+		self._patches = []
+
+	def enable(self):
+		''' Wrap every hooked function that can be imported
+		'''
+		if self.enabled:
+			return self
+		for moduleName, attribute, size in self.hooks:
+			try:
+				module = importlib.import_module(moduleName)
+			except ImportError:
+				continue
+			owner, name = module, attribute
+			if '.' in attribute:
+				className, name = attribute.split('.')
+				owner = getattr(module, className)
+			original = owner.__dict__[name]
+			wrapper = self._wrap(attribute, original, size)
+			self._patch(owner, name, original, wrapper)
+			if owner is module:  # also rebind copies made by "from module import ..."
+				for other in list(sys.modules.values()):
+					if other is not module and getattr(other, name, None) is original:
+						self._patch(other, name, original, wrapper)
+			self.stats.setdefault(attribute, Stat(original))
+		self.enabled = True
+		return self
+
+	def disable(self):
+		''' Put every wrapped function back
+		'''
+		for owner, name, original in reversed(self._patches):
+			setattr(owner, name, original)
+		self._patches = []
+		self.enabled = False
+
+	def __enter__(self):
+		return self.enable()
+
+	def __exit__(self, *exception):
+		self.disable()
+
+	def _patch(self, owner, name, original, wrapper):
+		setattr(owner, name, wrapper)
+		self._patches.append((owner, name, original))
+
+	def _wrap(self, name, function, size):
+		profiler = self
+
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			stack = getattr(profiler._local, 'stack', None)
+			if stack is None:
+				stack = profiler._local.stack = []
+			frame = [name, 0.0]  # name, wall time spent in hooked calls it makes
+			stack.append(frame)
+			wall, cpu, finished = time.perf_counter(), time.process_time(), False
+			try:
+				result = function(*args, **kwargs)
+				finished = True
+				return result
+			finally:
+				wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+				stack.pop()
+				caller = stack[-1] if stack else None
+				if caller is not None:
+					caller[1] += wall
+				profiler._record(name, wall, cpu, wall - frame[1], size(args, result) if finished and size else None,
+				                 caller[0] if caller is not None else None)
+		return wrapper
+
+	def _record(self, name, wall, cpu, own, size, caller):
+		with self._lock:
+			stat = self.stats[name]
+			stat.calls += 1
+			stat.wall  += wall
+			stat.cpu   += cpu
+			stat.own   += own
+			stat.bytes += size or 0
+			if caller is not None:
+				totals = stat.callers.setdefault(caller, [0, 0.0, 0.0])
+				totals[0] += 1
+				totals[1] += own
+				totals[2] += wall
+
+	def reset(self):
+		''' Zero every total
+		'''
+		with self._lock:
+			self.stats = dict((name, Stat(stat.function)) for name, stat in self.stats.items())
+
+	# ---------------------------------------------------------------------------------------------------
+	# Exports
+	# ---------------------------------------------------------------------------------------------------
+
+	def toDict(self):
+		''' Return the totals of every hooked function that was called, as a JSON-ready dict
+		'''
+		return dict((name, {'calls': s.calls, 'wall': s.wall, 'cpu': s.cpu, 'own': s.own, 'bytes': s.bytes,
+		                    'callers': dict((c, {'calls': t[0], 'own': t[1], 'wall': t[2]}) for c, t in s.callers.items())})
+		            for name, s in self.stats.items() if s.calls)
+
+	def writeJson(self, fileName):
+		with open(fileName, 'w') as f:
+			json.dump(self.toDict(), f, indent=1, sort_keys=True)
+
+	def pstatsDict(self):
+		''' Return the totals in the form cProfile saves (what pstats.Stats loads): {(file, line, function):
+			(primitive calls, calls, own seconds, wall seconds, {caller: (calls, calls, own, wall)})}
+		'''
+		keys = dict((name, _functionKey(name, s.function)) for name, s in self.stats.items())
+		stats = {}
+		for name, s in self.stats.items():
+			if s.calls:
+				callers = dict((keys[c], (t[0], t[0], t[1], t[2])) for c, t in s.callers.items())
+				stats[keys[name]] = (s.calls, s.calls, s.own, s.wall, callers)
+		return stats
+
+	def writeStats(self, fileName):
+		''' Save the totals in cProfile's format, for pstats, snakeviz, gprof2dot and friends
+		'''
+		with open(fileName, 'wb') as f:
+			marshal.dump(self.pstatsDict(), f)
+
+	def report(self):
+		''' Return a text table of the totals, most expensive first
+		'''
+		lines = ['{: <20}{: >10}{: >12}{: >12}{: >12}{: >14}\n'.format('function', 'calls', 'wall ms', 'cpu ms',
+		                                                                'own ms', 'bytes')]
+		for name, s in sorted(self.stats.items(), key=lambda item: -item[1].wall):
+			if s.calls:
+				lines.append('{: <20}{: >10}{: >12.2f}{: >12.2f}{: >12.2f}{: >14,}\n'.format(name, s.calls,
+				             s.wall * 1000.0, s.cpu * 1000.0, s.own * 1000.0, s.bytes))
+		return ''.join(lines)
+
+
+def _functionKey(name, function):
+	code = getattr(function, '__code__', None)
+	if code is None:
+		return ('~', 0, name)
+	return (code.co_filename, code.co_firstlineno, name)
+
+
+@contextlib.contextmanager
+def profiling(hooks=HOOKS):
+	''' Profile the hooked functions for the duration of a with block, yielding the Profiler
+	'''
+	profiler = Profiler(hooks).enable()
+	try:
+		yield profiler
+	finally:
+		profiler.disable()
+
+
+def profileScript(fileName, argv=()):
+	''' Run a generator script under a Profiler, as if from the console, and return the Profiler
+	'''
+	savedArgv = sys.argv
+	sys.argv = [fileName] + list(argv)
+	try:
+		with profiling() as profiler:
+			runpy.run_path(fileName, run_name='__main__')
+	finally:
+		sys.argv = savedArgv
+	return profiler
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Run a model script and report where its time went.')
+	parser.add_argument('script', help='the script to run')
+	parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments for the script')
+	parser.add_argument('--json', help='write the totals to this JSON file')
+	parser.add_argument('--stats', help='write the totals to this file in cProfile format')
+	args = parser.parse_args(argv)
+	sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+	profiler = profileScript(args.script, args.arguments)
+	sys.stderr.write(profiler.report())
+	if args.json:
+		profiler.writeJson(args.json)
+	if args.stats:
+		profiler.writeStats(args.stats)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,79 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Reference results from nec2 for the decks that ship with the project, and a check of nec2solver against
+them. The input impedances were computed by the nec2 engine (nec2++) from the same decks over their FR
+sweeps. nec2solver's accuracy claim (input impedance within 6% of |Z| and SWR within 7%) is what
+checkReference() holds it to, so a change that makes the solver drift shows up here.
+
+Run from the console (exits with status 1 if a deck is out of tolerance):
+
+  $ python nec2reference.py
+'''
+
+import os
+import sys
+
+import numpy
+
+import nec2deck
+import nec2solver
+
+
+IMPEDANCE_TOLERANCE = 0.06  # Largest difference in input impedance allowed, relative to |Z| from nec2
+SWR_TOLERANCE       = 0.07  # and in SWR (50 ohms), relative to nec2's
+
+# (deck, (FR start MHz, step MHz, input impedance from nec2 at each step))
+REFERENCE = (
+	(os.path.join('2m-folded-dipole', '2m-folded-dipole.nec'), (144.0, 0.1, [
+		(267.10-70.69j), (267.48-68.90j), (267.85-67.10j), (268.23-65.31j), (268.62-63.52j),
+		(269.01-61.73j), (269.40-59.95j), (269.79-58.17j), (270.19-56.39j), (270.59-54.61j),
+		(271.00-52.84j), (271.41-51.07j), (271.83-49.30j), (272.24-47.53j), (272.66-45.77j),
+		(273.09-44.00j), (273.52-42.24j), (273.95-40.49j), (274.39-38.73j), (274.83-36.98j),
+		(275.27-35.23j), (275.72-33.48j), (276.17-31.74j), (276.63-29.99j), (277.09-28.25j),
+		(277.55-26.51j), (278.02-24.77j), (278.49-23.04j), (278.97-21.30j), (279.45-19.57j),
+		(279.93-17.84j), (280.42-16.11j), (280.91-14.39j), (281.40-12.67j), (281.90-10.94j),
+		(282.41-9.22j), (282.91-7.51j), (283.42-5.79j), (283.94-4.07j), (284.46-2.36j),
+	])),
+	('2m-fd-fed-yagi.nec', (145.5, 0.05, [
+		(42.61-25.61j), (43.17-24.04j), (43.73-22.47j), (44.30-20.91j), (44.87-19.36j),
+		(45.44-17.81j), (46.01-16.27j), (46.59-14.74j), (47.17-13.21j), (47.76-11.68j),
+		(48.35-10.17j), (48.93-8.66j), (49.53-7.15j), (50.12-5.65j), (50.72-4.16j),
+		(51.32-2.67j), (51.92-1.19j), (52.52+0.28j), (53.13+1.75j), (53.73+3.22j),
+		(54.34+4.67j), (54.96+6.13j), (55.57+7.57j), (56.18+9.02j), (56.80+10.45j),
+		(57.42+11.88j), (58.04+13.31j), (58.66+14.73j), (59.29+16.14j), (59.91+17.55j),
+		(60.54+18.96j), (61.17+20.36j), (61.80+21.75j), (62.43+23.14j), (63.06+24.52j),
+		(63.69+25.90j), (64.33+27.27j), (64.97+28.64j), (65.60+30.01j), (66.24+31.36j),
+	])),
+)
+
+
+def checkReference(directory=None, z0=50.0):
+	''' Solve each reference deck (paths relative to directory, by default the one this file is in) and
+		return a list of (deck, largest relative impedance difference, largest relative SWR difference,
+		passed) tuples
+	'''
+	directory = directory or os.path.dirname(os.path.abspath(__file__))
+	results = []
+	for deck, (start, stepSize, impedance) in REFERENCE:
+		reference = numpy.array(impedance)
+		model = nec2deck.readDeck(os.path.join(directory, deck)).toModel()
+		result = nec2solver.solve(model, start, stepSize, len(reference), z0)
+		impedanceError = (numpy.abs(result.impedance - reference) / numpy.abs(reference)).max()
+		referenceSwr = nec2solver.swr(reference, z0)
+		swrError = (numpy.abs(result.swr - referenceSwr) / referenceSwr).max()
+		results.append((deck, impedanceError, swrError, impedanceError <= IMPEDANCE_TOLERANCE and swrError <= SWR_TOLERANCE))
+	return results
+
+
+def main():
+	results = checkReference()
+	for deck, impedanceError, swrError, passed in results:
+		sys.stdout.write('{: <42}  Z {: >6.2%}  SWR {: >6.2%}  {}\n'.format(deck, impedanceError, swrError,
+		                 'ok' if passed else 'OUT OF TOLERANCE'))
+	return 0 if all(r[3] for r in results) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
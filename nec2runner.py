@@ -0,0 +1,156 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Run a batch of card stack files through a command line nec2 engine (nec2c by default) on a pool of
+workers, one per core. Each job runs in its own temporary directory, so engines that write scratch files
+next to their input can't trip over each other, and gets killed if it runs past its timeout.
+
+The engine command is a list of arguments in which {input} and {output} are replaced by the deck and
+output file names. The NEC2_ENGINE environment variable overrides the executable, which makes it easy to
+point a batch at a stub script for testing.
+
+Usage:
+
+  results = nec2runner.runBatch(['yagi-1.nec', 'yagi-2.nec'], timeout=60.0)
+  for result in results:
+      result.name, result.ok, result.records
+'''
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import nec2cache
+import nec2output
+
+
+DEFAULT_COMMAND = ['nec2c', '-i', '{input}', '-o', '{output}']
+
+
+# =======================================================================================================
+# Jobs and results
+# =======================================================================================================
+
+class JobResult:
+	def __init__(self, name, deck):
+		''' What happened to one deck: the engine's return code and stderr, whether it timed out, the wall
+			clock time it took, the output file (if it was kept), and the parsed nec2output records (if the
+			batch parsed them)
+		'''
+		self.name       = name
+		self.deck       = deck
+		self.returnCode = None
+		self.timedOut   = False
+		self.elapsed    = 0.0
+		self.error      = ''
+		self.outputFile = None
+		self.records    = None
+
+	@property
+	def ok(self):
+		return self.returnCode == 0 and not self.timedOut and not self.error
+
+
+def engineCommand(command=None):
+	''' Return the engine command to use: command if given, else DEFAULT_COMMAND with its executable
+		replaced by $NEC2_ENGINE if that is set
+	'''
+	if command is not None:
+		return list(command)
+	command = list(DEFAULT_COMMAND)
+	if os.environ.get('NEC2_ENGINE'):
+		command[0] = os.environ['NEC2_ENGINE']
+	return command
+
+
+def _jobName(deck):
+	return os.path.splitext(os.path.basename(deck))[0]
+
+
+def runJob(deck, command=None, timeout=None, outputDirectory=None, parse=True, name=None):
+	''' Run one deck file through the engine in a fresh temporary directory and return a JobResult. When
+		the records are all that's wanted (parse and no outputDirectory) an active nec2cache is checked first.
+	'''
+	result = JobResult(name or _jobName(deck), deck)
+	cache = nec2cache.activeCache() if parse and outputDirectory is None else None
+	if cache is not None:
+		kind = 'engine ' + ' '.join(engineCommand(command))
+		with open(deck) as f:
+			key = nec2cache.deckKey(f.read(), kind)
+		arrays = cache.get(key)
+		if arrays is not None:
+			result.returnCode = 0
+			result.records = nec2output.arrayRecords(arrays)
+			return result
+	workDirectory = tempfile.mkdtemp(prefix='nec2run-')
+	try:
+		inputFile  = os.path.join(workDirectory, 'input.nec')
+		outputFile = os.path.join(workDirectory, 'output.out')
+		shutil.copyfile(deck, inputFile)
+		arguments = [a.replace('{input}', inputFile).replace('{output}', outputFile) for a in engineCommand(command)]
+		t0 = time.time()
+		try:
+			finished = subprocess.run(arguments, cwd=workDirectory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+			                          stderr=subprocess.PIPE, timeout=timeout)
+			result.returnCode = finished.returncode
+			if finished.returncode != 0:
+				result.error = finished.stderr.decode('utf-8', 'replace').strip() or "exit status {}".format(finished.returncode)
+		except subprocess.TimeoutExpired:
+			result.timedOut = True
+			result.error = "timed out after {} seconds".format(timeout)
+		except OSError as e:
+			result.error = str(e)
+		result.elapsed = time.time() - t0
+
+		if result.returnCode == 0 and not result.timedOut:
+			if not os.path.exists(outputFile):
+				result.error = "engine didn't write an output file"
+			else:
+				if parse:
+					result.records = list(nec2output.iterRecords(outputFile))
+					if cache is not None:
+						cache.put(key, nec2output.recordArrays(result.records), kind)
+				if outputDirectory is not None:
+					result.outputFile = os.path.join(outputDirectory, result.name + '.out')
+					shutil.move(outputFile, result.outputFile)
+	finally:
+		shutil.rmtree(workDirectory, ignore_errors=True)
+	return result
+
+
+# =======================================================================================================
+# Batches
+# =======================================================================================================
+
+def iterBatch(decks, command=None, workers=None, timeout=None, outputDirectory=None, parse=True):
+	''' Run deck files through the engine on workers threads (default: one per core), each job waiting on
+		its own engine process, and generate the JobResults in the order the jobs finish
+	'''
+	decks = list(decks)
+	if outputDirectory is not None and not os.path.isdir(outputDirectory):
+		os.makedirs(outputDirectory)
+	names = [_jobName(deck) for deck in decks]
+	if len(set(names)) != len(names):
+		names = ['{}-{}'.format(i, name) for i, name in enumerate(names)]  # keep kept output files apart
+	with ThreadPoolExecutor(max_workers=workers or multiprocessing.cpu_count()) as pool:
+		futures = [pool.submit(runJob, deck, command, timeout, outputDirectory, parse, name) for deck, name in zip(decks, names)]
+		for future in as_completed(futures):
+			yield future.result()
+
+
+def runBatch(decks, command=None, workers=None, timeout=None, outputDirectory=None, parse=True):
+	''' Run deck files through the engine in parallel and return their JobResults in the order of decks
+	'''
+	decks = list(decks)
+	order = {}
+	for i, deck in enumerate(decks):
+		order.setdefault(deck, []).append(i)
+	results = [None] * len(decks)
+	for result in iterBatch(decks, command, workers, timeout, outputDirectory, parse):
+		results[order[result.deck].pop(0)] = result
+	return results
@@ -0,0 +1,218 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Wavelength-aware segmentation. Segment counts decide both the accuracy of a model and what it costs to
+solve (nec2 fills an N x N matrix and factors it, so O(N^2) memory and O(N^3) time in the number of
+segments), so instead of guessing them, pick the fewest that meet nec2's segmentation guidelines at the
+highest frequency to be modeled, where the wavelength is shortest:
+
+  - segments no longer than 0.05 wavelength (SEGMENT_WAVELENGTHS), and never more than 0.1
+  - segments no shorter than 0.001 wavelength, and at least 8 times the wire radius for the thin-wire
+    kernel to hold (2 times at the very least)
+  - segments meeting at a junction, or along a wire, within a factor of JUNCTION_RATIO in length
+  - arcs in steps of no more than ARC_DEGREES, so the straight segments follow the curve
+
+A Segmenter applies them as wires and arcs are added to a Model with AUTO segments, and segmentReport()
+checks any model against them and counts its unknowns before anything is solved.
+
+Usage:
+
+  m = Model(inch(1.0/16.0)).setSegmentation(147.5)
+  m.addWire(AUTO, a1, a2)
+  m.addArc(AUTO, radiusB, deg(90), deg(270), rotate=Rotation(deg(90),deg(0),deg(0)), translate=b)
+  sys.stdout.write(m.segmentReport().text())
+'''
+
+import math
+
+import numpy
+
+from nec2geometry import compileGeometry, transformMatrix
+from nec2solver import CVEL
+
+
+SEGMENT_WAVELENGTHS     = 0.05   # Longest segment an automatic wire gets, in wavelengths
+MAX_SEGMENT_WAVELENGTHS = 0.1    # Longest segment nec2 handles reasonably
+MIN_SEGMENT_WAVELENGTHS = 0.001  # Shortest segment before round-off takes over
+LENGTH_TO_RADIUS        = 8.0    # Segment length over wire radius needed for the thin-wire kernel
+MIN_LENGTH_TO_RADIUS    = 2.0    # and below which it fails outright
+JUNCTION_RATIO          = 2.0    # Largest length ratio of segments that meet
+ARC_DEGREES             = 45.0   # Most degrees of arc per segment
+JUNCTION_TOLERANCE      = 1e-5   # Wire ends closer than this many wavelengths are joined
+
+
+# =======================================================================================================
+# Automatic segment counts
+# =======================================================================================================
+
+def arcEnds(radius, start, end, rotate, translate):
+	''' Return the two end points of an arc made by Model.addArc (angles in degrees, rotate a Rotation,
+		translate a Point)
+	'''
+	matrix = transformMatrix(rotate.rx, rotate.ry, rotate.rz, translate.x, translate.y, translate.z)
+	angles = numpy.radians([start, end])
+	points = numpy.stack([radius * numpy.cos(angles), numpy.zeros(2), radius * numpy.sin(angles), numpy.ones(2)])
+	return tuple(matrix.dot(points)[:3].T)
+
+
+class Segmenter:
+	def __init__(self, maxMHz, segmentWavelengths=SEGMENT_WAVELENGTHS, junctionRatio=JUNCTION_RATIO,
+	             arcDegrees=ARC_DEGREES, odd=True):
+		''' Chooses segment counts for wires as they're added to a model, for frequencies up to maxMHz. With
+			odd, counts are odd so that the middle segment of every wire is centered on it.
+		'''
+		self.maxMHz        = maxMHz
+		self.wavelength    = CVEL / maxMHz
+		self.segmentLength = segmentWavelengths * self.wavelength
+		self.junctionRatio = junctionRatio
+		self.arcDegrees    = arcDegrees
+		self.odd           = odd
+		self.tolerance     = JUNCTION_TOLERANCE * self.wavelength
+		self.wires = {}  # tag -> [length, end points, segments, chosen automatically?, fewest segments allowed]
+		self.cells = {}  # grid cell of a wire end -> tags with an end in it
+
+	def count(self, length, minimum=1):
+		''' Return the fewest segments, at least minimum, that keep a wire of the given length within the
+			target segment length
+		'''
+		segments = max(int(math.ceil(length / self.segmentLength - 1e-9)), int(minimum), 1)
+		if self.odd and segments % 2 == 0:
+			segments += 1
+		return segments
+
+	def arcMinimum(self, start, end):
+		''' Return the fewest segments for an arc from start to end degrees to follow its curve
+		'''
+		return int(math.ceil(abs(end - start) / self.arcDegrees - 1e-9))
+
+	def add(self, tag, length, ends, segments=None, minimum=1):
+		''' Record a wire or arc given its length and its two end points. With segments None its count is
+			chosen: the fewest that meets the guidelines next to the wires it touches. Automatic wires that
+			are then too coarse next to it (or next to the ones refined because of it) get more segments.
+			Returns {tag: segments} for every wire whose count was chosen or changed.
+		'''
+		automatic = segments is None
+		wire = [float(length), [numpy.asarray(p, dtype=float) for p in ends], segments or 1, automatic, minimum]
+		self.wires[tag] = wire
+		for point in wire[1]:
+			self.cells.setdefault(self._cell(point), set()).add(tag)
+		changed = {}
+		if automatic:
+			finest = min([self._step(other) for other in self._neighbors(tag)] or [numpy.inf])
+			wire[2] = self.count(length, max(minimum, math.ceil(length / (self.junctionRatio * finest) - 1e-9)))
+			changed[tag] = wire[2]
+		pending = [tag]
+		while pending:
+			current = pending.pop()
+			step = self._step(current)
+			for other in self._neighbors(current):
+				o = self.wires[other]
+				if o[3] and self._step(other) > self.junctionRatio * step * (1.0 + 1e-9):
+					o[2] = self.count(o[0], max(o[4], math.ceil(o[0] / (self.junctionRatio * step) - 1e-9)))
+					changed[other] = o[2]
+					pending.append(other)
+		return changed
+
+	def _step(self, tag):
+		wire = self.wires[tag]
+		return wire[0] / wire[2]
+
+	def _cell(self, point):
+		return tuple(numpy.floor(point / self.tolerance).astype(int).tolist())
+
+	def _neighbors(self, tag):
+		''' Return the other tags with an end within tolerance of one of tag's ends
+		'''
+		found = set()
+		for point in self.wires[tag][1]:
+			x, y, z = self._cell(point)
+			for cell in [(x + i, y + j, z + k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]:
+				for other in self.cells.get(cell, ()):
+					if other != tag and min(numpy.abs(q - point).max() for q in self.wires[other][1]) <= self.tolerance:
+						found.add(other)
+		return sorted(found)
+
+
+# =======================================================================================================
+# Checking a model
+# =======================================================================================================
+
+class SegmentReport:
+	def __init__(self, maxMHz, tags, names, segments, lengths, longest, radiusRatios, junctionRatios):
+		''' How a model's wires measure up to the segmentation guidelines at maxMHz, one entry per GW or GA
+			card: tag, mnemonic, segment count, length and longest segment in wavelengths, the smallest
+			segment length over wire radius, and the largest length ratio of the segment ends it shares a
+			point with (1 when it touches nothing)
+		'''
+		self.maxMHz         = maxMHz
+		self.wavelength     = CVEL / maxMHz
+		self.tags           = tags
+		self.names          = names
+		self.segments       = segments
+		self.lengths        = lengths
+		self.longest        = longest
+		self.radiusRatios   = radiusRatios
+		self.junctionRatios = junctionRatios
+		self.unknowns       = int(segments.sum())  # nec2 solves for one current per segment
+
+	def problems(self, row):
+		''' Return a list of the guidelines the wire of the given row breaks
+		'''
+		found = []
+		if self.longest[row] > MAX_SEGMENT_WAVELENGTHS:
+			found.append('segments longer than {} wavelength'.format(MAX_SEGMENT_WAVELENGTHS))
+		elif self.longest[row] > SEGMENT_WAVELENGTHS * (1.0 + 1e-6):
+			found.append('segments longer than {} wavelength'.format(SEGMENT_WAVELENGTHS))
+		if self.lengths[row] / self.segments[row] < MIN_SEGMENT_WAVELENGTHS:
+			found.append('segments shorter than {} wavelength'.format(MIN_SEGMENT_WAVELENGTHS))
+		if self.radiusRatios[row] < MIN_LENGTH_TO_RADIUS:
+			found.append('segments shorter than {} wire radii'.format(MIN_LENGTH_TO_RADIUS))
+		elif self.radiusRatios[row] < LENGTH_TO_RADIUS:
+			found.append('segments shorter than {} wire radii'.format(LENGTH_TO_RADIUS))
+		if self.junctionRatios[row] > JUNCTION_RATIO * (1.0 + 1e-6):
+			found.append('{:.1f}x segment length step at a junction'.format(self.junctionRatios[row]))
+		return found
+
+	def text(self):
+		''' Return the report as a text table, with the total number of unknowns and the size of nec2's
+			impedance matrix at the bottom
+		'''
+		lines = ['{: >5} {: <4}{: >6}{: >12}{: >12}{: >10}{: >8}  {}\n'.format('tag', 'card', 'segs', 'length wl',
+		         'longest wl', 'len/rad', 'step', 'problems')]
+		for row in range(len(self.tags)):
+			lines.append('{: >5} {: <4}{: >6}{: >12.4f}{: >12.4f}{: >10.1f}{: >8.2f}  {}\n'.format(self.tags[row],
+			             self.names[row], self.segments[row], self.lengths[row], self.longest[row],
+			             self.radiusRatios[row], self.junctionRatios[row], '; '.join(self.problems(row))))
+		lines.append('{:,} unknowns at {} MHz (wavelength {:.4f} m), {:,} byte impedance matrix\n'.format(self.unknowns,
+		             self.maxMHz, self.wavelength, 16 * self.unknowns**2))
+		return ''.join(lines)
+
+
+def segmentReport(model, maxMHz):
+	''' Check the segments of a nec2utils.Model against the guidelines at maxMHz and return a SegmentReport
+	'''
+	geometry = compileGeometry(model)
+	wavelength = CVEL / maxMHz
+	first, last = geometry.cardRanges()
+	cards = geometry.sources[first]
+	lengths = numpy.add.reduceat(geometry.lengths, first) if len(first) else numpy.zeros(0)
+	longest = numpy.maximum.reduceat(geometry.lengths, first) if len(first) else numpy.zeros(0)
+	radiusRatios = numpy.minimum.reduceat(geometry.lengths / geometry.radii, first) if len(first) else numpy.zeros(0)
+
+	# Segment ends that share a point, up to JUNCTION_TOLERANCE: the largest length ratio at each point
+	points = numpy.concatenate([geometry.starts, geometry.ends])
+	owners = numpy.r_[numpy.arange(len(geometry)), numpy.arange(len(geometry))]
+	keys = numpy.rint(points / (JUNCTION_TOLERANCE * wavelength)).astype(numpy.int64)
+	unique, point = numpy.unique(keys, axis=0, return_inverse=True) if len(keys) else (keys, owners)
+	point = numpy.ravel(point)
+	ratio = numpy.ones(len(geometry))
+	if len(point):
+		high = numpy.full(len(unique), -numpy.inf)
+		low  = numpy.full(len(unique), numpy.inf)
+		numpy.maximum.at(high, point, geometry.lengths[owners])
+		numpy.minimum.at(low, point, geometry.lengths[owners])
+		numpy.maximum.at(ratio, owners, (high / low)[point])
+	junctionRatios = numpy.maximum.reduceat(ratio, first) if len(first) else numpy.zeros(0)
+	return SegmentReport(maxMHz, geometry.tags[first], [model.wires.names[c] for c in cards], last - first,
+	                     lengths / wavelength, longest / wavelength, radiusRatios, junctionRatios)
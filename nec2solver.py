@@ -0,0 +1,527 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Thin-wire method of moments solver for the geometry in a nec2utils.Model, so impedance and SWR can be
+checked without a round trip through xnec2c.
+
+The formulation is the mixed potential electric field integral equation with the reduced (thin-wire)
+kernel, solved by Galerkin's method. Every segment is split in half at its center, and a triangle basis
+function sits on each node of that finer mesh: the segment centers (whose coefficients are the segment
+currents that nec2 reports), the joints between segments of one wire, and the junctions between wires.
+The EX card becomes a 1 volt delta gap at the center of the excited segment.
+
+Against nec2 on the 2m-folded-dipole and 2m-fd-fed-yagi models, the input impedance agrees to within 6%
+of |Z| and the SWR to within 7% across their FR sweeps. Most of the difference is a near constant offset
+of an ohm or two in reactance from the different source models, which doesn't shrink with segmentation.
+nec2reference holds the nec2 impedances and checks solve() against them within those tolerances.
+
+Filling the impedance matrix is most of the work at each frequency, so longer sweeps fill it exactly at a
+few anchor frequencies only and interpolate in between (see MatrixInterpolator), checking as they go that
+the currents stay within INTERPOLATION_TOLERANCE of an exact fill. Structures that are mirror symmetric in
+coordinate planes (most antennas are, side to side) only fill the rows of one basis function out of each
+set of mirror images and solve their even and odd parts separately (see Symmetry): about half the fill and
+a quarter of the factorization per plane.
+
+Usage:
+
+  result = nec2solver.solve(model, start=145.5, stepSize=0.05, stepCount=40)
+  result.impedance, result.swr, result.currents
+'''
+
+import math
+
+import numpy
+
+import nec2cache
+from nec2geometry import compileGeometry, mirrorMap, symmetryPlanes
+from nec2junction import junctionGraph
+from nec2utils import FrequencyList, truncate
+
+
+# =======================================================================================================
+# Constants
+# =======================================================================================================
+
+CVEL = 299.8                  # Speed of light in Mm/s, so wavelength in meters = CVEL / MHz (same as nec2)
+MU0  = 4.0e-7 * math.pi       # Permeability of free space
+EPS0 = 1.0 / (MU0 * (CVEL * 1.0e6)**2)
+
+QUADRATURE        = 8         # Gauss-Legendre points per half segment for the 1/R part of the kernel
+SMOOTH_QUADRATURE = 3         # and for the smooth, frequency dependent remainder
+CHUNK_ELEMENTS    = 1 << 20   # Quadrature points x elements filled per block of the impedance matrix
+KEEP_DISTANCES    = 1 << 24   # Distances between smooth quadrature points are kept between fills up to this many
+
+INTERPOLATION_TOLERANCE = 1e-4  # Relative error allowed in the currents when interpolating impedance matrices
+INTERPOLATION_ORDER     = 3     # Degree of the polynomial through neighboring anchor matrices
+INTERPOLATE_ABOVE       = 8     # Sweeps with more frequencies than this interpolate by default
+
+CACHE_KIND = 'nec2solver {} {}'.format(QUADRATURE, SMOOTH_QUADRATURE)  # Results cache entries made by solve()
+
+
+# =======================================================================================================
+# Mesh of half segments and triangle basis functions
+# =======================================================================================================
+
+class Mesh:
+	def __init__(self, geometry, tolerance=1e-3):
+		''' Split each segment of a compiled Geometry at its center and lay out the basis functions. Wire
+			ends closer together than tolerance times the shorter segment are treated as a junction, and so
+			are wire ends on a joint between two segments of another wire.
+		'''
+		starts, ends, radii, wireIds = geometry.starts, geometry.ends, geometry.radii, geometry.cards
+		count   = len(starts)
+		centers = 0.5 * (starts + ends)
+		# Element 2k runs from the start of segment k to its center, element 2k+1 from the center to the end
+		self.starts  = numpy.empty((2*count, 3))
+		self.ends    = numpy.empty((2*count, 3))
+		self.starts[0::2], self.ends[0::2] = starts, centers
+		self.starts[1::2], self.ends[1::2] = centers, ends
+		self.radii   = numpy.repeat(radii, 2)
+		self.lengths = numpy.sqrt(((self.ends - self.starts)**2).sum(axis=1))
+		self.units   = (self.ends - self.starts) / self.lengths[:, None]
+		self.segmentCount = count
+
+		# Each basis function is a pair of elements meeting at a node: current flows along "from" into the
+		# node, then along "to" away from it. Bookkeeping is (element, node is at the element's end?).
+		pairs = []
+		for k in range(count):
+			pairs.append(((2*k, True), (2*k + 1, False)))           # segment centers come first
+		joints = numpy.nonzero(wireIds[1:] == wireIds[:-1])[0]
+		for k in joints:
+			pairs.append(((2*k + 1, True), (2*k + 2, False)))       # joints inside a wire
+		for group in self._junctions(geometry, tolerance):
+			for other in group[1:]:
+				pairs.append((group[0], other))                     # junctions between wire ends
+
+		fromElement = numpy.array([p[0][0] for p in pairs])
+		fromAtEnd   = numpy.array([p[0][1] for p in pairs])
+		toElement   = numpy.array([p[1][0] for p in pairs])
+		toAtEnd     = numpy.array([p[1][1] for p in pairs])
+		# Per basis function and piece (0 = from, 1 = to): element, which linear shape (1 rises toward
+		# the element's end), direction of the current relative to the element, and the divergence.
+		self.elements   = numpy.stack([fromElement, toElement], axis=1)
+		self.shapes     = numpy.stack([fromAtEnd, toAtEnd], axis=1).astype(int)
+		self.directions = numpy.stack([numpy.where(fromAtEnd, 1.0, -1.0), numpy.where(toAtEnd, -1.0, 1.0)], axis=1)
+		self.divergence = numpy.stack([1.0 / self.lengths[fromElement], -1.0 / self.lengths[toElement]], axis=1)
+		self.nodes      = numpy.where(fromAtEnd[:, None], self.ends[fromElement], self.starts[fromElement])
+
+	def _junctions(self, geometry, tolerance):
+		''' Return groups of (element, node is at the element's end?) for wire ends that touch each other or
+			land on a joint inside another wire (see nec2junction)
+		'''
+		graph  = junctionGraph(geometry, tolerance)
+		owners = [(2*k, False) for k in graph.first] + [(2*k + 1, True) for k in graph.last - 1]
+		nodes  = graph.endNodes.T.ravel()  # starts of every wire, then ends
+		groups = {}
+		for end in numpy.nonzero(graph.multiplicity[nodes] > 1)[0]:
+			groups.setdefault(nodes[end], []).append(owners[end])
+		for segment, node in zip(graph.tapSegments, graph.tapNodes):
+			groups.setdefault(node, []).append((2*segment + 1, True))
+		return [groups[node] for node in sorted(groups)]
+
+	def mirror(self, image, reversed_):
+		''' Given the mirror image of each segment and whether the image runs the opposite way (see
+			nec2geometry.mirrorMap), return (image, sign): reflecting basis function n gives sign[n] times basis
+			function image[n]. Returns None if some basis function's reflection isn't one of the basis
+			functions, as happens where the mesh's junctions don't share the geometry's symmetry.
+		'''
+		flipped = numpy.repeat(reversed_, 2)
+		elementImage = numpy.empty(2 * self.segmentCount, dtype=int)
+		elementImage[0::2] = 2 * image + reversed_
+		elementImage[1::2] = 2 * image + 1 - reversed_
+		# A piece of a basis function is identified by its element and shape; reflection takes it to the
+		# image element, with the shape and the direction of the current swapped if the image runs backwards
+		pieces = 2 * self.elements + self.shapes
+		imageFlipped = flipped[self.elements]
+		imagePieces = 2 * elementImage[self.elements] + numpy.where(imageFlipped, 1 - self.shapes, self.shapes)
+		imageDirections = numpy.where(imageFlipped, -self.directions, self.directions)
+		span = 4 * self.segmentCount
+		keys = pieces.min(axis=1) * span + pieces.max(axis=1)
+		imageKeys = imagePieces.min(axis=1) * span + imagePieces.max(axis=1)
+		order = numpy.argsort(keys)
+		found = numpy.minimum(numpy.searchsorted(keys[order], imageKeys), len(keys) - 1)
+		result = order[found]
+		if (keys[result] != imageKeys).any():
+			return None
+		swapped = pieces[result, 0] != imagePieces[:, 0]  # the image's pieces are listed the other way round
+		matched = numpy.where(swapped[:, None], self.directions[result][:, ::-1], self.directions[result])
+		sign = imageDirections / matched
+		if (sign[:, 0] != sign[:, 1]).any():
+			return None
+		return result, sign[:, 0]
+
+	def __len__(self):
+		return len(self.elements)
+
+
+# =======================================================================================================
+# Impedance matrix
+# =======================================================================================================
+
+class _Kernel:
+	def __init__(self, mesh, rows=None):
+		''' Precompute everything about the element to element potential integrals that doesn't depend on
+			frequency. The reduced kernel exp(-jkR)/R is split into 1/R, whose inner integral along the source
+			element has a closed form, and the smooth remainder (exp(-jkR) - 1)/R, which only needs a few
+			Gauss points per element on each side and is the only part evaluated per frequency. Only the
+			rows of the impedance matrix for basis functions rows (default all) are filled, so only the
+			elements those live on are observation points. Observation elements are taken a block at a time
+			(here and in matrix()), keeping the temporaries to about CHUNK_ELEMENTS quadrature points x
+			elements.
+		'''
+		self.mesh = mesh
+		self.count = len(mesh.lengths)
+		self.rows = numpy.arange(len(mesh)) if rows is None else numpy.asarray(rows)
+		self.observers = numpy.unique(mesh.elements[self.rows])
+		self.local = numpy.full(self.count, -1)
+		self.local[self.observers] = numpy.arange(len(self.observers))
+		step = max(1, CHUNK_ELEMENTS // (QUADRATURE * self.count))
+		self.blocks = [slice(a, a + step) for a in range(0, len(self.observers), step)]
+		o, n = len(self.observers), self.count
+		self.static = (numpy.empty((2, 2, o, n)), numpy.empty((o, n)))
+		x, w = self._gauss(QUADRATURE)
+		for block in self.blocks:
+			observers = self.observers[block]
+			points = self._points(x, observers)
+			weights = (mesh.lengths[observers, None] * w[None, :]).reshape(-1)
+
+			# Static part: S0 = integral of 1/R ds',  S1 = integral of (s'/h)/R ds' along each source element
+			d   = points[:, None, :] - mesh.starts[None, :, :]
+			t0  = (d * mesh.units[None, :, :]).sum(axis=2)
+			rho = numpy.sqrt(numpy.maximum((d**2).sum(axis=2) - t0**2, 0.0) + mesh.radii[None, :]**2)
+			h   = mesh.lengths[None, :]
+			R0  = numpy.sqrt(t0**2 + rho**2)
+			Rh  = numpy.sqrt((h - t0)**2 + rho**2)
+			S0  = numpy.arcsinh((h - t0) / rho) + numpy.arcsinh(t0 / rho)
+			S1  = ((Rh - R0) + t0 * S0) / h
+			self.static[0][:, :, block], self.static[1][block] = self._integrate(x, weights, S1, S0 - S1, QUADRATURE)
+
+		# Smooth part: Gauss points of every element. The distances between them are kept for small meshes
+		# and worked out again a block at a time for each fill of large ones.
+		self.x, self.w = self._gauss(SMOOTH_QUADRATURE)
+		self.sources = self._points(self.x).reshape(n, SMOOTH_QUADRATURE, 3)
+		self.weights = (mesh.lengths[self.observers, None] * self.w[None, :]).reshape(-1)
+		self.distances = None
+		if o * n * SMOOTH_QUADRATURE**2 <= KEEP_DISTANCES:
+			self.distances = [self._distances(block) for block in self.blocks]
+
+	def _distances(self, block):
+		''' Return the (block elements * SMOOTH_QUADRATURE, elements, SMOOTH_QUADRATURE) distances between the
+			smooth part's Gauss points on a block of observation elements and those on every element
+		'''
+		diff = self._points(self.x, self.observers[block])[:, None, None, :] - self.sources[None, :, :, :]
+		return numpy.sqrt((diff**2).sum(axis=3) + self.mesh.radii[None, :, None]**2)
+
+	def _gauss(self, count):
+		''' Return Gauss-Legendre points and weights on [0, 1]
+		'''
+		x, w = numpy.polynomial.legendre.leggauss(count)
+		return 0.5 * (x + 1.0), 0.5 * w
+
+	def _points(self, x, elements=None):
+		''' Return the points at fractions x along every element (or the given ones), flattened to
+			(elements * len(x), 3)
+		'''
+		m = self.mesh
+		elements = numpy.arange(self.count) if elements is None else elements
+		starts, ends = m.starts[elements], m.ends[elements]
+		return (starts[:, None, :] + x[None, :, None] * (ends - starts)[:, None, :]).reshape(-1, 3)
+
+	def _integrate(self, x, weights, rise, fall, count):
+		''' Integrate potentials known at count Gauss points x per observation element against the linear
+			shapes. rise and fall are (observers * count, elements) integrals of G times the source element's
+			rising and falling shapes. Returns (A, B): A[a, b] weights the observation side with shape a and
+			the source side with shape b (1 rises from 0 at an element's start to 1 at its end, 0 falls),
+			and B is the plain double integral of G.
+		'''
+		n, o = self.count, len(weights) // count
+		outer = (numpy.tile(1.0 - x, o) * weights, numpy.tile(x, o) * weights)
+		A = numpy.empty((2, 2, o, n), dtype=rise.dtype)
+		for a in (0, 1):
+			A[a, 0] = (outer[a][:, None] * fall).reshape(o, count, n).sum(axis=1)
+			A[a, 1] = (outer[a][:, None] * rise).reshape(o, count, n).sum(axis=1)
+		B = A[0, 0] + A[0, 1] + A[1, 0] + A[1, 1]
+		return A / (4.0 * math.pi), B / (4.0 * math.pi)
+
+	def matrix(self, k, omega):
+		''' Return the rows of the impedance matrix at wave number k and angular frequency omega, adding in
+			the potentials of one block of observation elements at a time
+		'''
+		m = self.mesh
+		Z = numpy.zeros((len(self.rows), len(m)), dtype=complex)
+		for number, block in enumerate(self.blocks):
+			R = self._distances(block) if self.distances is None else self.distances[number]
+			smooth = (numpy.exp(-1j * k * R) - 1.0) / R * (self.w * m.lengths[None, :, None])
+			rise = smooth.dot(self.x)
+			fall = smooth.sum(axis=2) - rise
+			first = block.start * SMOOTH_QUADRATURE
+			A, B = self._integrate(self.x, self.weights[first:first + len(R)], rise, fall, SMOOTH_QUADRATURE)
+			A += self.static[0][:, :, block]
+			B += self.static[1][block]
+
+			# Rows whose observation side (element p of their basis function) is in the block
+			for p in (0, 1):
+				local = self.local[m.elements[self.rows, p]] - block.start
+				inside = (local >= 0) & (local < len(B))
+				rows, local = self.rows[inside], local[inside]
+				ep = m.elements[rows, p]
+				for q in (0, 1):
+					eq = m.elements[:, q]
+					dot = m.units[ep].dot(m.units[eq].T) * numpy.outer(m.directions[rows, p], m.directions[:, q])
+					Z[inside] += 1j * omega * MU0 * dot * A[m.shapes[rows, p][:, None], m.shapes[:, q][None, :], local[:, None], eq[None, :]]
+					Z[inside] += numpy.outer(m.divergence[rows, p], m.divergence[:, q]) * B[local[:, None], eq[None, :]] / (1j * omega * EPS0)
+		return Z
+
+
+# =======================================================================================================
+# Mirror symmetry
+# =======================================================================================================
+
+class Symmetry:
+	def __init__(self, mirrors):
+		''' Block diagonal form of the impedance matrix for a mesh that is its own mirror image in one or more
+			coordinate planes. mirrors holds the (image, sign) of each plane's reflection (see Mesh.mirror).
+			The reflections generate a group of 2^k symmetries that all commute with the impedance matrix, so
+			in a basis of currents that are even or odd under each plane (one combination per character of
+			the group) it splits into 2^k independent blocks. Each block only needs the matrix rows of one
+			basis function per orbit, the representatives.
+		'''
+		count = len(mirrors[0][0])
+		images, signs = [numpy.arange(count)], [numpy.ones(count)]
+		for image, sign in mirrors:  # the group, element g reflecting in the planes of g's set bits
+			images, signs = images + [image[i] for i in images], signs + [sign[i] * s for i, s in zip(images, signs)]
+		images, signs = numpy.array(images), numpy.array(signs)
+		order = len(images)
+		self.planes = len(mirrors)
+		self.representatives, orbit = numpy.unique(images.min(axis=0), return_inverse=True)
+		orbitSize = numpy.bincount(orbit)
+		members = images[:, self.representatives].T
+		stabilizer = members == self.representatives[:, None]
+		parity = numpy.array([[(-1.0)**bin(g & character).count('1') for g in range(order)] for character in range(order)])
+
+		# For each character: the orbits whose combination doesn't cancel to nothing, the basis functions
+		# making it up, and their coefficients (duplicates, from reflections that fix the representative, add up)
+		self.blocks = []
+		for character in range(order):
+			coefficients = parity[character][None, :] * signs[:, self.representatives].T
+			rows = numpy.nonzero(~(stabilizer & (coefficients < 0.0)).any(axis=1))[0]
+			scale = numpy.sqrt(orbitSize[rows])
+			weights = coefficients[rows] * (orbitSize[rows] / float(order) / scale)[:, None]
+			self.blocks.append((rows, members[rows], weights, scale))
+		if sum(len(block[0]) for block in self.blocks) != count:
+			raise AssertionError("Symmetric blocks don't add up to the mesh")
+
+	def solve(self, rows, voltage):
+		''' Solve for the basis function currents given the representatives' rows of the impedance matrix
+		'''
+		currents = numpy.zeros(len(voltage), dtype=complex)
+		for block, members, weights, scale in self.blocks:
+			if not len(block):
+				continue
+			Z = rows[block]
+			reduced = scale[:, None] * sum(Z[:, members[:, g]] * weights[None, :, g] for g in range(members.shape[1]))
+			solution = numpy.linalg.solve(reduced, (weights * voltage[members]).sum(axis=1))
+			numpy.add.at(currents, members, weights * solution[:, None])
+		return currents
+
+
+def meshSymmetry(mesh, geometry, tolerance=1e-6):
+	''' Return the Symmetry of the mesh in the coordinate planes the geometry is symmetric in, or None.
+		Planes the whole mesh lies in leave every basis function where it is and are skipped.
+	'''
+	mirrors = []
+	for axis in symmetryPlanes(geometry, tolerance):
+		mirror = mesh.mirror(*mirrorMap(geometry, axis, tolerance))
+		if mirror is not None and not ((mirror[0] == numpy.arange(len(mesh))).all() and (mirror[1] > 0.0).all()):
+			mirrors.append(mirror)
+	return Symmetry(mirrors) if mirrors else None
+
+
+# =======================================================================================================
+# Solver
+# =======================================================================================================
+
+class Result:
+	def __init__(self, frequencies, impedance, currents, geometry, z0):
+		''' Solver output for a frequency sweep: frequencies in MHz, complex input impedance in ohms, SWR
+			relative to z0, and the complex current at the center of each segment of the compiled geometry
+			(one row per frequency)
+		'''
+		self.frequencies = frequencies
+		self.impedance   = impedance
+		self.currents    = currents
+		self.geometry    = geometry
+		self.z0          = z0
+		self.swr         = swr(impedance, z0)
+		self.fills       = None  # Exact impedance matrix fills it took, when known
+		self.metrics     = None  # nec2metrics.metricsArrays() of its patterns, when a sweep asks for them
+
+	def __len__(self):
+		return len(self.frequencies)
+
+
+def swr(impedance, z0=50.0):
+	''' Return the SWR of a load impedance on a line with characteristic impedance z0
+	'''
+	gamma = numpy.abs((impedance - z0) / (impedance + z0))
+	return (1.0 + gamma) / (1.0 - gamma)
+
+
+def frequencies(start, stepSize=None, stepCount=None):
+	''' Return the frequencies in MHz that a linear FR card with these parameters sweeps through, or those of
+		a nec2utils.FrequencyList passed as start
+	'''
+	if isinstance(start, FrequencyList):
+		return numpy.array(start.values(), dtype=float)
+	return start + stepSize * numpy.arange(truncate(stepCount))
+
+
+class Solver:
+	def __init__(self, model, symmetry=True):
+		''' Compile the model and do all the frequency independent setup once, so the solver can be asked
+			for any number of frequencies, in any order. With symmetry, mirror symmetry in the coordinate
+			planes is used to fill only the rows of one basis function per orbit and solve the even and odd
+			parts separately.
+		'''
+		self.geometry = compileGeometry(model)
+		self.feed     = self.geometry.segmentIndex(model.EX_tag, model.EX_segment)
+		self.mesh     = Mesh(self.geometry)
+		self.symmetry = meshSymmetry(self.mesh, self.geometry) if symmetry else None
+		self.rows     = numpy.arange(len(self.mesh)) if self.symmetry is None else self.symmetry.representatives
+		self.kernel   = _Kernel(self.mesh, self.rows)
+		self.fills    = 0  # Impedance matrices filled exactly so far
+		self.voltage  = numpy.zeros(len(self.mesh), dtype=complex)
+		self.voltage[self.feed] = 1.0
+
+	def matrix(self, mhz):
+		''' Fill the impedance matrix at one frequency (only the rows in self.rows)
+		'''
+		self.fills += 1
+		return self.kernel.matrix(2.0 * math.pi * mhz / CVEL, 2.0 * math.pi * mhz * 1.0e6)
+
+	def currents(self, mhz, matrix=None):
+		''' Return the segment currents at one frequency for the 1 volt source
+		'''
+		if matrix is None:
+			matrix = self.matrix(mhz)
+		if self.symmetry is not None:
+			return self.symmetry.solve(matrix, self.voltage)[:self.mesh.segmentCount]
+		return numpy.linalg.solve(matrix, self.voltage)[:self.mesh.segmentCount]
+
+	def solve(self, sweep, z0=50.0, interpolation=None):
+		''' Return the Result for an array of frequencies in MHz. With interpolation (a tolerance, see
+			MatrixInterpolator) the impedance matrices come from a MatrixInterpolator across the sweep
+			instead of being filled at every frequency, unless that would take more fills than it saves.
+		'''
+		sweep = numpy.asarray(sweep, dtype=float)
+		interpolator = None
+		if interpolation and len(sweep) > INTERPOLATION_ORDER + 1:
+			interpolator = MatrixInterpolator(self, sweep.min(), sweep.max(), interpolation, maxFills=len(sweep) // 2)
+			if interpolator.fallback:
+				interpolator = None
+		currents = numpy.empty((len(sweep), self.mesh.segmentCount), dtype=complex)
+		for i, mhz in enumerate(sweep):
+			currents[i] = self.currents(mhz, None if interpolator is None else interpolator.matrix(mhz))
+		result = Result(sweep, 1.0 / currents[:, self.feed], currents, self.geometry, z0)
+		result.fills = self.fills
+		return result
+
+
+class MatrixInterpolator:
+	def __init__(self, solver, low, high, tolerance=INTERPOLATION_TOLERANCE, order=INTERPOLATION_ORDER, maxFills=None):
+		''' Impedance matrices between low and high MHz, interpolated element by element from exact fills at
+			a few anchor frequencies. Each element is multiplied by omega * exp(jkR), with R the distance
+			between the two basis functions' nodes, which takes out its fast phase rotation and 1/omega
+			charge term and leaves something a low order polynomial follows well.
+
+			Anchors start evenly spaced. Every gap between anchors is checked by filling the matrix at its
+			midpoint exactly and comparing the currents it gives with the interpolated matrix's; gaps off by
+			more than tolerance (relative, in the 2-norm of the currents) get the midpoint as a new anchor and
+			are checked again in halves. If that takes more than maxFills exact fills, fallback is set and
+			the caller should fill every matrix exactly.
+		'''
+		self.solver   = solver
+		self.order    = order
+		self.fallback = False
+		nodes         = solver.mesh.nodes
+		self.R        = numpy.sqrt(((nodes[solver.rows][:, None, :] - nodes[None, :, :])**2).sum(axis=2))
+		self.anchors  = {}  # MHz -> smoothed matrix
+		self.exact    = {}  # MHz -> exactly filled matrix, kept for the midpoints that were checked
+		fills = solver.fills
+		for mhz in numpy.linspace(low, high, order + 1):
+			self._anchor(mhz, solver.matrix(mhz))
+		gaps = list(zip(sorted(self.anchors)[:-1], sorted(self.anchors)[1:]))
+		while gaps:
+			a, b = gaps.pop()
+			middle = 0.5 * (a + b)
+			if maxFills is not None and solver.fills - fills >= maxFills:
+				self.fallback = True
+				break
+			exact = solver.matrix(middle)
+			interpolated = self.matrix(middle)
+			expected = solver.currents(middle, exact)
+			error = numpy.linalg.norm(solver.currents(middle, interpolated) - expected) / numpy.linalg.norm(expected)
+			if error > tolerance:
+				self._anchor(middle, exact)
+				gaps += [(a, middle), (middle, b)]
+			else:
+				self.exact[middle] = exact
+
+	def _anchor(self, mhz, matrix):
+		self.anchors[mhz] = matrix * self._factor(mhz)
+
+	def _factor(self, mhz):
+		return (2.0 * math.pi * mhz) * numpy.exp(1j * (2.0 * math.pi * mhz / CVEL) * self.R)
+
+	def matrix(self, mhz):
+		''' Return the (interpolated) impedance matrix at mhz: Lagrange interpolation through the order + 1
+			anchors nearest to it
+		'''
+		if mhz in self.exact:
+			return self.exact[mhz]
+		anchors = numpy.array(sorted(self.anchors))
+		nearest = numpy.sort(anchors[numpy.argsort(numpy.abs(anchors - mhz), kind='stable')[:self.order + 1]])
+		smooth = numpy.zeros_like(self.anchors[nearest[0]])
+		for i, xi in enumerate(nearest):
+			weight = numpy.prod([(mhz - xj) / (xi - xj) for j, xj in enumerate(nearest) if j != i])
+			smooth += weight * self.anchors[xi]
+		return smooth / self._factor(mhz)
+
+
+def solve(model, start, stepSize=None, stepCount=None, z0=50.0, interpolation=INTERPOLATION_TOLERANCE, symmetry=True):
+	''' Solve the model at each frequency of the FR sweep that getText(start, stepSize, stepCount) would
+		request, with the EX card's 1 volt source at model.EX_tag / model.EX_segment. start may be a
+		nec2utils.FrequencyList. Sweeps of more than INTERPOLATE_ABOVE frequencies interpolate impedance
+		matrices to within interpolation (None fills every one exactly). symmetry uses the geometry's mirror
+		symmetry to cut the work (see Solver); the results differ only by rounding. If a nec2cache is active
+		and already holds this deck's results, they're returned without solving anything.
+	'''
+	sweep = frequencies(start, stepSize, stepCount)
+	if len(sweep) <= INTERPOLATE_ABOVE:
+		interpolation = None
+	kind = CACHE_KIND if interpolation is None else '{} interpolated {}'.format(CACHE_KIND, interpolation)
+	cache = nec2cache.activeCache()
+	if cache is not None:
+		key = nec2cache.modelKey(model, start, stepSize, stepCount, kind)
+		arrays = cache.get(key)
+		if arrays is not None:
+			return Result(arrays['frequencies'], arrays['impedance'], arrays['currents'], compileGeometry(model), z0)
+	result = Solver(model, symmetry).solve(sweep, z0, interpolation)
+	if cache is not None:
+		cache.put(key, {'frequencies': result.frequencies, 'impedance': result.impedance, 'currents': result.currents}, kind)
+	return result
+
+
+def memoryEstimate(segments, frequencyCount=1):
+	''' Return a rough upper bound in bytes on what solve() needs for a model of this many segments over a
+		sweep of frequencyCount frequencies: the kernel's static part (and its kept distances, for small
+		meshes), the impedance matrices being solved or kept as interpolation anchors, and the temporaries
+		of one block of the fill
+	'''
+	pairs = (2 * segments)**2  # elements x elements, and about basis functions x basis functions
+	distances = pairs * SMOOTH_QUADRATURE**2
+	matrices = 2
+	if frequencyCount > INTERPOLATE_ABOVE:
+		matrices += INTERPOLATION_ORDER + 2 + frequencyCount // 2
+	return 8 * (5 * pairs + (distances if distances <= KEEP_DISTANCES else 0) + 2 * matrices * pairs + 16 * CHUNK_ELEMENTS)
@@ -0,0 +1,192 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Parametric sweeps: build a Model from named parameters, evaluate every variant in a grid (or any list of
+parameter sets) on a pool of worker processes, and collect the results in a table indexed by parameter
+values. This takes the place of editing correctionFactor and friends by hand and re-running a script.
+
+The build function has to be importable by the workers, so define it at the top level of a module (and
+start the sweep from under if __name__ == '__main__' in a script).
+
+Usage:
+
+  def buildYagi(correctionFactor, Y0):
+      ...
+      return model
+
+  table = nec2sweep.sweep(buildYagi, nec2sweep.grid(correctionFactor=[0.92, 0.93, 0.94], Y0=[inch(5), inch(6)]),
+                          start=145.5, stepSize=0.05, stepCount=40)
+  table[0.93, inch(5)].swr
+  table.best()
+'''
+
+import itertools
+import multiprocessing
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import nec2metrics
+import nec2solver
+
+
+# =======================================================================================================
+# Parameter sets
+# =======================================================================================================
+
+def grid(**axes):
+	''' Return the list of parameter dicts for every combination of the given values, e.g.
+		grid(a=[1, 2], b=[3, 4]) -> [{'a': 1, 'b': 3}, {'a': 1, 'b': 4}, {'a': 2, 'b': 3}, {'a': 2, 'b': 4}]
+	'''
+	names = sorted(axes)
+	return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+
+# =======================================================================================================
+# Results table
+# =======================================================================================================
+
+class SweepRow:
+	def __init__(self, parameters, result, error):
+		''' One variant: its parameter dict, the nec2solver.Result (None if it failed) and the error text
+		'''
+		self.parameters = parameters
+		self.result     = result
+		self.error      = error
+
+
+class SweepTable:
+	def __init__(self, names, rows):
+		''' Sweep results: names is the ordered list of parameter names and rows the SweepRows, in the order
+			the parameter sets were given. Index with a tuple of values in names order (or a single value for
+			a one parameter sweep), or with a dict.
+		'''
+		self.names = names
+		self.rows  = rows
+		self._index = dict((self._key(row.parameters), row) for row in rows)
+
+	def _key(self, parameters):
+		if isinstance(parameters, dict):
+			return tuple(parameters[name] for name in self.names)
+		if not isinstance(parameters, tuple):
+			return (parameters,)
+		return parameters
+
+	def __len__(self):
+		return len(self.rows)
+
+	def __iter__(self):
+		return iter(self.rows)
+
+	def __getitem__(self, parameters):
+		''' Return the nec2solver.Result for a parameter set
+		'''
+		return self._index[self._key(parameters)].result
+
+	@property
+	def frequencies(self):
+		for row in self.rows:
+			if row.result is not None:
+				return row.result.frequencies
+		return numpy.zeros(0)
+
+	def values(self, name):
+		''' Return the values of one parameter, one per row
+		'''
+		return numpy.array([row.parameters[name] for row in self.rows])
+
+	def impedance(self):
+		''' Return the (rows, frequencies) array of input impedances, nan for variants that failed
+		'''
+		return self._stack('impedance', complex)
+
+	def swr(self):
+		''' Return the (rows, frequencies) array of SWRs, nan for variants that failed
+		'''
+		return self._stack('swr', float)
+
+	def metric(self, name):
+		''' Return the (rows, frequencies) array of one nec2metrics field (e.g. 'frontToBack'), for a sweep
+			run with metrics=True; nan for variants that failed
+		'''
+		table = numpy.full((len(self.rows), len(self.frequencies)), numpy.nan)
+		for i, row in enumerate(self.rows):
+			if row.result is not None:
+				table[i] = row.result.metrics[name]
+		return table
+
+	def _stack(self, attribute, dtype):
+		table = numpy.full((len(self.rows), len(self.frequencies)), numpy.nan, dtype=dtype)
+		for i, row in enumerate(self.rows):
+			if row.result is not None:
+				table[i] = getattr(row.result, attribute)
+		return table
+
+	def best(self, score=None):
+		''' Return the SweepRow with the lowest score(result), by default the minimum SWR across the sweep
+		'''
+		score = score or (lambda result: result.swr.min())
+		scored = [(score(row.result), i) for i, row in enumerate(self.rows) if row.result is not None]
+		if not scored:
+			raise ValueError("every variant in the sweep failed")
+		return self.rows[min(scored)[1]]
+
+	def getText(self):
+		''' Return the table as text: one line per variant with its parameters, minimum SWR, and the
+			frequency and impedance where that minimum falls
+		'''
+		header = ''.join(['{: >14}'.format(name[:13]) for name in self.names])
+		lines = [header + '{: >10}{: >12}{: >22}\n'.format('min SWR', 'MHz', 'Z (ohms)')]
+		for row in self.rows:
+			line = ''.join(['{: >14.6g}'.format(row.parameters[name]) for name in self.names])
+			if row.result is None:
+				lines.append(line + '  failed: {}\n'.format(row.error.strip().split('\n')[-1]))
+			else:
+				i = numpy.argmin(row.result.swr)
+				z = row.result.impedance[i]
+				lines.append(line + '{: >10.3f}{: >12.4f}{: >11.2f}{:+9.2f}j\n'.format(row.result.swr[i], row.result.frequencies[i], z.real, z.imag))
+		return ''.join(lines)
+
+
+# =======================================================================================================
+# Sweeps
+# =======================================================================================================
+
+def evaluate(build, parameters, start, stepSize, stepCount, z0=50.0, keepCurrents=False, metrics=False):
+	''' Build and solve one variant, returning (Result, None) or (None, error text). The Result's compiled
+		geometry is dropped, and so are its currents unless keepCurrents, to keep what crosses back from the
+		worker process small. With metrics, result.metrics holds the nec2metrics.metricsArrays() of every
+		frequency's pattern, worked out before the currents go.
+	'''
+	try:
+		result = nec2solver.solve(build(**parameters), start, stepSize, stepCount, z0)
+		if metrics:
+			result.metrics = nec2metrics.metricsArrays(nec2metrics.farFieldMetrics(result))
+	except Exception:
+		return None, ''.join(traceback.format_exception(*sys.exc_info()))
+	result.geometry = None
+	if not keepCurrents:
+		result.currents = None
+	return result, None
+
+
+def sweep(build, parameterSets, start, stepSize, stepCount, z0=50.0, workers=None, keepCurrents=False, metrics=False):
+	''' Evaluate build(**parameters) for every parameter dict in parameterSets over the FR sweep (start,
+		stepSize, stepCount) on workers processes (default: one per core) and return a SweepTable. A variant
+		that raises doesn't stop the sweep; its row carries the traceback instead of a result. With metrics,
+		every variant also gets pattern metrics (see SweepTable.metric) for a few KB each.
+	'''
+	parameterSets = [dict(parameters) for parameters in parameterSets]
+	names = sorted(parameterSets[0]) if parameterSets else []
+	workers = workers or multiprocessing.cpu_count()
+	if workers == 1:
+		outcomes = [evaluate(build, p, start, stepSize, stepCount, z0, keepCurrents, metrics) for p in parameterSets]
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			futures = [pool.submit(evaluate, build, p, start, stepSize, stepCount, z0, keepCurrents, metrics) for p in parameterSets]
+			outcomes = [future.result() for future in futures]
+	rows = [SweepRow(parameters, result, error) for parameters, (result, error) in zip(parameterSets, outcomes)]
+	return SweepTable(names, rows)
@@ -5,7 +5,16 @@ MIT License
 Utility code for generating antenna geometry files in nec2 card stack format
 '''
 
+import gzip
 import math
+import operator
+import sys
+from array import array
+
+try:
+	import numpy
+except ImportError:
+	numpy = None  # formatCards() needs numpy, everything else falls back to per-card formatting
 
 
 # =======================================================================================================
@@ -18,10 +27,169 @@ def sci(f):
 	return '{: > 13.5E}'.format(f)
 
 
+def truncate(i):
+	''' Return i as an int, truncated toward zero. Unlike math.trunc() this takes numpy integers too, which
+		don't define __trunc__ under numpy 2.
+	'''
+	try:
+		return operator.index(i)
+	except TypeError:
+		return math.trunc(i)
+
+
 def dec(i):
 	''' Return formatted string containing a decimal integer in a 6 char wide field (tags, segments)
 	'''
-	return '{: >6d}'.format(math.trunc(i))
+	return '{: >6d}'.format(truncate(i))
+
+
+def cardLine(name, ints, floats):
+	''' Return one formatted card: the two letter mnemonic followed by its integer fields and float fields
+	'''
+	line = name
+	for i in ints:
+		line += dec(i)
+	for f in floats:
+		line += sci(f)
+	return line + "\n"
+
+
+# =======================================================================================================
+# Bulk field formatting. formatCards() builds the same fixed width columns as sci() and dec(), but for a
+# whole block of cards at once by writing digits straight into a byte array, one field column at a time.
+# Values the fast path can't be sure about (3 digit exponents, nan/inf, rounding ties it can't settle
+# exactly) are handed to sci() itself, so the output is always byte-identical to cardLine().
+# =======================================================================================================
+
+if numpy is not None:
+	_POW10 = 10.0 ** numpy.arange(-110, 111)  # _POW10[110 + k] == 10**k, exact for 0 <= k <= 22
+
+
+def _productError(a, b, product):
+	''' Return a*b - product exactly, where product is the float result of a*b (Dekker's two-product)
+	'''
+	split = 134217729.0  # 2**27 + 1
+	t  = split * a
+	ah = t - (t - a)
+	al = a - ah
+	t  = split * b
+	bh = t - (t - b)
+	bl = b - bh
+	return ((ah*bh - product) + ah*bl + al*bh) + al*bl
+
+
+def _digitRows(values, count):
+	''' Return a (count, n) uint8 array of the last count decimal digits of non-negative ints, as ASCII
+	'''
+	values = values.astype(numpy.int32)
+	rows = numpy.empty((count, values.size), dtype=numpy.uint8)
+	for i in range(count):
+		rows[count-1-i] = values % 10 + ord('0')
+		values = values // 10
+	return rows
+
+
+def _sciRows(column):
+	''' Return a (13, n) uint8 array whose row i holds character i of sci() for each value of a 1-D float array
+	'''
+	column = numpy.ascontiguousarray(column, dtype=numpy.float64)
+	mag    = numpy.abs(column)
+	zero   = mag == 0.0
+	fast   = (mag > 1e-95) & (mag < 1e95)  # also rules out nan and inf
+	mag[~fast] = 1.0
+	# Scale each value so its 6 significant digits land in front of the decimal point
+	exp    = numpy.floor(numpy.log10(mag)).astype(numpy.int64)
+	power  = _POW10[115 - exp]
+	scaled = mag * power
+	low    = scaled < 99999.5  # log10 rounded the exponent up
+	if low.any():
+		exp[low]   -= 1
+		power[low]  = _POW10[115 - exp[low]]
+		scaled[low] = mag[low] * power[low]
+	mant   = numpy.rint(scaled)
+	# Away from a tie the float product rounds the right way. When the power of ten is exact, a product that
+	# lands exactly on .5 gets settled from the exact product error; otherwise near-ties go to sci().
+	exact  = (exp >= -17) & (exp <= 5)
+	frac   = scaled - numpy.floor(scaled)
+	fast  &= exact | (numpy.abs(frac - 0.5) > 1e-6)
+	tie    = exact & (frac == 0.5)
+	if tie.any():
+		error = _productError(mag[tie], power[tie], scaled[tie])
+		base  = numpy.floor(scaled[tie])
+		mant[tie] = base + ((error > 0) | ((error == 0) & (base % 2 == 1)))
+	carry  = mant >= 1000000  # 9.999995 rounds up to 1.00000E+01
+	mant[carry] = 100000
+	exp   += carry
+	mant[zero]  = 0
+	exp[zero]   = 0
+	fast  |= zero
+
+	rows = numpy.empty((13, column.size), dtype=numpy.uint8)
+	rows[0]  = ord(' ')
+	rows[1]  = numpy.where(numpy.signbit(column), ord('-'), ord(' '))
+	digits   = _digitRows(mant, 6)
+	rows[2]  = digits[0]
+	rows[3]  = ord('.')
+	rows[4:9] = digits[1:]
+	rows[9]  = ord('E')
+	rows[10] = numpy.where(exp < 0, ord('-'), ord('+'))
+	rows[11:13] = _digitRows(numpy.abs(exp) % 100, 2)
+
+	slow = numpy.nonzero(~fast)[0]
+	if slow.size:
+		text = ''.join([sci(f) for f in column[slow]]).encode('ascii')
+		rows[:, slow] = numpy.frombuffer(text, dtype=numpy.uint8).reshape(slow.size, 13).T
+	return rows
+
+
+def _decRows(column):
+	''' Return a (6, n) uint8 array whose row i holds character i of dec() for each value of a 1-D int array.
+		Every value has to fit the 6 char field (see decFits).
+	'''
+	mag    = numpy.abs(column)
+	width  = numpy.ones(column.size, dtype=numpy.int64)
+	for power in range(1, 6):
+		width += mag >= 10**power
+	rows = _digitRows(mag, 6)
+	position = numpy.arange(6)[:, None]
+	rows[position < 6 - width] = ord(' ')
+	rows[(column < 0) & (position == 5 - width)] = ord('-')
+	return rows
+
+
+def decFits(values):
+	''' Return True if every integer in values fits in dec()'s 6 char field (-99999 to 999999)
+	'''
+	return bool(numpy.all((values > -100000) & (values < 1000000)))
+
+
+def formatCards(names, ints, floats):
+	''' Return the text for a block of cards that all have the same field layout, given the card mnemonics
+		and (n, k) arrays of integer and float fields. Same output as calling cardLine() on each card.
+	'''
+	if numpy is None:
+		raise ImportError("formatCards() requires numpy")
+	count = len(names)
+	if count == 0:
+		return ''
+	ints   = numpy.trunc(numpy.asarray(ints)).astype(numpy.int64).reshape(count, -1)
+	floats = numpy.asarray(floats, dtype=numpy.float64).reshape(count, -1)
+	if not decFits(ints):
+		# Oversized tags or segment counts widen their field, so these cards get done the slow way
+		return ''.join([cardLine(names[i], [int(v) for v in ints[i]], floats[i]) for i in range(count)])
+
+	# Build the block transposed (one row per character position) so every column write is contiguous
+	block = numpy.empty((2 + 6*ints.shape[1] + 13*floats.shape[1] + 1, count), dtype=numpy.uint8)
+	block[:2] = numpy.frombuffer(''.join(names).encode('ascii'), dtype=numpy.uint8).reshape(count, 2).T
+	column = 2
+	for i in range(ints.shape[1]):
+		block[column:column+6] = _decRows(ints[:, i])
+		column += 6
+	for i in range(floats.shape[1]):
+		block[column:column+13] = _sciRows(floats[:, i])
+		column += 13
+	block[column] = ord('\n')
+	return block.T.tobytes().decode('ascii')
 
 
 # =======================================================================================================
@@ -76,92 +244,234 @@ class Rotation:
 		self.rz = float(rz)
 
 
+# =======================================================================================================
+# Card storage
+# =======================================================================================================
+
+class CardStore:
+	''' Compact column store for cards sharing the GW/GA/GM layout: a two letter mnemonic, two integer fields,
+		and seven float fields. Fields go into flat typed arrays, so appending a card is O(1) and nothing gets
+		rendered to text until somebody asks for it.
+	'''
+	INTS   = 2
+	FLOATS = 7
+
+	def __init__(self):
+		self.names  = []          # Card mnemonic for each row ('GW', 'GA', 'GM')
+		self.ints   = array('l')  # INTS fields per row
+		self.floats = array('d')  # FLOATS fields per row
+
+	def __len__(self):
+		return len(self.names)
+
+	def __iter__(self):
+		for row in range(len(self.names)):
+			yield self.card(row)
+
+	def append(self, name, ints, floats):
+		''' Add a card given as (mnemonic, integer fields, float fields) and return its row number
+		'''
+		if len(ints) != self.INTS or len(floats) != self.FLOATS:
+			raise ValueError("{} card needs {} integer and {} float fields".format(name, self.INTS, self.FLOATS))
+		self.names.append(name)
+		self.ints.extend([truncate(i) for i in ints])
+		self.floats.extend(floats)
+		return len(self.names) - 1
+
+	def appendColumns(self, names, ints, floats):
+		''' Append a block of cards given as a list of mnemonics and (n, INTS) / (n, FLOATS) field arrays
+		'''
+		self.names.extend(names)
+		self.ints.frombytes(numpy.ascontiguousarray(ints, dtype=numpy.dtype(self.ints.typecode)).tobytes())
+		self.floats.frombytes(numpy.ascontiguousarray(floats, dtype=numpy.float64).tobytes())
+
+	def extend(self, other):
+		''' Append all the cards of another store
+		'''
+		self.names.extend(other.names)
+		self.ints.extend(other.ints)
+		self.floats.extend(other.floats)
+
+	def setInts(self, row, ints):
+		''' Replace the integer fields of the card at the given row
+		'''
+		self.ints[row*self.INTS:(row+1)*self.INTS] = array(self.ints.typecode, [truncate(i) for i in ints])
+
+	def card(self, row):
+		''' Return the card at the given row as a (mnemonic, integer fields, float fields) tuple
+		'''
+		i = row * self.INTS
+		f = row * self.FLOATS
+		return (self.names[row], tuple(self.ints[i:i+self.INTS]), tuple(self.floats[f:f+self.FLOATS]))
+
+	def columns(self, first=0, last=None):
+		''' Return copies of the integer and float fields of rows first to last-1 (default all) as (n, INTS)
+			and (n, FLOATS) numpy arrays
+		'''
+		if last is None:
+			last = len(self)
+		ints   = numpy.array(self.ints[first*self.INTS:last*self.INTS], dtype=numpy.int64).reshape(-1, self.INTS)
+		floats = numpy.array(self.floats[first*self.FLOATS:last*self.FLOATS], dtype=numpy.float64).reshape(-1, self.FLOATS)
+		return ints, floats
+
+	def iterText(self, chunkSize=4096):
+		''' Render the stored cards in nec2 card stack format, yielding the text chunkSize cards at a time
+		'''
+		for first in range(0, len(self), chunkSize):
+			last = min(first + chunkSize, len(self))
+			if numpy is None:
+				yield ''.join([cardLine(*self.card(row)) for row in range(first, last)])
+			else:
+				ints, floats = self.columns(first, last)
+				yield formatCards(self.names[first:last], ints, floats)
+
+	def getText(self):
+		''' Render the stored cards in nec2 card stack format
+		'''
+		return ''.join(self.iterText())
+
+
+# =======================================================================================================
+# Frequency lists
+# =======================================================================================================
+
+class FrequencyList:
+	def __init__(self):
+		''' A list of frequencies to model, kept as the FR card ranges that express it. Pass one to getText()
+			in place of start, stepSize, and stepCount to get one FR card (and RP card) per range.
+		'''
+		self.ranges = []  # (start, stepSize, stepCount, stepType) of each FR card
+
+	def add(self, start, stepSize, stepCount, stepType=0):
+		''' Append a range: stepCount frequencies from start in MHz, stepping by adding stepSize (stepType 0)
+			or by multiplying by it (stepType 1)
+		'''
+		self.ranges.append((start, stepSize, truncate(stepCount), stepType))
+		return self
+
+	def values(self):
+		''' Return every frequency in MHz, in order
+		'''
+		values = []
+		for start, stepSize, stepCount, stepType in self.ranges:
+			for i in range(stepCount):
+				values.append(start * stepSize**i if stepType == 1 else start + stepSize * i)
+		return values
+
+	def __len__(self):
+		return sum([r[2] for r in self.ranges])
+
+
+def linearFrequencies(start, stepSize, stepCount):
+	''' Return the FrequencyList of a single linear FR card
+	'''
+	return FrequencyList().add(start, stepSize, stepCount)
+
+
+def frequencyPoints(values):
+	''' Return a FrequencyList of arbitrary frequencies, in the order given. Runs of evenly spaced values
+		share one FR card; anything irregular gets an FR card of its own.
+	'''
+	frequencies = FrequencyList()
+	values = [float(v) for v in values]
+	i = 0
+	while i < len(values):
+		if i + 1 == len(values):
+			frequencies.add(values[i], 0.0, 1)
+			break
+		step = values[i+1] - values[i]
+		j = i + 1
+		while j + 1 < len(values) and abs((values[j+1] - values[j]) - step) <= 1e-9 * max(abs(step), abs(values[j])):
+			j += 1
+		frequencies.add(values[i], step, j - i + 1)
+		i = j + 1
+	return frequencies
+
+
 # =======================================================================================================
 # Model class
 # =======================================================================================================
 
+AUTO = 'auto'  # Segment count for addWire()/addArc() that lets the model choose (see setSegmentation())
+
+
 class Model:
 	def __init__(self, wireRadius):
 		''' Prepare the model with the given wire radius
 		'''
-		self.wires      = ""
-		self.transforms = ""
+		self.wires      = CardStore()  # GW and GA cards, in tag order
+		self.transforms = CardStore()  # GM cards
+		self.tagRows    = {}           # Tag number -> row in self.wires
 		self.wireRadius = wireRadius
 		self.tag        = 0
 		self.EX_tag     = 0
 		self.EX_segment = 0
+		self.segmentation = None  # nec2segment.Segmenter, once setSegmentation() is called
+		self.replicated   = False # Set once replicate() has copied wires, after which no more can be added
+		self.setRadiationPattern(37, 37)
 
-		self.transformBuffer = ''
+		self.transformBuffer = CardStore()
 
 	# ---------------------------------------------------------------------------------------------------
 	# Low-level functions to generate nec2 cards
 	# See documentation at http://www.nec2.org/part_3/cards/ 
 	# Tag & segments have no units. Dimensions are in meters. Angles are in degrees.
+	# Cards are (mnemonic, integer fields, float fields) tuples; cardLine() turns them into text.
 	# ---------------------------------------------------------------------------------------------------
 
 	def flushTransformBuffer(self):
 		''' Used in some song and dance to avoid the edge case that can occur with an arc as the last element
 		    My double GM card trick causes a problem if the second GM tries to refer to a tag that doesn't exist
 		'''
-		self.transforms      += self.transformBuffer
-		self.transformBuffer  = ""
+		self.transforms.extend(self.transformBuffer)
+		self.transformBuffer = CardStore()
 
 
 	def gw(self, tag, segments, x1, y1, z1, x2, y2, z2, radius):
-		''' Return the line for a GW card, a wire.
+		''' Return a GW card, a wire.
 		'''
-		gw = "GW" + dec(tag) + dec(segments)
-		gw += sci(x1) + sci(y1) + sci(z1)
-		gw += sci(x2) + sci(y2) + sci(z2)
-		gw += sci(radius) + "\n"
-		return gw
+		return ("GW", (tag, segments), (x1, y1, z1, x2, y2, z2, radius))
 
 	def ga(self, tag, segments, arcRadius, startAngle, endAngle, wireRadius):
-		''' Return the line for a GA card, an arc in the X-Z plane with its center at the origin
+		''' Return a GA card, an arc in the X-Z plane with its center at the origin
 		'''
 		notUsed = 0.0
-		ga = "GA" + dec(tag) + dec(segments)
-		ga += sci(arcRadius) + sci(startAngle) + sci(endAngle)
-		ga += sci(wireRadius)
-		ga += sci(notUsed) # Note: xnec2c fills this in with its "Segs % lambda" field, but that may be a bug
-		ga += sci(notUsed) + sci(notUsed) + "\n"
-		return ga
-
-	def gm(self, rotX, rotY, rotZ, trX, trY, trZ, firstTag):
-		''' Return the line for a GM card, move (rotate and translate).
+		# Note: xnec2c fills the first unused field in with its "Segs % lambda" field, but that may be a bug
+		return ("GA", (tag, segments), (arcRadius, startAngle, endAngle, wireRadius, notUsed, notUsed, notUsed))
+
+	def gm(self, rotX, rotY, rotZ, trX, trY, trZ, firstTag, tagIncrement=0, newStructures=0):
+		''' Return a GM card, move (rotate and translate).
 			rotX, rotY, and rotZ: angle to rotate around each axis
 			trX, trY, and trZ: distance to translate along each axis
 			firstTag: first tag# to apply transform to (subseqent tag#'s get it too... like it or not)
+			tagIncrement: added to the tags of what's moved, or of each new copy over the one before
+			newStructures: 0 to move the wires, or the number of moved copies to add, leaving them in place
+		'''
+		return ("GM", (tagIncrement, newStructures), (rotX, rotY, rotZ, trX, trY, trZ, firstTag*1.0))
+
+	def gx(self, tagIncrement, planes):
+		''' Return a GX card, reflect the structure so far.
+			tagIncrement: added to the tags of the reflected copy (doubled for each further plane)
+			planes: XYZ digit flags, e.g. 100 reflects along X (in the Y-Z plane), 110 along X and Y
 		'''
-		tagIncrement = 0
-		newStructures = 0
-		gm = "GM" + dec(tagIncrement) + dec(newStructures)
-		gm += sci(rotX) + sci(rotY) + sci(rotZ)
-		gm += sci(trX) + sci(trY) + sci(trZ)
-		gm += sci(firstTag*1.0) + "\n"
-		return gm
+		return ("GX", (tagIncrement, planes), ())
 
 	def ge(self):
 		''' Card to "terminate reading of geometry data cards"
 		'''
 		GPFLAG = 0  # Ground plane flag. 0 means no ground plane present.
-		ge = "GE"
-		ge += dec(GPFLAG) + "\n"
-		return ge
+		return ("GE", (GPFLAG,), ())
 
-	def fr(self, start, stepSize, stepCount):
+	def fr(self, start, stepSize, stepCount, stepType=0):
 		''' Define the frequency range to be modeled
 		'''
-		IFRQ = 0           # Step type, 0 is linear (additive), 1 = multiplicative
+		IFRQ = stepType    # Step type, 0 is linear (additive), 1 = multiplicative
 		NFRQ = stepCount   # Number of frequency steps
 		I3   = 0           # blank
 		I4   = 0           # blank
 		FMHZ   = start     # Starting frequency in MHz
 		DELFRQ = stepSize  # Frequency stepping increment (IFRQ=0), or multiplication factor (IFRQ=1)
-		fr = "FR"
-		fr += dec(IFRQ) + dec(NFRQ) + dec(I3) + dec(I4)
-		fr += sci(FMHZ) + sci(DELFRQ) + "\n"
-		return fr
+		return ("FR", (IFRQ, NFRQ, I3, I4), (FMHZ, DELFRQ))
 
 	def ex(self,tag,segment):
 		''' Define excitation parameters.
@@ -172,43 +482,104 @@ class Model:
 		I4 = 0        # 0 means use defaults for admittance matrix asymmetry and printing input impedance voltage
 		F1 = 1.0      # Real part of voltage
 		F2 = 0.0      # Imaginary part of voltage
-		ex = "EX"
-		ex += dec(I1) + dec(I2) + dec(I3) + dec(I4)
-		ex += sci(F1) + sci(F2) + "\n"
-		return ex
+		return ("EX", (I1, I2, I3, I4), (F1, F2))
 
 
 	def rp(self):
-		''' Card to initiate calculation and output of radiation pattern.
-		'''
-		I1  = 0      # 0 is normal mode: defaults to free-space unless a previous GN card specified a ground plane
-		NTH = 37     # Number of values of theta (angle away from positive Z axis)
-		NPH = 37     # Number of values of phi (angle away from X axis in the XY plane)
-		I4  = 0      # Use defaults for some misc output printing options
-		THETS = 0.0  # Theta start value in degrees
-		PHIS  = 0.0  # Phi start value in degrees
-		DTH   = 10.0 # Delta-theta in degrees
-		DPH   = 10.0 # Delta-phi in degrees
-		rp = "RP"
-		rp += dec(I1) + dec(NTH) + dec(NPH) + dec(I4)
-		rp += sci(THETS) + sci(PHIS) + sci(DTH) + sci(DPH) + "\n"
-		return rp
+		''' Card to initiate calculation and output of radiation pattern, with the grid from setRadiationPattern()
+		'''
+		return ("RP", (self.RP_I1, self.RP_NTH, self.RP_NPH, self.RP_I4), (self.RP_THETS, self.RP_PHIS, self.RP_DTH, self.RP_DPH))
+
+	def setRadiationPattern(self, thetaCount, phiCount, thetaStart=0.0, phiStart=0.0, thetaStep=10.0, phiStep=10.0, mode=0, options=0):
+		''' Choose the theta/phi grid the RP card asks for. The defaults are a 37x37 grid at 10 degree steps.
+		'''
+		self.RP_I1    = mode        # 0 is normal mode: defaults to free-space unless a previous GN card specified a ground plane
+		self.RP_NTH   = thetaCount  # Number of values of theta (angle away from positive Z axis)
+		self.RP_NPH   = phiCount    # Number of values of phi (angle away from X axis in the XY plane)
+		self.RP_I4    = options     # Use defaults for some misc output printing options
+		self.RP_THETS = thetaStart  # Theta start value in degrees
+		self.RP_PHIS  = phiStart    # Phi start value in degrees
+		self.RP_DTH   = thetaStep   # Delta-theta in degrees
+		self.RP_DPH   = phiStep     # Delta-phi in degrees
+		return self
 
 
 	def en(self):
 		''' Card to mark end of input
 		'''
-		return "EN\n"
+		return ("EN", (), ())
 
 	# ---------------------------------------------------------------------------------------------------
 	# High-level geometry functions
 	# ---------------------------------------------------------------------------------------------------
 
+	def setSegmentation(self, maxMHz, segmentWavelengths=None, junctionRatio=None, odd=True):
+		''' Let addWire() and addArc() choose segment counts when given AUTO: the fewest that meet nec2's
+			segmentation guidelines up to maxMHz (see nec2segment), refining earlier AUTO wires as finer ones
+			are joined to them. segmentWavelengths is the longest segment allowed, junctionRatio the largest
+			length ratio of segments that meet, and odd keeps every count odd so middle feeds are centered.
+		'''
+		import nec2segment
+		self.segmentation = nec2segment.Segmenter(maxMHz,
+			nec2segment.SEGMENT_WAVELENGTHS if segmentWavelengths is None else segmentWavelengths,
+			nec2segment.JUNCTION_RATIO if junctionRatio is None else junctionRatio, odd=odd)
+		if len(self.wires):  # wires added before now keep their counts but count as neighbors
+			from nec2geometry import compileGeometry
+			geometry = compileGeometry(self)
+			first, last = geometry.cardRanges()
+			for a, b in zip(first, last):
+				self.segmentation.add(int(geometry.tags[a]), geometry.lengths[a:b].sum(), (geometry.starts[a], geometry.ends[b-1]), b - a)
+		return self
+
+	def segmentReport(self, maxMHz=None):
+		''' Return a nec2segment.SegmentReport checking every wire against the segmentation guidelines at
+			maxMHz (default the one given to setSegmentation()), with the total number of unknowns
+		'''
+		import nec2segment
+		if maxMHz is None:
+			if self.segmentation is None:
+				raise ValueError("segmentReport() needs maxMHz unless setSegmentation() was called")
+			maxMHz = self.segmentation.maxMHz
+		return nec2segment.segmentReport(self, maxMHz)
+
+	def _segments(self, segments, length, ends, minimum=1):
+		''' Record the wire or arc being added (tag self.tag) with the Segmenter, if there is one, and return
+			its segment count: the one given, or the Segmenter's choice for AUTO
+		'''
+		if self.segmentation is None:
+			if segments == AUTO:
+				raise ValueError("AUTO segments need setSegmentation() to be called first")
+			return segments
+		changed = self.segmentation.add(self.tag, length, ends, None if segments == AUTO else segments, minimum)
+		for tag, count in changed.items():
+			if tag != self.tag:
+				self._resegment(tag, count)
+		return changed.get(self.tag, segments)
+
+	def _resegment(self, tag, segments):
+		''' Change the segment count of an earlier wire or arc, moving an EX card on its middle segment to the
+			new middle
+		'''
+		row = self.tagRows[tag]
+		old = self.wires.card(row)[1][1]
+		self.wires.setInts(row, (tag, segments))
+		if self.EX_tag == tag and self.EX_segment == math.trunc(old/2) + 1:
+			self.EX_segment = math.trunc(segments/2) + 1
+
+	def _checkOpen(self):
+		if self.replicated:
+			raise ValueError("wires can't be added after replicate(), its GM card would copy them too")
+
 	def addWire(self, segments, pt1, pt2):
-		''' Append a wire, increment the tag number, and return this object to facilitate a chained attachToEX() call
+		''' Append a wire, increment the tag number, and return this object to facilitate a chained attachToEX() call.
+			segments may be AUTO (see setSegmentation()).
 		'''
+		self._checkOpen()
 		self.tag += 1
-		self.wires += self.gw(self.tag, segments, pt1.x, pt1.y, pt1.z, pt2.x, pt2.y, pt2.z, self.wireRadius)
+		if self.segmentation is not None or segments == AUTO:
+			length = math.sqrt((pt2.x - pt1.x)**2 + (pt2.y - pt1.y)**2 + (pt2.z - pt1.z)**2)
+			segments = self._segments(segments, length, ((pt1.x, pt1.y, pt1.z), (pt2.x, pt2.y, pt2.z)))
+		self.tagRows[self.tag] = self.wires.append(*self.gw(self.tag, segments, pt1.x, pt1.y, pt1.z, pt2.x, pt2.y, pt2.z, self.wireRadius))
 		self.flushTransformBuffer()
 		self.middle = math.trunc(segments/2) + 1
 		return self
@@ -216,26 +587,74 @@ class Model:
 	def addArc(self, segments, radius, start, end, rotate, translate):
 		''' Append an arc using a combination of a GA card (radius, start angle, end angle), a GM card to rotate
 			and translate the arc from the origin into it's correct location, and a second GM card to restore the
-			transformation matrix for cards that come after the arc.
+			transformation matrix for cards that come after the arc. segments may be AUTO (see setSegmentation()).
 		'''
 		# Place the arc in the XZ plane with its center on the origin
+		self._checkOpen()
 		self.tag += 1
-		self.wires += self.ga(self.tag, segments, radius, start, end, self.wireRadius)
+		if self.segmentation is not None or segments == AUTO:
+			from nec2segment import arcEnds
+			length = radius * math.radians(abs(end - start))
+			minimum = self.segmentation.arcMinimum(start, end) if self.segmentation is not None else 1
+			segments = self._segments(segments, length, arcEnds(radius, start, end, rotate, translate), minimum)
+		self.tagRows[self.tag] = self.wires.append(*self.ga(self.tag, segments, radius, start, end, self.wireRadius))
 		self.flushTransformBuffer()
 		self.middle = math.trunc(segments/2) + 1
 		# Move the arc to where it's supposed to be (note the tag #)
 		r = rotate
 		t = translate
-		self.transforms += self.gm(r.rx, r.ry, r.rz, t.x, t.y, t.z, self.tag)
+		self.transforms.append(*self.gm(r.rx, r.ry, r.rz, t.x, t.y, t.z, self.tag))
 		# Queue up the transforms to roll back the translation and rotation, using multiple gm cards to ensure
 		# that it really works (see GM card documentation about order of operations). This will restore the normal
 		# coordinate system if any elements are appended to the model after this arc, but the use of tag = n+1
 		# means it could break the nec2 parser if it's included without a GW or GA that actually uses tag n+1. The
 		# point of this buffering nonsense is to avoid triggering that parsing problem.
-		self.transformBuffer += self.gm(  0.0,   0.0,   0.0, -t.x, -t.y, -t.z, self.tag+1)
-		self.transformBuffer += self.gm(  0.0,   0.0, -r.rz,  0.0,  0.0,  0.0, self.tag+1)
-		self.transformBuffer += self.gm(  0.0, -r.ry,   0.0,  0.0,  0.0,  0.0, self.tag+1)
-		self.transformBuffer += self.gm(-r.rx,   0.0,   0.0,  0.0,  0.0,  0.0, self.tag+1)
+		self.transformBuffer.append(*self.gm(  0.0,   0.0,   0.0, -t.x, -t.y, -t.z, self.tag+1))
+		self.transformBuffer.append(*self.gm(  0.0,   0.0, -r.rz,  0.0,  0.0,  0.0, self.tag+1))
+		self.transformBuffer.append(*self.gm(  0.0, -r.ry,   0.0,  0.0,  0.0,  0.0, self.tag+1))
+		self.transformBuffer.append(*self.gm(-r.rx,   0.0,   0.0,  0.0,  0.0,  0.0, self.tag+1))
+		return self
+
+	def addWires(self, segments, starts, ends):
+		''' Append one wire per row of the (n, 3) arrays of start and end points, tagged in order, with the same
+			segments each, as a single block. Returns this object, with feedAtMiddle() applying to the last wire.
+		'''
+		if self.segmentation is not None or segments == AUTO or numpy is None:
+			for a, b in zip(starts, ends):
+				self.addWire(segments, Point(*a), Point(*b))
+			return self
+		self._checkOpen()
+		starts, ends = numpy.asarray(starts, dtype=float).reshape(-1, 3), numpy.asarray(ends, dtype=float).reshape(-1, 3)
+		tags = numpy.arange(self.tag + 1, self.tag + 1 + len(starts))
+		first = len(self.wires)
+		self.wires.appendColumns(['GW'] * len(tags), numpy.stack([tags, numpy.full(len(tags), segments)], axis=1),
+		                         numpy.concatenate([starts, ends, numpy.full((len(tags), 1), self.wireRadius)], axis=1))
+		self.tagRows.update(zip(tags.tolist(), range(first, first + len(tags))))
+		if len(tags):
+			self.tag = int(tags[-1])
+			self.flushTransformBuffer()
+			self.middle = math.trunc(segments/2) + 1
+		return self
+
+	def replicate(self, copies, rotate=None, translate=None, firstTag=None, tagIncrement=None):
+		''' Add copies more of the wires and arcs from tag firstTag (default the last one added) on, each one
+			moved from the one before by rotating it with rotate (a Rotation) and then translating it by
+			translate (a Point), using a single GM card instead of a card per wire. The copies' tags go up by
+			tagIncrement from one to the next, by default just enough to follow on from the last tag. Since
+			the GM cards are written after all the wires, the card would copy anything added later as well,
+			so nothing can be. Returns this object.
+		'''
+		if firstTag is None:
+			firstTag = self.tag
+		if copies < 1 or firstTag not in self.tagRows:
+			raise ValueError("replicate() needs at least one copy of tags that exist")
+		if tagIncrement is None:
+			tagIncrement = self.tag - firstTag + 1
+		r = rotate or Rotation(0.0, 0.0, 0.0)
+		t = translate or Point(0.0, 0.0, 0.0)
+		self.transforms.append(*self.gm(r.rx, r.ry, r.rz, t.x, t.y, t.z, firstTag, tagIncrement, copies))
+		self.tag += copies * tagIncrement
+		self.replicated = True
 		return self
 
 	def feedAtMiddle(self):
@@ -244,34 +663,129 @@ class Model:
 		self.EX_tag     = self.tag
 		self.EX_segment = self.middle
 
+	def getCard(self, tag):
+		''' Return the GW or GA card for the given tag as a (mnemonic, integer fields, float fields) tuple
+		'''
+		return self.wires.card(self.tagRows[tag])
+
+
+	def flatCards(self):
+		''' Return a CardStore of GW cards that describes the same segments as the GW/GA/GM cards, with every
+			transform baked into the coordinates. Wires keep their tag and segment count; each arc becomes a
+			chain of one segment GW cards sharing the arc's tag, so EX segment numbers still line up.
+		'''
+		from nec2geometry import compileGeometry
+		geometry = compileGeometry(self)
+		first, last = geometry.cardRanges()
+		isArc = (numpy.array(self.wires.names) == 'GA')[geometry.sources[first]]  # per wire, copies included
+		# One row per GW card, one row per segment of a GA card
+		rows  = numpy.sort(numpy.r_[first[~isArc], numpy.nonzero(isArc[geometry.cards])[0]])
+		ends  = numpy.where(isArc[geometry.cards[rows]], rows + 1, last[geometry.cards[rows]])
+		ints  = numpy.stack([geometry.tags[rows], ends - rows], axis=1)
+		floats = numpy.concatenate([geometry.starts[rows], geometry.ends[ends - 1], geometry.radii[rows, None]], axis=1)
+		# Rolling a rotation back leaves round-off like 1e-49 where the deck had 0.0, which is just noise
+		coords = floats[:, :6]
+		coords[numpy.abs(coords) < 1e-12 * numpy.abs(coords).max()] = 0.0
+		flat = CardStore()
+		flat.appendColumns(['GW'] * len(rows), ints, floats)
+		return flat
+
+	def reflection(self, tolerance=1e-6):
+		''' Return (CardStore of GW cards, GX card, EX tag, EX segment) that rebuild the structure from the part
+			of it on the feed's side of its planes of mirror symmetry, using as many planes as a GX card can,
+			or None if there are none it can use
+		'''
+		from nec2geometry import axesPlanes, compileGeometry, reflectedCards, symmetryPlanes
+		planes = symmetryPlanes(compileGeometry(self), tolerance)
+		flat = self.flatCards()
+		subsets = [tuple(a for i, a in enumerate(planes) if bits >> i & 1) for bits in range(1, 1 << len(planes))]
+		for axes in sorted(subsets, key=len, reverse=True):
+			found = reflectedCards(flat, self.EX_tag, self.EX_segment, axes, tolerance)
+			if found is not None:
+				names, ints, floats, tagIncrement, tag, segment = found
+				half = CardStore()
+				half.appendColumns(names, ints, floats)
+				return half, self.gx(tagIncrement, axesPlanes(axes)), tag, segment
+		return None
+
+	def iterText(self, start, stepSize=None, stepCount=None, flatten=False, reflect=False):
+		''' Generate the card stack a block at a time: GW/GA cards, then GM cards, then the GE/EX/FR/RP/EN footer.
+			With flatten, write the pre-transformed GW cards of flatCards() instead and no GM cards at all.
+			With reflect, a mirror symmetric structure is written as pre-transformed GW cards for one half (or
+			quarter, or eighth) of it and a GX card that reflects that into the whole (see reflection());
+			one without usable symmetry is written as usual. start may be a FrequencyList instead of the
+			parameters of one linear FR card, in which case each of its ranges gets its own FR and RP cards.
+		'''
+		exTag, exSegment = self.EX_tag, self.EX_segment
+		reflected = self.reflection() if reflect else None
+		if reflected is not None:
+			half, gx, exTag, exSegment = reflected
+			for text in half.iterText():
+				yield text
+			yield cardLine(*gx)
+		elif flatten:
+			for text in self.flatCards().iterText():
+				yield text
+		else:
+			for text in self.wires.iterText():
+				yield text
+			for text in self.transforms.iterText():
+				yield text
+		frequencies = start if isinstance(start, FrequencyList) else linearFrequencies(start, stepSize, stepCount)
+		footer = [self.ge(),
+		          self.ex(tag=exTag, segment=exSegment)]
+		for first, step, count, stepType in frequencies.ranges:
+			footer += [self.fr(first, step, count, stepType),
+			           self.rp()]
+		footer.append(self.en())
+		yield ''.join([cardLine(*card) for card in footer])
+
+	def writeTo(self, nec2File, start, stepSize=None, stepCount=None, flatten=False, reflect=False):
+		''' Stream the card stack to an open file without ever building the whole thing as one string
+		'''
+		for text in self.iterText(start, stepSize, stepCount, flatten, reflect):
+			nec2File.write(text)
 
-	def getText(self, start, stepSize, stepCount):
-		footer = self.ge()
-		footer += self.ex(tag=self.EX_tag, segment=self.EX_segment)
-		footer += self.fr(start, stepSize, stepCount)
-		footer += self.rp()
-		footer += self.en()
-		return self.wires + self.transforms + footer
+	def getText(self, start, stepSize=None, stepCount=None, flatten=False, reflect=False):
+		return ''.join(self.iterText(start, stepSize, stepCount, flatten, reflect))
 
 
 # =======================================================================================================
 # File I/O
 # =======================================================================================================
 
+def openCardFile(fileName, mode='r'):
+	''' Open a card stack file for text I/O, gzip compressed if the name ends in .gz
+	'''
+	if fileName.endswith('.gz'):
+		return gzip.open(fileName, mode + 't')
+	return open(fileName, mode, 1 << 16)
+
+
 def writeCardsToFile(fileName, comments, cardStack):
 	''' Write a NEC2 formatted card stack to the output file
 	'''
-	nec2File = open(fileName,'w')
+	nec2File = openCardFile(fileName, 'w')
 	nec2File.write(comments.strip() + "\n")
 	nec2File.write(cardStack.strip() + "\n")
 	nec2File.close()
 
 
-def copyCardFileToConsole(fileName):
-	''' Dump the card stack back to the console for a quick sanity check
+def writeModelToFile(fileName, comments, model, start, stepSize=None, stepCount=None, flatten=False, reflect=False):
+	''' Stream a model's card stack to the output file. Same output as writeCardsToFile(fileName, comments,
+		model.getText(start, stepSize, stepCount, flatten, reflect)), but memory use doesn't grow with the size of the
+		model.
 	'''
-	nec2File = open(fileName,'r')
-	print nec2File.read(),
+	nec2File = openCardFile(fileName, 'w')
+	nec2File.write(comments.strip() + "\n")
+	model.writeTo(nec2File, start, stepSize, stepCount, flatten, reflect)
 	nec2File.close()
 
 
+def copyCardFileToConsole(fileName):
+	''' Dump the card stack back to the console for a quick sanity check
+	'''
+	nec2File = openCardFile(fileName, 'r')
+	for line in nec2File:
+		sys.stdout.write(line)
+	nec2File.close()
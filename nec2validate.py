@@ -0,0 +1,308 @@
+'''
+Copyright 2012 Will Snook (http://willsnook.com)
+MIT License
+
+Geometry checks that catch modeling mistakes before a long solve turns them into garbage results. Works on
+compiled segments (nec2geometry.Geometry), so it covers Models and decks read from files alike, and flags:
+
+  - intersections: segments that cross or touch without being joined at their ends
+  - overlaps and near-coincident parallel wires, closer than PARALLEL_RADII wire radii
+  - segments too short for their wire radius (see nec2segment's LENGTH_TO_RADIUS guidelines)
+  - dangling ends: wire ends that aren't joined to anything but come within a segment length of another
+    wire, like an arc that just misses the wire it was meant to meet, or that land part way along a
+    segment, which nec2 doesn't treat as a junction
+
+Pairs of segments are only compared when they're near each other: every segment goes into the cells of a
+uniform grid that its bounding box (padded by how far apart two segments can be and still matter)
+overlaps, and candidate pairs come from segments sharing a cell. Cells are about the size of a typical
+segment, and segments much longer than that (a boom running through an array, say) are cut into pieces
+that each go into the few cells around them, so it's a sort plus a few comparisons per segment and 100k
+segment models take seconds.
+
+Usage:
+
+  report = nec2validate.validateModel(model)
+  sys.stdout.write(report.text())
+  report.errors()
+'''
+
+import numpy
+
+from nec2geometry import compileGeometry
+from nec2segment import LENGTH_TO_RADIUS, MIN_LENGTH_TO_RADIUS
+
+
+JUNCTION_TOLERANCE = 1e-3    # Ends closer than this times the shorter segment are joined (as in nec2solver.Mesh)
+PARALLEL_RADII     = 4.0     # Parallel segments closer than this many wire radii (center to center) are flagged
+PARALLEL_COSINE    = 0.999   # Segments whose directions are at least this aligned count as parallel
+NEAR_MISS          = 1.0     # Loose ends within this many segment lengths of another wire are flagged
+
+
+# =======================================================================================================
+# Issues
+# =======================================================================================================
+
+class Issue:
+	def __init__(self, severity, kind, segments, point, message):
+		''' One problem: severity 'error' or 'warning', kind ('intersection', 'overlap', 'parallel',
+			'thickness', 'dangling'), the indices of the segments involved in the compiled geometry, a point
+			where it is, and a description
+		'''
+		self.severity = severity
+		self.kind     = kind
+		self.segments = segments
+		self.point    = point
+		self.message  = message
+
+
+class ValidationReport:
+	def __init__(self, geometry, issues):
+		self.geometry = geometry
+		self.issues   = issues
+
+	def __len__(self):
+		return len(self.issues)
+
+	def __iter__(self):
+		return iter(self.issues)
+
+	def errors(self):
+		return [issue for issue in self.issues if issue.severity == 'error']
+
+	def warnings(self):
+		return [issue for issue in self.issues if issue.severity == 'warning']
+
+	def kinds(self):
+		''' Return {kind: number of issues}
+		'''
+		counts = {}
+		for issue in self.issues:
+			counts[issue.kind] = counts.get(issue.kind, 0) + 1
+		return counts
+
+	def describe(self, segment):
+		''' Return "tag T segment S" for a segment index
+		'''
+		return 'tag {} segment {}'.format(self.geometry.tags[segment], self.geometry.segments[segment])
+
+	def text(self, limit=100):
+		''' Return the issues as text, errors first, at most limit of them
+		'''
+		ordered = self.errors() + self.warnings()
+		lines = []
+		for issue in ordered[:limit]:
+			where = ' / '.join(self.describe(s) for s in issue.segments)
+			lines.append('{: <8}{: <13}{: <40} ({:.4f}, {:.4f}, {:.4f})  {}\n'.format(issue.severity, issue.kind, where,
+			             issue.point[0], issue.point[1], issue.point[2], issue.message))
+		if len(ordered) > limit:
+			lines.append('... and {} more\n'.format(len(ordered) - limit))
+		lines.append('{} segments: {} errors, {} warnings\n'.format(len(self.geometry), len(self.errors()), len(self.warnings())))
+		return ''.join(lines)
+
+
+# =======================================================================================================
+# Spatial index
+# =======================================================================================================
+
+def candidatePairs(starts, ends, reach):
+	''' Return (i, j) arrays, i < j, of every pair of segments whose bounding boxes, padded by reach (one
+		distance, or one per segment), overlap (plus some that don't), found through a uniform grid with
+		cells about the median padded box size. Segments longer than a cell are cut into pieces no longer
+		than one, so every piece's padded box spans at most 3 cells along each axis; the few segments padded
+		by more than half a cell are compared with every other segment directly instead.
+	'''
+	count = len(starts)
+	if count < 2:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	reach = numpy.broadcast_to(numpy.asarray(reach, dtype=float), (count,))
+	lengths = numpy.sqrt(((ends - starts)**2).sum(axis=1))
+	extents = numpy.abs(ends - starts).max(axis=1) + 2.0 * reach
+	# Cells no smaller than a quarter of the mean length either, which keeps pieces below 5 per segment,
+	# and big enough that only 1% of segments have to be compared directly
+	cell = max(numpy.median(extents), numpy.percentile(2.0 * reach, 99.0), lengths.sum() / (4.0 * count), 1e-12)
+	boxLow  = numpy.minimum(starts, ends) - reach[:, None]
+	boxHigh = numpy.maximum(starts, ends) + reach[:, None]
+	pairs = []
+	wide = 2.0 * reach > cell
+	for k in numpy.nonzero(wide)[0]:
+		other = numpy.nonzero(((boxLow <= boxHigh[k]) & (boxHigh >= boxLow[k])).all(axis=1))[0]
+		other = other[other != k]
+		pairs.append(numpy.minimum(other, k) * count + numpy.maximum(other, k))
+
+	segments = numpy.nonzero(~wide)[0]
+	pieces = numpy.maximum(numpy.ceil(lengths[segments] / cell).astype(numpy.int64), 1)
+	owners = numpy.repeat(segments, pieces)
+	local  = numpy.arange(len(owners)) - numpy.repeat(numpy.cumsum(pieces) - pieces, pieces)
+	t0 = (local / numpy.repeat(pieces, pieces).astype(float))[:, None]
+	t1 = ((local + 1) / numpy.repeat(pieces, pieces).astype(float))[:, None]
+	a = starts[owners] + (ends - starts)[owners] * t0
+	b = starts[owners] + (ends - starts)[owners] * t1
+	low  = numpy.minimum(a, b) - reach[owners, None]
+	high = numpy.maximum(a, b) + reach[owners, None]
+	if len(owners):
+		origin = low.min(axis=0)
+		first = numpy.floor((low - origin) / cell).astype(numpy.int64)
+		last  = numpy.floor((high - origin) / cell).astype(numpy.int64)
+		span  = last.max(axis=0) + 3
+
+		# (cell, segment) entries for the 1 to 27 cells each piece's box overlaps
+		keys, entries = [], []
+		for dx in (0, 1, 2):
+			for dy in (0, 1, 2):
+				for dz in (0, 1, 2):
+					c = first + (dx, dy, dz)
+					inside = (c <= last).all(axis=1)
+					keys.append(((c[inside, 0] * span[1]) + c[inside, 1]) * span[2] + c[inside, 2])
+					entries.append(owners[inside])
+		keys, owners = numpy.concatenate(keys), numpy.concatenate(entries)
+		order = numpy.lexsort((owners, keys))
+		keys, owners = keys[order], owners[order]
+
+		# Pair every entry with the ones after it in the same cell
+		offset = 1
+		while offset < len(keys):
+			same = numpy.nonzero(keys[offset:] == keys[:-offset])[0]
+			if not len(same):
+				break
+			same = same[owners[same] != owners[same + offset]]  # two pieces of one segment
+			pairs.append(owners[same] * count + owners[same + offset])
+			offset += 1
+	if not pairs:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	codes = numpy.unique(numpy.concatenate(pairs))
+	return codes // count, codes % count
+
+
+def segmentDistances(p1, q1, p2, q2):
+	''' Return (distance, s, t) for pairs of segments p1-q1 and p2-q2 (arrays of points): the shortest
+		distance between them and where it's reached, as fractions s and t along each
+	'''
+	d1, d2, r = q1 - p1, q2 - p2, p1 - p2
+	a = numpy.maximum((d1 * d1).sum(axis=1), 1e-300)
+	e = numpy.maximum((d2 * d2).sum(axis=1), 1e-300)
+	b, c, f = (d1 * d2).sum(axis=1), (d1 * r).sum(axis=1), (d2 * r).sum(axis=1)
+	denominator = a * e - b * b
+	s = numpy.where(denominator > 1e-12 * a * e, numpy.clip((b * f - c * e) / numpy.where(denominator > 0.0, denominator, 1.0), 0.0, 1.0), 0.0)
+	t = (b * s + f) / e
+	s = numpy.where(t < 0.0, numpy.clip(-c / a, 0.0, 1.0), numpy.where(t > 1.0, numpy.clip((b - c) / a, 0.0, 1.0), s))
+	t = numpy.clip(t, 0.0, 1.0)
+	distance = numpy.sqrt((((p1 + d1 * s[:, None]) - (p2 + d2 * t[:, None]))**2).sum(axis=1))
+	return distance, s, t
+
+
+def pointDistances(points, starts, ends):
+	''' Return (distance, t) from each point to the segment starts-ends paired with it, t the fraction along
+		the segment of the nearest point
+	'''
+	d = ends - starts
+	t = numpy.clip(((points - starts) * d).sum(axis=1) / numpy.maximum((d * d).sum(axis=1), 1e-300), 0.0, 1.0)
+	return numpy.sqrt(((starts + d * t[:, None] - points)**2).sum(axis=1)), t
+
+
+# =======================================================================================================
+# Validation
+# =======================================================================================================
+
+def validateGeometry(geometry, junctionTolerance=JUNCTION_TOLERANCE, parallelRadii=PARALLEL_RADII, nearMiss=NEAR_MISS):
+	''' Check a compiled nec2geometry.Geometry and return a ValidationReport
+	'''
+	issues = []
+	starts, ends, radii, lengths = geometry.starts, geometry.ends, geometry.radii, geometry.lengths
+	count = len(geometry)
+
+	# Segments too short for their radius
+	ratio = lengths / numpy.where(radii > 0.0, radii, 1e-300)
+	for k in numpy.nonzero(ratio < LENGTH_TO_RADIUS)[0]:
+		severity = 'error' if ratio[k] < MIN_LENGTH_TO_RADIUS else 'warning'
+		issues.append(Issue(severity, 'thickness', (k,), geometry.centers[k],
+		                    'length is {:.2f} wire radii, needs {:g}'.format(ratio[k], LENGTH_TO_RADIUS)))
+	if count < 2:
+		return ValidationReport(geometry, issues)
+
+	# Segments are only checked against the ones within a few of their wire radii
+	i, j = candidatePairs(starts, ends, max(parallelRadii, 1.0) * radii)
+
+	# Pairs joined at their ends (along a wire or at a junction) are supposed to touch
+	tolerance = junctionTolerance * numpy.minimum(lengths[i], lengths[j])
+	ends_i, ends_j = (starts[i], ends[i]), (starts[j], ends[j])
+	joined = numpy.zeros(len(i), dtype=bool)
+	for a in ends_i:
+		for b in ends_j:
+			joined |= numpy.sqrt(((a - b)**2).sum(axis=1)) <= tolerance
+	# and so are nearby segments of one wire that's thicker than its segments are long (flagged above)
+	gap = (numpy.abs(i - j) - 1) * numpy.minimum(lengths[i], lengths[j])
+	joined |= (geometry.cards[i] == geometry.cards[j]) & (gap <= radii[i] + radii[j])
+	i, j, tolerance = i[~joined], j[~joined], tolerance[~joined]
+
+	# Crossing, overlapping and close parallel segments
+	distance, s, t = segmentDistances(starts[i], ends[i], starts[j], ends[j])
+	cosine = numpy.abs((geometry.units[i] * geometry.units[j]).sum(axis=1))
+	parallel = cosine >= PARALLEL_COSINE
+	axis = ends[i] - starts[i]
+	u = ((starts[j] - starts[i]) * axis).sum(axis=1) / numpy.maximum((axis * axis).sum(axis=1), 1e-300)
+	v = ((ends[j] - starts[i]) * axis).sum(axis=1) / numpy.maximum((axis * axis).sum(axis=1), 1e-300)
+	sideBySide = numpy.minimum(1.0, numpy.maximum(u, v)) - numpy.maximum(0.0, numpy.minimum(u, v)) > 1e-6
+	touching = distance <= radii[i] + radii[j]
+	close = parallel & sideBySide & (distance < parallelRadii * numpy.maximum(radii[i], radii[j]))
+	for k in numpy.nonzero(touching | close)[0]:
+		point = starts[i[k]] + s[k] * axis[k]
+		if touching[k] and parallel[k] and sideBySide[k]:
+			issues.append(Issue('error', 'overlap', (i[k], j[k]), point, 'parallel segments {:.3g} m apart overlap'.format(distance[k])))
+		elif touching[k]:
+			issues.append(Issue('error', 'intersection', (i[k], j[k]), point,
+			                    'segments {:.3g} m apart cross without a junction'.format(distance[k])))
+		else:
+			issues.append(Issue('warning', 'parallel', (i[k], j[k]), point,
+			                    'parallel segments only {:.2f} wire radii apart'.format(distance[k] / max(radii[i[k]], radii[j[k]]))))
+
+	issues += _danglingEnds(geometry, junctionTolerance, nearMiss)
+	return ValidationReport(geometry, issues)
+
+
+def _danglingEnds(geometry, junctionTolerance, nearMiss):
+	''' Return Issues for wire ends that aren't joined to another segment's end but are near another segment
+	'''
+	first, last = geometry.cardRanges()
+	points   = numpy.concatenate([geometry.starts[first], geometry.ends[last - 1]])
+	segments = numpy.r_[first, last - 1]
+	# Candidate segments for each end, from the grid with the end as a zero length segment reaching as far
+	# as a near miss can be
+	count = len(geometry)
+	reach = numpy.r_[numpy.zeros(count), max(nearMiss, junctionTolerance) * geometry.lengths[segments]]
+	i, j = candidatePairs(numpy.concatenate([geometry.starts, points]), numpy.concatenate([geometry.ends, points]), reach)
+	isEnd = j >= count
+	e, other = j[isEnd] - count, i[isEnd]
+	keep = other < count
+	e, other = e[keep], other[keep]
+	mine = segments[e]
+	tolerance = junctionTolerance * numpy.minimum(geometry.lengths[mine], geometry.lengths[other])
+	endDistance = numpy.minimum(numpy.sqrt(((points[e] - geometry.starts[other])**2).sum(axis=1)),
+	                            numpy.sqrt(((points[e] - geometry.ends[other])**2).sum(axis=1)))
+	joined = numpy.zeros(len(points), dtype=bool)
+	joined[e[(endDistance <= tolerance) & (other != mine)]] = True
+
+	# The nearest other wire to each loose end, leaving out wires running alongside (see the parallel check)
+	# but not ones carrying on in line with it
+	sameCard = geometry.cards[other] == geometry.cards[mine]
+	distance, t = pointDistances(points[e], geometry.starts[other], geometry.ends[other])
+	offset = points[e] - geometry.starts[other]
+	lateral = numpy.sqrt(numpy.maximum((offset**2).sum(axis=1) - ((offset * geometry.units[other]).sum(axis=1))**2, 0.0))
+	alongside = (numpy.abs((geometry.units[mine] * geometry.units[other]).sum(axis=1)) >= PARALLEL_COSINE) & (lateral > tolerance)
+	loose = ~joined[e] & ~sameCard & ~alongside & (distance < nearMiss * geometry.lengths[mine])
+	issues, reported = [], set()
+	for k in numpy.nonzero(loose)[0][numpy.argsort(distance[loose], kind='stable')]:
+		if e[k] in reported:
+			continue
+		reported.add(e[k])
+		if distance[k] <= tolerance[k]:
+			message = 'wire end lands {:.0%} along another segment; nec2 only joins wires at segment ends'.format(t[k])
+		else:
+			message = 'wire end misses another wire by {:.3g} m'.format(distance[k])
+		issues.append(Issue('error', 'dangling', (mine[k], other[k]), points[e[k]], message))
+	return issues
+
+
+def validateModel(model, **options):
+	''' Check the geometry of a nec2utils.Model, see validateGeometry()
+	'''
+	return validateGeometry(compileGeometry(model), **options)